@@ -16,5 +16,6 @@ setup(name="vlab-gateway-api",
       description="A service for creating a network gateway in vLab",
       long_description=open('README.rst').read(),
       install_requires=['flask', 'pyjwt', 'uwsgi', 'vlab-api-common', 'ujson',
-                        'cryptography', 'celery', 'vlab-inf-common']
+                        'cryptography', 'celery', 'vlab-inf-common', 'requests',
+                        'msgpack', 'prometheus-client']
       )
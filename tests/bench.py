@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmark the API and workers, end to end, against the fake vCenter.
+
+Every simulated user creates, shows, and deletes a gateway via the API, many
+times over. Tasks run in the same process as the API, so the numbers include
+the API, the shared store, and the worker code, but not the message broker.
+How long vCenter takes is set by ``--latency`` (per SOAP call) and
+``--task-time`` (per vCenter task); so a change can be checked for how many
+round trips it saves, not just how fast it runs with an idle vCenter.
+
+Usage::
+
+    python -m tests.bench --users 20 --iterations 5 --latency 0.005
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import collections
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+from flask import Flask
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_gateway_api.lib import cache
+from vlab_gateway_api.lib.views import gateway_view
+from vlab_gateway_api.lib.worker import tasks, admission
+from tests.fake_vcenter import FakeServer, simulate
+
+
+OPERATIONS = ('create', 'show', 'delete')
+
+
+class EagerCelery(object):
+    """Runs a task as soon as the API sends it, in the same thread
+
+    :param app: **Required** The Celery app that defines the tasks
+    :type app: celery.Celery
+    """
+    def __init__(self, app):
+        self._app = app
+
+    def send_task(self, name, args, task_id=None, **kwargs):
+        return self._app.tasks[name].apply(args=args, task_id=task_id)
+
+    def AsyncResult(self, task_id):
+        return self._app.AsyncResult(task_id)
+
+
+def parse_args(argv):
+    """Define the command line options
+
+    :Returns: argparse.Namespace
+
+    :param argv: The command line arguments
+    :type argv: List
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=10, help='How many users to simulate')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='How many times each user creates, shows, and deletes a gateway')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='How many users run at once; defaults to all of them')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per call to vCenter')
+    parser.add_argument('--task-time', type=float, default=0.0,
+                        help='Seconds for vCenter to deploy, power off, destroy, or reconfigure a VM')
+    parser.add_argument('--boot-time', type=float, default=0.0, help='Seconds for a new gateway to boot')
+    parser.add_argument('--admission', action='store_true',
+                        help='Enforce the admission limits, instead of admitting every task')
+    return parser.parse_args(argv)
+
+
+def run_user(client, username, iterations, latencies):
+    """Create, show, and delete one user's gateway, over and over
+
+    :Returns: None
+
+    :param client: The API to call
+    :type client: flask.testing.FlaskClient
+
+    :param username: The user to simulate
+    :type username: String
+
+    :param iterations: How many times to run the lifecycle
+    :type iterations: Integer
+
+    :param latencies: Where to record how long each operation took
+    :type latencies: collections.defaultdict
+    """
+    headers = {'X-Auth': generate_v2_test_token(username=username)}
+    body = ujson.dumps({'wan': 'frontend', 'lan': 'lan'})
+    for _ in range(iterations):
+        for operation in OPERATIONS:
+            started = time.time()
+            if operation == 'create':
+                resp = client.post('/api/2/inf/gateway', headers=headers, data=body,
+                                   content_type='application/json')
+            elif operation == 'show':
+                resp = client.get('/api/2/inf/gateway', headers=headers)
+            else:
+                resp = client.delete('/api/2/inf/gateway', headers=headers)
+            if resp.status_code == 202:
+                task_id = resp.json['content']['task-id']
+                resp = client.get('/api/2/inf/gateway/task/{}'.format(task_id), headers=headers)
+            latencies[operation].append(time.time() - started)
+            if resp.status_code != 200 or resp.json.get('error'):
+                raise RuntimeError('{} failed for {}: {}'.format(operation, username, resp.data))
+
+
+def summarize(latencies, elapsed, calls):
+    """Format the results of a run
+
+    :Returns: String
+
+    :param latencies: How long each operation took
+    :type latencies: Dictionary
+
+    :param elapsed: The wall clock seconds of the whole run
+    :type elapsed: Float
+
+    :param calls: How many times each vCenter method/property was called
+    :type calls: collections.Counter
+    """
+    total = sum(len(x) for x in latencies.values())
+    lines = ['{:<8} {:>6} {:>9} {:>9} {:>9}'.format('op', 'count', 'p50 ms', 'p99 ms', 'max ms')]
+    for operation in OPERATIONS:
+        ordered = sorted(latencies[operation])
+        if not ordered:
+            continue
+        lines.append('{:<8} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}'.format(operation,
+                                                                  len(ordered),
+                                                                  ordered[len(ordered) // 2] * 1000,
+                                                                  ordered[int(len(ordered) * 0.99)] * 1000,
+                                                                  ordered[-1] * 1000))
+    lines.append('')
+    lines.append('{} operations in {:.2f} seconds ({:.1f} ops/sec)'.format(total, elapsed, total / elapsed))
+    lines.append('{:.1f} vCenter calls per operation'.format(sum(calls.values()) / max(total, 1)))
+    lines.append('Busiest vCenter calls: {}'.format(', '.join('{}={}'.format(*x) for x in calls.most_common(5))))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Run the benchmark
+
+    :Returns: Integer - The exit code
+    """
+    args = parse_args(argv)
+    logging.disable(logging.CRITICAL)
+    users = ['benchuser{}'.format(x) for x in range(args.users)]
+    task_time = {x: args.task_time for x in ('PowerOffVM_Task', 'Destroy_Task', 'ReconfigVM_Task', 'deploy')}
+    server = FakeServer(latency=args.latency, task_time=task_time, boot_time=args.boot_time,
+                        networks=['frontend'] + ['{}_lan'.format(x) for x in users])
+    for username in users:
+        server.add_user(username)
+
+    app = Flask(__name__)
+    gateway_view.GatewayView.register(app)
+    app.celery_app = EagerCelery(tasks.app)
+    app.config['TESTING'] = True
+    client = app.test_client()
+
+    tmp_dir = tempfile.mkdtemp()
+    patches = [patch.object(cache, 'STORE', cache.Store(os.path.join(tmp_dir, 'bench.db')))]
+    if not args.admission:
+        patches.append(patch.dict(admission.LIMITS, {x: (0, 0) for x in admission.LIMITS}))
+    latencies = collections.defaultdict(list)
+    # So the API can look up the results of tasks that ran eagerly
+    store_eager_result = tasks.app.conf.task_store_eager_result
+    tasks.app.conf.task_store_eager_result = True
+    try:
+        for a_patch in patches:
+            a_patch.start()
+        with simulate(server):
+            started = time.time()
+            with ThreadPoolExecutor(max_workers=args.concurrency or len(users)) as executor:
+                futures = [executor.submit(run_user, client, x, args.iterations, latencies) for x in users]
+                for future in futures:
+                    future.result()
+            elapsed = time.time() - started
+    finally:
+        tasks.app.conf.task_store_eager_result = store_eager_result
+        for a_patch in reversed(patches):
+            a_patch.stop()
+        shutil.rmtree(tmp_dir)
+    print(summarize(latencies, elapsed, server.calls))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
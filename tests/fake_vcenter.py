@@ -0,0 +1,532 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-process stand-in for vCenter, so the worker code can be run (and timed)
+without a real vCenter.
+
+pyVmomi objects send every method call and property read to their "stub";
+``FakeServer`` is that stub. The objects are real ``vim`` objects, so code
+that checks their types works, and every call counts as a round trip (and
+sleeps for the configured latency), like it would with a real vCenter.
+
+Only what this project uses is simulated: folders, networks, VMs, the
+PropertyCollector, guest operations, and the ``PowerOffVM_Task``,
+``Destroy_Task`` and ``ReconfigVM_Task`` tasks. Deploying an OVA and
+``get_info`` are simulated at the ``vlab_inf_common`` function level, because
+they need an OVA file, ESXi hosts, and a console; see ``simulate``.
+"""
+import re
+import time
+import datetime
+import itertools
+import threading
+import collections
+from types import SimpleNamespace
+from contextlib import contextmanager, ExitStack
+from unittest.mock import patch
+
+import ujson
+from pyVmomi import vim, vmodl
+from vlab_inf_common.vmware import vCenter
+
+from vlab_gateway_api.lib import const
+from vlab_gateway_api.lib.worker import vmware, provision, readiness
+
+
+# How many seconds vCenter takes to finish each kind of task
+DEFAULT_TASK_TIME = {'PowerOffVM_Task': 0, 'Destroy_Task': 0, 'ReconfigVM_Task': 0, 'deploy': 0}
+
+
+class FakeServer(object):
+    """An in-memory vCenter.
+
+    :param latency: The seconds every call to vCenter takes; either a number,
+                    or a mapping of call name (like "WaitForUpdatesEx" or
+                    "get:name") to seconds, with "default" for everything else
+    :type latency: Float or Dictionary
+
+    :param task_time: How many seconds vCenter takes to finish each kind of task
+    :type task_time: Dictionary
+
+    :param boot_time: How many seconds a new VM takes to boot
+    :type boot_time: Float
+
+    :param reboot_time: How many seconds a VM is down for when it's rebooted;
+                        if it's shorter than the gap between the worker asking
+                        for a reboot and checking on it, the worker waits
+                        ``VLAB_GATEWAY_SHUTDOWN_TIMEOUT`` for a reboot it missed
+    :type reboot_time: Float
+
+    :param networks: The names of the networks to create
+    :type networks: List
+
+    :param poll: How many seconds the worker waits between checks on a booting VM
+    :type poll: Float
+    """
+    def __init__(self, latency=0, task_time=None, boot_time=0, reboot_time=0.5, networks=(), poll=0.01):
+        self.latency = latency
+        self.task_time = dict(DEFAULT_TASK_TIME, **(task_time or {}))
+        self.boot_time = boot_time
+        self.reboot_time = reboot_time
+        self.poll = poll
+        # How many times each method/property was called
+        self.calls = collections.Counter()
+        self.guest_files = {}
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._entities = {}
+        self._collectors = {}
+        self._views = {}
+        self._pending = []
+        self._processes = {}
+        self._transfers = {}
+        self.root_folder = self._add(vim.Folder, name='Datacenters', parent=None)
+        self.datacenter = self._add(vim.Datacenter, name='Datacenter', parent=self.root_folder)
+        self.vm_folder = self._add(vim.Folder, name='vm', parent=self.datacenter)
+        self.network_folder = self._add(vim.Folder, name='network', parent=self.datacenter)
+        self.property_collector = vmodl.query.PropertyCollector('propertyCollector', self)
+        self.content = SimpleNamespace(rootFolder=self.root_folder,
+                                       propertyCollector=self.property_collector,
+                                       viewManager=vim.view.ViewManager('ViewManager', self),
+                                       sessionManager=vim.SessionManager('SessionManager', self),
+                                       guestOperationsManager=vim.vm.guest.GuestOperationsManager('guestOperationsManager', self))
+        self.top_folder = self.make_folders(const.INF_VCENTER_TOP_LVL_DIR)
+        for name in networks:
+            self.add_network(name)
+
+    # -- Setting up the inventory ---------------------------------------------
+
+    def make_folders(self, path):
+        """Create every folder in a path, under the datacenter's VM folder
+
+        :Returns: vim.Folder - The last folder in the path
+        """
+        folder = self.vm_folder
+        for name in [x for x in path.split('/') if x]:
+            child = self._find(vim.Folder, name, parent=folder)
+            folder = child or self._add(vim.Folder, name=name, parent=folder)
+        return folder
+
+    def add_user(self, username):
+        """Create the folder for a user's VMs
+
+        :Returns: vim.Folder
+        """
+        return self.make_folders('{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR, username))
+
+    def add_network(self, name):
+        """Create a network
+
+        :Returns: vim.Network
+        """
+        return self._add(vim.Network, name=name, parent=self.network_folder)
+
+    def add_vm(self, folder, name, annotation=None, powered_on=True):
+        """Create a VM, as if it was just deployed
+
+        :Returns: vim.VirtualMachine
+
+        :param folder: The folder to create the VM in
+        :type folder: vim.Folder
+        """
+        the_vm = self._add(vim.VirtualMachine, name=name, parent=folder)
+        entity = self._entities[the_vm._moId]
+        entity.props['config.annotation'] = annotation
+        entity.props['runtime.powerState'] = 'poweredOn' if powered_on else 'poweredOff'
+        entity.ready_at = time.time() + self.boot_time
+        return the_vm
+
+    def vms(self, folder):
+        """Obtain the VMs in a folder
+
+        :Returns: List of vim.VirtualMachine
+        """
+        with self._lock:
+            self._advance()
+            return [x.obj for x in self._entities.values()
+                    if x.kind is vim.VirtualMachine and x.props.get('parent') == folder]
+
+    # -- Simulated vlab_inf_common functions ----------------------------------
+
+    def deploy_from_ova(self, vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+        """Stands in for ``virtual_machine.deploy_from_ova``
+
+        :Returns: vim.VirtualMachine
+        """
+        self._call('deploy')
+        time.sleep(self.task_time['deploy'])
+        with self._lock:
+            folder = self._find(vim.Folder, username)
+            if folder is None:
+                raise RuntimeError('No folder named {}'.format(username))
+            return self.add_vm(folder, machine_name, powered_on=power_on)
+
+    def get_info(self, vcenter, the_vm, username, ensure_ip=False, ensure_timeout=600):
+        """Stands in for ``virtual_machine.get_info``
+
+        :Returns: Dictionary
+        """
+        try:
+            meta = ujson.loads(the_vm.config.annotation)
+        except (ValueError, TypeError):
+            meta = {'component': 'Unknown', 'created': 0, 'version': 'Unknown',
+                    'generation': 0, 'configured': False}
+        return {'state': the_vm.runtime.powerState,
+                'console': 'https://fake-vcenter/console/{}'.format(the_vm._moId),
+                'ips': ['192.0.2.{}'.format(int(the_vm._moId.split('-')[1]) % 254 + 1)],
+                'networks': [],
+                'moid': the_vm._moId,
+                'meta': meta}
+
+    # -- The pyVmomi stub interface -------------------------------------------
+
+    def InvokeMethod(self, mo, info, args):
+        """Called by pyVmomi for every method call"""
+        name = info.wsdlName
+        self._call(name)
+        handler = getattr(self, '_do_{}'.format(name), None)
+        if handler is None:
+            raise NotImplementedError('The fake vCenter does not support {}'.format(name))
+        with self._lock:
+            self._advance()
+        return handler(mo, **dict(zip([x.name for x in info.params], args)))
+
+    def InvokeAccessor(self, mo, info):
+        """Called by pyVmomi for every property read"""
+        self._call('get:{}'.format(info.name))
+        with self._lock:
+            self._advance()
+            return self._read(mo, info.name)
+
+    # -- Internals ------------------------------------------------------------
+
+    def _call(self, name):
+        """Count a round trip to vCenter, and wait as long as it takes"""
+        with self._lock:
+            self.calls[name] += 1
+        if isinstance(self.latency, dict):
+            delay = self.latency.get(name, self.latency.get('default', 0))
+        else:
+            delay = self.latency
+        if delay:
+            time.sleep(delay)
+
+    def _add(self, kind, **props):
+        """Create a managed object"""
+        with self._lock:
+            moid = '{}-{}'.format(kind.__name__.split('.')[-1].lower(), next(self._ids))
+            obj = kind(moid, self)
+            self._entities[moid] = _Entity(obj, kind, props)
+            return obj
+
+    def _find(self, kind, name, parent=None):
+        """Find a managed object by name"""
+        for entity in self._entities.values():
+            if entity.kind is kind and entity.props.get('name') == name:
+                if parent is None or entity.props.get('parent') == parent:
+                    return entity.obj
+        return None
+
+    def _children(self, parent):
+        """Obtain every object directly within a folder/datacenter"""
+        return [x.obj for x in self._entities.values() if x.props.get('parent') == parent]
+
+    def _within(self, entity, container):
+        """Determine if an object is (recursively) within a container"""
+        parent = entity.props.get('parent')
+        while parent is not None:
+            if parent == container:
+                return True
+            parent = self._entities[parent._moId].props.get('parent')
+        return False
+
+    def _start_task(self, method, effect):
+        """Create a vCenter task that runs ``effect`` once it's done.
+
+        ``effect`` returns a fault if the task failed.
+        """
+        task = self._add(vim.Task, **{'info.state': 'running', 'info.error': None})
+        self._pending.append((time.time() + self.task_time.get(method, 0), task._moId, effect))
+        return task
+
+    def _advance(self):
+        """Finish every task that has run long enough"""
+        now = time.time()
+        pending = []
+        for done_at, moid, effect in self._pending:
+            if done_at > now:
+                pending.append((done_at, moid, effect))
+                continue
+            fault = effect()
+            props = self._entities[moid].props
+            props['info.error'] = fault
+            props['info.state'] = 'error' if fault else 'success'
+            props['info.completeTime'] = datetime.datetime.now()
+        self._pending = pending
+
+    def _read(self, mo, name):
+        """Read a property of a managed object"""
+        moid = mo._moId
+        if moid == 'ServiceInstance' or moid == 'SessionManager':
+            return {'currentSession': 'fake-session'}.get(name)
+        if moid == 'guestOperationsManager':
+            if name == 'fileManager':
+                return vim.vm.guest.FileManager('guestOperationsFileManager', self)
+            return vim.vm.guest.ProcessManager('guestOperationsProcessManager', self)
+        if moid in self._views:
+            container, types = self._views[moid]
+            return [x.obj for x in self._entities.values()
+                    if issubclass(x.kind, tuple(types)) and self._within(x, container)]
+        entity = self._entities[moid]
+        if name in entity.props:
+            return entity.props[name]
+        if name == 'childEntity':
+            return self._children(mo)
+        if name == 'vmFolder':
+            return self.vm_folder
+        if name == 'networkFolder':
+            return self.network_folder
+        if name == 'config':
+            return SimpleNamespace(annotation=entity.props.get('config.annotation'))
+        if name == 'runtime':
+            return SimpleNamespace(powerState=entity.props.get('runtime.powerState'))
+        if name == 'guest':
+            return SimpleNamespace(guestOperationsReady=self._guest_ready(entity))
+        if name == 'guestHeartbeatStatus':
+            return 'green' if self._guest_ready(entity) else 'gray'
+        if name == 'info':
+            return SimpleNamespace(state=entity.props['info.state'],
+                                   error=entity.props['info.error'],
+                                   completeTime=entity.props.get('info.completeTime'),
+                                   result=None)
+        raise NotImplementedError('The fake vCenter does not support reading {}'.format(name))
+
+    def _guest_ready(self, entity):
+        """Determine if VMware Tools would be running in a VM"""
+        return entity.props.get('runtime.powerState') == 'poweredOn' and time.time() >= entity.ready_at
+
+    def _snapshot(self, spec):
+        """Read the properties a PropertyCollector filter watches
+
+        :Returns: Dictionary - moId -> (object, {property path: value})
+        """
+        objs = []
+        for obj_spec in spec.objectSet:
+            if obj_spec.obj._moId in self._views:
+                objs.extend(self._read(obj_spec.obj, 'view'))
+            if not obj_spec.skip and obj_spec.obj._moId in self._entities:
+                objs.append(obj_spec.obj)
+        snapshot = {}
+        for obj in objs:
+            entity = self._entities[obj._moId]
+            for prop_spec in spec.propSet:
+                if issubclass(entity.kind, prop_spec.type):
+                    snapshot[obj._moId] = (obj, {x: entity.props.get(x) for x in prop_spec.pathSet})
+        return snapshot
+
+    def _do_RetrieveServiceContent(self, mo):
+        return self.content
+
+    def _do_CreatePropertyCollector(self, mo):
+        with self._lock:
+            collector = vmodl.query.PropertyCollector('session[{}]'.format(next(self._ids)), self)
+            self._collectors[collector._moId] = {'specs': [], 'sent': {}, 'version': 0}
+            return collector
+
+    def _do_DestroyPropertyCollector(self, mo):
+        with self._lock:
+            self._collectors.pop(mo._moId, None)
+
+    def _do_CreateFilter(self, mo, spec, partialUpdates):
+        with self._lock:
+            self._collectors[mo._moId]['specs'].append(spec)
+            return vmodl.query.PropertyCollector.Filter('filter-{}'.format(next(self._ids)), self)
+
+    def _do_WaitForUpdatesEx(self, mo, version, options):
+        max_wait = options.maxWaitSeconds if options and options.maxWaitSeconds is not None else 60
+        deadline = time.time() + max_wait
+        while True:
+            with self._lock:
+                self._advance()
+                result = self._updates(self._collectors[mo._moId], version)
+            if result is not None or time.time() >= deadline:
+                return result
+            time.sleep(min(0.01, max(deadline - time.time(), 0)))
+
+    def _updates(self, collector, version):
+        """Diff what a collector watches against what it last sent"""
+        if version != str(collector['version']):
+            collector['sent'] = {}
+        current = {}
+        for spec in collector['specs']:
+            current.update(self._snapshot(spec))
+        updates = []
+        for moid, (obj, props) in current.items():
+            sent = collector['sent'].get(moid)
+            if sent is None:
+                changes = props
+                kind = 'enter'
+            else:
+                changes = {k: v for k, v in props.items() if sent.get(k) != v}
+                kind = 'modify'
+            if changes:
+                change_set = [vmodl.query.PropertyCollector.Change(name=k, op='assign', val=v) for k, v in changes.items()]
+                updates.append(vmodl.query.PropertyCollector.ObjectUpdate(obj=obj, kind=kind, changeSet=change_set))
+        for moid in set(collector['sent']) - set(current):
+            obj = self._entities[moid].obj if moid in self._entities else vim.ManagedEntity(moid, self)
+            updates.append(vmodl.query.PropertyCollector.ObjectUpdate(obj=obj, kind='leave', changeSet=[]))
+        if not updates and version == str(collector['version']):
+            return None
+        collector['sent'] = {k: v[1] for k, v in current.items()}
+        collector['version'] += 1
+        filter_set = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+        return vmodl.query.PropertyCollector.UpdateSet(version=str(collector['version']),
+                                                       filterSet=[filter_set],
+                                                       truncated=False)
+
+    def _do_CreateContainerView(self, mo, container, type, recursive):
+        with self._lock:
+            view = vim.view.ContainerView('session[{}]'.format(next(self._ids)), self)
+            self._views[view._moId] = (container, type)
+            return view
+
+    def _do_DestroyView(self, mo):
+        with self._lock:
+            self._views.pop(mo._moId, None)
+
+    def _do_PowerOffVM_Task(self, mo):
+        def effect():
+            props = self._entities[mo._moId].props
+            if props['runtime.powerState'] == 'poweredOff':
+                return vim.fault.InvalidPowerState(msg='The VM is already powered off')
+            props['runtime.powerState'] = 'poweredOff'
+            return None
+        with self._lock:
+            return self._start_task('PowerOffVM_Task', effect)
+
+    def _do_Destroy_Task(self, mo):
+        def effect():
+            if self._entities[mo._moId].props['runtime.powerState'] != 'poweredOff':
+                return vim.fault.InvalidPowerState(msg='The VM is powered on')
+            del self._entities[mo._moId]
+            return None
+        with self._lock:
+            return self._start_task('Destroy_Task', effect)
+
+    def _do_ReconfigVM_Task(self, mo, spec):
+        def effect():
+            if spec.annotation is not None:
+                self._entities[mo._moId].props['config.annotation'] = spec.annotation
+            return None
+        with self._lock:
+            return self._start_task('ReconfigVM_Task', effect)
+
+    def _do_InitiateFileTransferToGuest(self, mo, vm, auth, guestFilePath, fileAttributes, fileSize, overwrite):
+        url = 'https://fake-esxi/guestFile?id={}'.format(next(self._ids))
+        self._transfers[url] = (vm._moId, guestFilePath)
+        return url
+
+    def _do_InitiateFileTransferFromGuest(self, mo, vm, auth, guestFilePath):
+        url = 'https://fake-esxi/guestFile?id={}'.format(next(self._ids))
+        self._transfers[url] = (vm._moId, guestFilePath)
+        return SimpleNamespace(url=url, size=len(self.guest_files.get((vm._moId, guestFilePath), '')))
+
+    def _do_StartProgramInGuest(self, mo, vm, auth, spec):
+        with self._lock:
+            entity = self._entities[vm._moId]
+            if not self._guest_ready(entity):
+                raise vim.fault.GuestOperationsUnavailable()
+            pid = next(self._ids)
+            if spec.arguments == '/sbin/reboot':
+                entity.ready_at = time.time() + self.reboot_time
+            elif spec.arguments.startswith('/bin/bash '):
+                self._run_script(vm._moId, spec.arguments.split()[1])
+            self._processes[pid] = vim.vm.guest.ProcessManager.ProcessInfo(pid=pid,
+                                                                          exitCode=0,
+                                                                          endTime=datetime.datetime.now())
+            return pid
+
+    def _do_ListProcessesInGuest(self, mo, vm, auth, pids):
+        return [self._processes[x] for x in pids]
+
+    def _run_script(self, moid, path):
+        """Pretend to run a script from ``provision``, where every step works"""
+        script = self.guest_files.pop((moid, path), '')
+        results = ['{} 0 0'.format(x) for x in re.findall(r'^record (\S+) ', script, re.MULTILINE)]
+        self.guest_files[(moid, provision.RESULTS_PATH)] = '\n'.join(results)
+
+
+class _Entity(object):
+    """The state of one managed object"""
+    def __init__(self, obj, kind, props):
+        self.obj = obj
+        self.kind = kind
+        self.props = props
+        self.ready_at = 0
+
+
+class FakeVCenter(vCenter):
+    """A ``vlab_inf_common.vmware.vCenter`` session with a ``FakeServer``
+
+    :param server: **Required** The fake vCenter to connect to
+    :type server: FakeServer
+    """
+    def __init__(self, server):
+        self._conn = vim.ServiceInstance('ServiceInstance', server)
+        self._base_dir = const.INF_VCENTER_TOP_LVL_DIR
+        self._net_cache = None
+
+    def close(self):
+        """Nothing to logout of"""
+        pass
+
+
+class FakeOva(object):
+    """Stands in for ``MappedOva``"""
+    def __init__(self, ova_path):
+        self.path = ova_path
+        self.networks = ['wan', 'lan']
+
+    def close(self):
+        pass
+
+
+class FakeRequests(object):
+    """Stands in for the ``requests`` module, for uploading/downloading guest files"""
+    def __init__(self, server):
+        self._server = server
+
+    def put(self, url, data, verify=True):
+        vm_id, path = self._server._transfers.pop(url)
+        self._server.guest_files[(vm_id, path)] = data.decode()
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+    def get(self, url, verify=True):
+        vm_id, path = self._server._transfers.pop(url)
+        return SimpleNamespace(raise_for_status=lambda: None, text=self._server.guest_files.get((vm_id, path), ''))
+
+
+@contextmanager
+def simulate(server):
+    """Point the worker code at a ``FakeServer`` instead of vCenter
+
+    :Returns: FakeServer
+
+    :param server: The fake vCenter
+    :type server: FakeServer
+    """
+    patches = [patch.object(vmware, 'vCenter', lambda **kwargs: FakeVCenter(server)),
+               patch.object(vmware, 'MappedOva', FakeOva),
+               patch.object(vmware, 'resolve_name', lambda name: '192.0.2.1'),
+               patch.object(vmware.virtual_machine, 'deploy_from_ova', server.deploy_from_ova),
+               patch.object(vmware.virtual_machine, 'get_info', server.get_info),
+               patch.object(provision, 'requests', FakeRequests(server)),
+               patch.object(readiness, 'POLL_START', server.poll)]
+    with ExitStack() as stack:
+        for a_patch in patches:
+            stack.enter_context(a_patch)
+        # Pooled sessions could belong to a different server
+        vmware.SESSIONS.reset()
+        try:
+            yield server
+        finally:
+            vmware.SESSIONS.reset()
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in admission.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_gateway_api.lib.worker import admission
+
+
+class TestAdmission(unittest.TestCase):
+    """A set of test cases for the admission.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patchers = [patch.object(admission.cache, 'STORE', admission.cache.Store(os.path.join(self.tmp_dir, 'test.db'))),
+                         patch.object(admission, 'LIMITS', {'create': (2, 0), 'show': (0, 1.0)}),
+                         patch.object(admission.time, 'sleep')]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_acquire_concurrency(self):
+        """``_acquire`` admits no more than the concurrency limit"""
+        first = admission._acquire('create', 'a')
+        second = admission._acquire('create', 'b')
+        third = admission._acquire('create', 'c')
+
+        self.assertEqual(first, 0)
+        self.assertEqual(second, 0)
+        self.assertTrue(third > 0)
+
+    def test_release(self):
+        """``_release`` frees a slot for another task"""
+        admission._acquire('create', 'a')
+        admission._acquire('create', 'b')
+        admission._release('create', 'a')
+
+        self.assertEqual(admission._acquire('create', 'c'), 0)
+
+    @patch.object(admission, 'const')
+    def test_lease_expires(self, fake_const):
+        """``_acquire`` ignores holders whose lease expired"""
+        fake_const.VLAB_GATEWAY_ADMISSION_LEASE = -1
+        admission._acquire('create', 'a')
+        admission._acquire('create', 'b')
+
+        self.assertEqual(admission._acquire('create', 'c'), 0)
+
+    @patch.object(admission.time, 'time')
+    def test_token_bucket(self, fake_time):
+        """``_acquire`` limits how often an operation starts"""
+        fake_time.return_value = 100
+        first = admission._acquire('show', 'a')
+        second = admission._acquire('show', 'b')
+        fake_time.return_value = 101
+        third = admission._acquire('show', 'c')
+
+        self.assertEqual(first, 0)
+        self.assertEqual(second, 1.0)
+        self.assertEqual(third, 0)
+
+    def test_admit(self):
+        """``admit`` releases the slot when the task is done"""
+        with admission.admit('create', 'task1', MagicMock()):
+            pass
+        with admission.admit('create', 'task2', MagicMock()):
+            pass
+        with admission.admit('create', 'task3', MagicMock()):
+            pass
+
+        self.assertEqual(admission.cache.STORE.get('admission-sem:create'), {})
+
+    @patch.object(admission, 'const')
+    def test_admit_busy(self, fake_const):
+        """``admit`` raises Busy when the task cannot be admitted in time"""
+        fake_const.VLAB_GATEWAY_ADMISSION_WAIT = 1
+        fake_const.VLAB_GATEWAY_ADMISSION_LEASE = 60
+        admission._acquire('create', 'a')
+        admission._acquire('create', 'b')
+
+        with self.assertRaises(admission.Busy):
+            with admission.admit('create', 'task1', MagicMock()):
+                pass
+
+    @patch.object(admission.metrics, 'admitted')
+    def test_admit_wait_time(self, fake_admitted):
+        """``admit`` records the wait time from the first attempt of a task"""
+        with admission.admit('create', 'task1', MagicMock()):
+            pass
+
+        self.assertEqual(fake_admitted.call_args[0][0], 'create')
+
+    def test_admit_unavailable(self):
+        """``admit`` lets the task run when the store is unusable"""
+        ran = False
+        with patch.object(admission.cache, 'STORE', admission.cache.Store('/no/such/dir/test.db')):
+            with admission.admit('create', 'task1', MagicMock()):
+                ran = True
+
+        self.assertTrue(ran)
+
+    @patch.object(admission, '_acquire')
+    def test_admit_unavailable_waiting(self, fake_acquire):
+        """``admit`` lets the task run when the store breaks while waiting to be admitted"""
+        fake_acquire.side_effect = [1.0, admission.cache.sqlite3.OperationalError('testing')]
+        ran = False
+        with admission.admit('create', 'task1', MagicMock()):
+            ran = True
+
+        self.assertTrue(ran)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -54,6 +54,16 @@ class TestGatwayViewSchema(unittest.TestCase):
 
         self.assertTrue(body_required)
 
+    def test_put_schema(self):
+        """The schema defined for PUT is valid"""
+        try:
+            Draft4Validator.check_schema(gateway_view.GatewayView.PUT_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in bulk.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_gateway_api.lib import bulk
+
+
+class TestBulk(unittest.TestCase):
+    """A set of test cases for the bulk.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(bulk.cache, 'STORE', bulk.cache.Store(os.path.join(self.tmp_dir, 'test.db')))
+        self.patcher.start()
+        users = [{'username': 'alice', 'wan': 'someWAN', 'lan': 'alice_lan'},
+                 {'username': 'bob', 'wan': 'someWAN', 'lan': 'bob_lan'},
+                 {'username': 'sam', 'wan': 'someWAN', 'lan': 'sam_lan'}]
+        self.bulk_id = bulk.start('create', users)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_status(self):
+        """``status`` reports the state of every user, in the order supplied"""
+        output = bulk.status(self.bulk_id)
+        users = [x['username'] for x in output['users']]
+
+        self.assertEqual(users, ['alice', 'bob', 'sam'])
+        self.assertEqual(output['progress']['pending'], 3)
+        self.assertFalse(output['complete'])
+
+    def test_status_unknown(self):
+        """``status`` returns None for an unknown bulk operation"""
+        self.assertTrue(bulk.status('nope') is None)
+
+    def test_next_batch(self):
+        """``next_batch`` queues no more than the limit"""
+        action, batch, complete = bulk.next_batch(self.bulk_id, limit=2)
+
+        self.assertEqual(action, 'create')
+        self.assertEqual([x[0] for x in batch], ['alice', 'bob'])
+        self.assertFalse(complete)
+
+    def test_next_batch_full(self):
+        """``next_batch`` queues nothing while the limit is reached"""
+        bulk.next_batch(self.bulk_id, limit=2)
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=2)
+
+        self.assertEqual(batch, [])
+
+    def test_record_result(self):
+        """``record_result`` frees a slot for the next user"""
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=2)
+        bulk.record_result(batch[0][2], None)
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=2)
+
+        self.assertEqual([x[0] for x in batch], ['sam'])
+
+    def test_record_result_error(self):
+        """``record_result`` marks the user as failed when the task had an error"""
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=1)
+        bulk.record_result(batch[0][2], 'No such network for LAN: alice_lan')
+        output = bulk.status(self.bulk_id)
+
+        self.assertEqual(output['users'][0]['state'], 'failed')
+        self.assertEqual(output['users'][0]['error'], 'No such network for LAN: alice_lan')
+
+    def test_record_result_not_bulk(self):
+        """``record_result`` ignores tasks that are not part of a bulk operation"""
+        self.assertFalse(bulk.record_result('someTask', None))
+
+    def test_complete(self):
+        """``next_batch`` reports when every user is done"""
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=3)
+        for _, _, task_id in batch:
+            bulk.record_result(task_id, None)
+        _, _, complete = bulk.next_batch(self.bulk_id, limit=3)
+
+        self.assertTrue(complete)
+
+    def test_follow(self):
+        """``follow`` records the outcome of the task already in flight for the user"""
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=1)
+        bulk.follow(batch[0][2], 'userTask')
+        bulk.record_result('userTask', None)
+        output = bulk.status(self.bulk_id)
+
+        self.assertEqual(output['users'][0]['task-id'], 'userTask')
+        self.assertEqual(output['users'][0]['state'], 'done')
+
+    def test_follow_other_bulk(self):
+        """``follow`` fails the user when another bulk operation waits on the same task"""
+        other_id = bulk.start('create', [{'username': 'alice', 'wan': 'someWAN', 'lan': 'alice_lan'}])
+        _, batch, _ = bulk.next_batch(other_id, limit=1)
+        bulk.follow(batch[0][2], 'userTask')
+        _, batch, _ = bulk.next_batch(self.bulk_id, limit=1)
+        bulk.follow(batch[0][2], 'userTask')
+        output = bulk.status(self.bulk_id)
+
+        self.assertEqual(output['users'][0]['state'], 'failed')
+
+    @patch.object(bulk, 'const')
+    def test_timeout(self, fake_const):
+        """``next_batch`` fails users whose task never reported back"""
+        fake_const.VLAB_GATEWAY_BULK_TASK_TIMEOUT = -1
+        fake_const.VLAB_GATEWAY_BULK_TTL = 60
+        bulk.next_batch(self.bulk_id, limit=1)
+        bulk.next_batch(self.bulk_id, limit=1)
+        output = bulk.status(self.bulk_id)
+
+        self.assertEqual(output['users'][0]['state'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in cache.py
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_gateway_api.lib import cache
+
+
+class TestStore(unittest.TestCase):
+    """A set of test cases for the Store object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = cache.Store(os.path.join(self.tmp_dir, 'test.db'))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_set(self):
+        """``Store`` returns the value that was set"""
+        self.store.set('foo', {'bar': 1})
+
+        self.assertEqual(self.store.get('foo'), {'bar': 1})
+
+    def test_get_missing(self):
+        """``Store.get`` returns None when there's no such key"""
+        self.assertTrue(self.store.get('foo') is None)
+
+    @patch.object(cache.time, 'time')
+    def test_get_expired(self, fake_time):
+        """``Store.get`` returns None once the entry expires"""
+        fake_time.return_value = 100
+        self.store.set('foo', 'bar', ttl=10)
+        fake_time.return_value = 111
+
+        self.assertTrue(self.store.get('foo') is None)
+
+    def test_add(self):
+        """``Store.add`` only creates the entry if there isn't one already"""
+        first = self.store.add('foo', 1)
+        second = self.store.add('foo', 2)
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertEqual(self.store.get('foo'), 1)
+
+    @patch.object(cache.time, 'time')
+    def test_add_expired(self, fake_time):
+        """``Store.add`` replaces an expired entry"""
+        fake_time.return_value = 100
+        self.store.add('foo', 1, ttl=10)
+        fake_time.return_value = 111
+
+        self.assertTrue(self.store.add('foo', 2))
+
+    def test_delete(self):
+        """``Store.delete`` removes the entry"""
+        self.store.set('foo', 'bar')
+        self.store.delete('foo')
+
+        self.assertTrue(self.store.get('foo') is None)
+
+    def test_incr(self):
+        """``Store.incr`` creates the counter, and returns the new value"""
+        self.store.incr('foo')
+        output = self.store.incr('foo', amount=2)
+
+        self.assertEqual(output, 3)
+
+    def test_transaction_rollback(self):
+        """``Store.transaction`` discards every change when an error is raised"""
+        try:
+            with self.store.transaction():
+                self.store.set('foo', 'bar')
+                raise RuntimeError('testing')
+        except RuntimeError:
+            pass
+
+        self.assertTrue(self.store.get('foo') is None)
+
+    def test_get_set_raw(self):
+        """``Store`` returns the bytes that were set, as is"""
+        self.store.set_raw('foo', b'\x81\xa3bar\x01')
+
+        self.assertEqual(self.store.get_raw('foo'), b'\x81\xa3bar\x01')
+
+    @patch.object(cache.time, 'time')
+    def test_purge(self, fake_time):
+        """``Store.purge`` deletes only the expired entries"""
+        fake_time.return_value = 100
+        self.store.set('foo', 'bar', ttl=10)
+        self.store.set('baz', 'bat')
+        fake_time.return_value = 111
+
+        output = self.store.purge()
+
+        self.assertEqual(output, 1)
+        self.assertEqual(self.store.get('baz'), 'bat')
+
+    def test_shared(self):
+        """``Store`` entries are visible to other connections to the same file"""
+        other = cache.Store(self.store.path)
+        self.store.set('foo', 'bar')
+
+        self.assertEqual(other.get('foo'), 'bar')
+
+
+class TestShowCache(unittest.TestCase):
+    """A set of test cases for caching gateway.show results"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db')))
+        self.patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_set_show(self):
+        """``set_show`` caches the info for ``get_show``"""
+        generation = cache.show_generation('alice')
+        cache.set_show('alice', {'worked': True}, generation)
+
+        self.assertEqual(cache.get_show('alice'), {'worked': True})
+
+    def test_invalidate_show(self):
+        """``invalidate_show`` discards the cached info"""
+        cache.set_show('alice', {'worked': True}, cache.show_generation('alice'))
+        cache.invalidate_show('alice')
+
+        self.assertTrue(cache.get_show('alice') is None)
+
+    def test_set_show_stale(self):
+        """``set_show`` does not cache info that was invalidated while it was queried"""
+        generation = cache.show_generation('alice')
+        cache.invalidate_show('alice')
+        output = cache.set_show('alice', {'worked': True}, generation)
+
+        self.assertFalse(output)
+        self.assertTrue(cache.get_show('alice') is None)
+
+    def test_network_exists(self):
+        """``network_exists`` checks the names published by ``set_network_names``"""
+        cache.set_network_names(['someWAN'])
+
+        self.assertTrue(cache.network_exists('someWAN'))
+        self.assertFalse(cache.network_exists('someLAN'))
+
+    def test_network_exists_unknown(self):
+        """``network_exists`` returns None when no names have been published"""
+        self.assertTrue(cache.network_exists('someWAN') is None)
+
+    def test_get_images(self):
+        """``get_images`` returns the catalog published by ``set_images``"""
+        cache.set_images([{'image': 'gw.ova'}])
+
+        self.assertEqual(cache.get_images(), [{'image': 'gw.ova'}])
+
+    def test_get_images_unknown(self):
+        """``get_images`` returns None when no catalog has been published"""
+        self.assertTrue(cache.get_images() is None)
+
+    def test_claim_image_checksums(self):
+        """``claim_image_checksums`` only lets one worker checksum the images"""
+        first = cache.claim_image_checksums(60)
+        second = cache.claim_image_checksums(60)
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+
+    def test_claim_template_import(self):
+        """``claim_template_import`` only lets one worker import a template"""
+        first = cache.claim_template_import('gw-1234', 60)
+        second = cache.claim_template_import('gw-1234', 60)
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+
+    def test_release_template_import(self):
+        """``release_template_import`` lets another worker import the template"""
+        cache.claim_template_import('gw-1234', 60)
+        cache.release_template_import('gw-1234')
+
+        self.assertTrue(cache.claim_template_import('gw-1234', 60))
+
+    def test_unusable(self):
+        """``get_show`` returns None when the store cannot be opened"""
+        with patch.object(cache, 'STORE', cache.Store('/no/such/dir/test.db')):
+            output = cache.get_show('alice')
+
+        self.assertTrue(output is None)
+
+    def test_claim_inflight(self):
+        """``claim_inflight`` returns the id of the task already in flight"""
+        cache.claim_inflight('create', 'alice', ['wan', 'lan'], 'task1', ttl=60)
+        output = cache.claim_inflight('create', 'alice', ['wan', 'lan'], 'task2', ttl=60)
+
+        self.assertEqual(output, 'task1')
+
+    def test_claim_inflight_other_params(self):
+        """``claim_inflight`` does not coalesce tasks with different params"""
+        cache.claim_inflight('create', 'alice', ['wan', 'lan'], 'task1', ttl=60)
+        output = cache.claim_inflight('create', 'alice', ['wan', 'otherLan'], 'task2', ttl=60)
+
+        self.assertTrue(output is None)
+
+    def test_release_inflight(self):
+        """``release_inflight`` lets the next claim queue a new task"""
+        cache.claim_inflight('delete', 'alice', [], 'task1', ttl=60)
+        cache.release_inflight('delete', 'alice', [], 'task1')
+        output = cache.claim_inflight('delete', 'alice', [], 'task2', ttl=60)
+
+        self.assertTrue(output is None)
+
+    def test_release_inflight_other_task(self):
+        """``release_inflight`` does not release the claim of a different task"""
+        cache.claim_inflight('delete', 'alice', [], 'task2', ttl=60)
+        cache.release_inflight('delete', 'alice', [], 'task1')
+        output = cache.claim_inflight('delete', 'alice', [], 'task3', ttl=60)
+
+        self.assertEqual(output, 'task2')
+
+    def test_claim_inflight_unusable(self):
+        """``claim_inflight`` returns None when the store cannot be opened"""
+        with patch.object(cache, 'STORE', cache.Store('/no/such/dir/test.db')):
+            output = cache.claim_inflight('delete', 'alice', [], 'task1', ttl=60)
+
+        self.assertTrue(output is None)
+
+    def test_worker_health(self):
+        """``set_worker_health`` publishes the check in of a worker for ``get_worker_health``"""
+        cache.set_worker_health('celery@a', {'checked': time.time()}, 30)
+        cache.set_worker_health('celery@b', {'checked': time.time()}, 30)
+
+        self.assertEqual(sorted(cache.get_worker_health().keys()), ['celery@a', 'celery@b'])
+
+    def test_worker_health_forgets(self):
+        """``set_worker_health`` forgets about workers that stopped checking in"""
+        cache.set_worker_health('celery@a', {'checked': time.time() - 60}, 30)
+        cache.set_worker_health('celery@b', {'checked': time.time()}, 30)
+
+        self.assertEqual(list(cache.get_worker_health().keys()), ['celery@b'])
+
+    def test_get_worker_health_unusable(self):
+        """``get_worker_health`` raises when the store cannot be used, so the health check can say so"""
+        with patch.object(cache, 'STORE', cache.Store('/no/such/dir/test.db')):
+            with self.assertRaises(cache.CACHE_ERRORS):
+                cache.get_worker_health()
+
+
+if __name__ == '__main__':
+    unittest.main()
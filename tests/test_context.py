@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the context.py module
+"""
+import os
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_gateway_api.lib.worker import context, profile, provision
+
+
+class TestDnsCache(unittest.TestCase):
+    """A set of test cases for ``context.DnsCache``"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.resolve = MagicMock(return_value='10.1.1.1')
+        self.dns = context.DnsCache(ttl=300, stale=3600, resolve=self.resolve)
+
+    def test_lookup(self):
+        """``DnsCache.lookup`` returns the IP of the name"""
+        self.assertEqual(self.dns.lookup('vlab.local'), '10.1.1.1')
+
+    def test_lookup_cached(self):
+        """``DnsCache.lookup`` only resolves a name once, until the answer expires"""
+        self.dns.lookup('vlab.local')
+        self.dns.lookup('vlab.local')
+
+        self.assertEqual(self.resolve.call_count, 1)
+
+    @patch.object(context.time, 'monotonic')
+    def test_lookup_expired(self, fake_monotonic):
+        """``DnsCache.lookup`` resolves the name again once the answer expires"""
+        fake_monotonic.return_value = 1000
+        self.dns.lookup('vlab.local')
+        fake_monotonic.return_value = 1301
+        self.resolve.return_value = '10.2.2.2'
+
+        self.assertEqual(self.dns.lookup('vlab.local'), '10.2.2.2')
+
+    @patch.object(context.time, 'monotonic')
+    def test_lookup_outage(self, fake_monotonic):
+        """``DnsCache.lookup`` uses an expired answer while DNS is down"""
+        fake_monotonic.return_value = 1000
+        self.dns.lookup('vlab.local')
+        fake_monotonic.return_value = 2000
+        self.resolve.side_effect = socket.gaierror('testing')
+
+        self.assertEqual(self.dns.lookup('vlab.local'), '10.1.1.1')
+
+    @patch.object(context.time, 'monotonic')
+    def test_lookup_outage_too_long(self, fake_monotonic):
+        """``DnsCache.lookup`` raises once an answer is too old to use, even while DNS is down"""
+        fake_monotonic.return_value = 1000
+        self.dns.lookup('vlab.local')
+        fake_monotonic.return_value = 1000 + 300 + 3600
+        self.resolve.side_effect = socket.gaierror('testing')
+
+        with self.assertRaises(OSError):
+            self.dns.lookup('vlab.local')
+
+    def test_lookup_unknown(self):
+        """``DnsCache.lookup`` raises when a name was never resolved"""
+        self.resolve.side_effect = socket.gaierror('testing')
+
+        with self.assertRaises(OSError):
+            self.dns.lookup('vlab.local')
+
+    def test_clear(self):
+        """``DnsCache.clear`` forgets every answer"""
+        self.dns.lookup('vlab.local')
+        self.dns.clear()
+        self.dns.lookup('vlab.local')
+
+        self.assertEqual(self.resolve.call_count, 2)
+
+
+class TestContext(unittest.TestCase):
+    """A set of test cases for building the provisioning context"""
+    def setUp(self):
+        """Runs before every test case"""
+        context.reset()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        context.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_build(self):
+        """``build`` renders the same steps as ``provision.common_steps``"""
+        output = context.build('10.1.1.1')
+
+        self.assertEqual(list(output.common_steps), provision.common_steps('10.1.1.1'))
+        self.assertEqual(output.profile, profile.load('10.1.1.1'))
+
+    @patch.object(context.provision, 'plan')
+    def test_build_invalid(self, fake_plan):
+        """``build`` raises ValueError when the steps cannot be run"""
+        fake_plan.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            context.build('10.1.1.1')
+
+    @patch.object(context, 'build', wraps=context.build)
+    def test_get(self, fake_build):
+        """``get`` only builds the context once"""
+        context.get('10.1.1.1')
+        context.get('10.1.1.1')
+
+        self.assertEqual(fake_build.call_count, 1)
+
+    def test_get_new_ip(self):
+        """``get`` builds the context again when the IP of the vLab server changes"""
+        context.get('10.1.1.1')
+
+        output = context.get('10.2.2.2')
+
+        self.assertEqual(output.vlab_ip, '10.2.2.2')
+        self.assertEqual(output.profile.settings['ntp'], '10.2.2.2')
+
+    def test_get_new_profile(self):
+        """``get`` builds the context again when the profile file changes"""
+        profile_path = os.path.join(self.tmp_dir, 'profile.json')
+        new_const = context.const._replace(VLAB_GATEWAY_PROFILE=profile_path)
+        with open(profile_path, 'w') as the_file:
+            ujson.dump({'version': '1.1.0'}, the_file)
+        with patch.object(context, 'const', new_const), patch.object(profile, 'const', new_const):
+            context.get('10.1.1.1')
+            with open(profile_path, 'w') as the_file:
+                ujson.dump({'version': '1.2.0'}, the_file)
+            later = time.time() + 10
+            os.utime(profile_path, (later, later))
+
+            output = context.get('10.1.1.1')
+
+        self.assertEqual(output.profile.version, '1.2.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in dispatch.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_gateway_api.lib import dispatch
+
+
+class TestSendOnce(unittest.TestCase):
+    """A set of test cases for ``send_once``"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_celery = MagicMock()
+        self.fake_celery.send_task.return_value.id = 'task1'
+        self.fake_logger = MagicMock()
+
+    @patch.object(dispatch.progress, 'publish')
+    @patch.object(dispatch.cache, 'claim_inflight')
+    def test_send_once(self, fake_claim_inflight, fake_publish):
+        """``send_once`` queues the task with the id it claimed"""
+        fake_claim_inflight.return_value = None
+
+        output = dispatch.send_once(self.fake_celery, 'create', 'alice', ['wan', 'lan', 'gw.ova'], 'myId',
+                                    self.fake_logger, task_id='task1')
+
+        self.assertEqual(output, 'task1')
+        self.fake_celery.send_task.assert_called_with('gateway.create', ['alice', 'wan', 'lan', 'gw.ova', 'myId'], task_id='task1')
+        self.assertEqual(fake_claim_inflight.call_args[0][3], 'task1')
+
+    @patch.object(dispatch.progress, 'publish')
+    @patch.object(dispatch.cache, 'claim_inflight')
+    def test_send_once_queued_event(self, fake_claim_inflight, fake_publish):
+        """``send_once`` publishes a queued event, so the task has events before a worker picks it up"""
+        fake_claim_inflight.return_value = None
+
+        dispatch.send_once(self.fake_celery, 'delete', 'alice', [], 'myId', self.fake_logger)
+
+        fake_publish.assert_called_with('task1', 'alice', 'queued')
+
+    @patch.object(dispatch.progress, 'publish')
+    @patch.object(dispatch.cache, 'claim_inflight')
+    def test_send_once_show(self, fake_claim_inflight, fake_publish):
+        """``send_once`` does not publish events for a show"""
+        fake_claim_inflight.return_value = None
+
+        dispatch.send_once(self.fake_celery, 'show', 'alice', [], 'myId', self.fake_logger)
+
+        self.assertFalse(fake_publish.called)
+
+    @patch.object(dispatch.progress, 'publish')
+    @patch.object(dispatch.cache, 'claim_inflight')
+    def test_send_once_inflight(self, fake_claim_inflight, fake_publish):
+        """``send_once`` returns the task already in flight, without queuing another"""
+        fake_claim_inflight.return_value = 'userTask'
+
+        output = dispatch.send_once(self.fake_celery, 'delete', 'alice', [], 'myId', self.fake_logger)
+
+        self.assertEqual(output, 'userTask')
+        self.assertFalse(self.fake_celery.send_task.called)
+        self.assertFalse(fake_publish.called)
+
+    @patch.object(dispatch.cache, 'release_inflight')
+    @patch.object(dispatch.cache, 'claim_inflight')
+    def test_send_once_fails(self, fake_claim_inflight, fake_release_inflight):
+        """``send_once`` releases its claim if the task cannot be queued"""
+        fake_claim_inflight.return_value = None
+        self.fake_celery.send_task.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            dispatch.send_once(self.fake_celery, 'delete', 'alice', [], 'myId', self.fake_logger, task_id='task1')
+
+        fake_release_inflight.assert_called_with('delete', 'alice', [], 'task1')
+
+
+if __name__ == '__main__':
+    unittest.main()
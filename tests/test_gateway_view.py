@@ -14,6 +14,12 @@ from vlab_api_common.http_auth import generate_v2_test_token
 from vlab_gateway_api.lib.views import gateway_view
 
 
+def _image(name, error=None):
+    """Make an entry of the image catalog"""
+    return {'image': name, 'version': name[:-4], 'size': 1, 'modified': 1,
+            'networks': ['WAN', 'LAN'], 'sha256': None, 'error': error}
+
+
 class TestGatewayView(unittest.TestCase):
     """A set of test cases for the GatewayView object"""
     @classmethod
@@ -30,9 +36,37 @@ class TestGatewayView(unittest.TestCase):
         cls.app = app.test_client()
         # Mock Celery
         app.celery_app = MagicMock()
+        cls.fake_celery = app.celery_app
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        # Every network exists, unless a test says otherwise
+        cls.network_patcher = patch.object(gateway_view.cache, 'network_exists', return_value=True)
+        cls.fake_network_exists = cls.network_patcher.start()
+        # Only the default image, unless a test says otherwise
+        cls.images_patcher = patch.object(gateway_view.cache, 'get_images',
+                                          return_value=[_image('defaultgateway-IPAM.ova')])
+        cls.fake_get_images = cls.images_patcher.start()
+        # Keep the shared store on the host's disk out of the tests; nothing
+        # is cached or in flight, unless a test says otherwise
+        cls.show_patcher = patch.object(gateway_view.cache, 'get_show', return_value=None)
+        cls.fake_get_show = cls.show_patcher.start()
+        cls.claim_patcher = patch.object(gateway_view.cache, 'claim_inflight', return_value=None)
+        cls.fake_claim_inflight = cls.claim_patcher.start()
+        cls.release_patcher = patch.object(gateway_view.cache, 'release_inflight')
+        cls.fake_release_inflight = cls.release_patcher.start()
+        cls.publish_patcher = patch.object(gateway_view.progress, 'publish')
+        cls.fake_publish = cls.publish_patcher.start()
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        cls.network_patcher.stop()
+        cls.images_patcher.stop()
+        cls.show_patcher.stop()
+        cls.claim_patcher.stop()
+        cls.release_patcher.stop()
+        cls.publish_patcher.stop()
 
     def test_get_task(self):
         """GatewayView - GET on /api/2/inf/gateway returns a task-id"""
@@ -55,6 +89,17 @@ class TestGatewayView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    @patch.object(gateway_view.cache, 'get_show')
+    def test_get_cached(self, fake_get_show):
+        """GatewayView - GET on /api/2/inf/gateway returns the cached info without a task"""
+        fake_get_show.return_value = {'worked': True}
+        resp = self.app.get('/api/2/inf/gateway',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'worked': True})
+        self.assertFalse(self.fake_celery.send_task.called)
+
     def test_post_task(self):
         """GatewayView - POST on /api/2/inf/gateway returns a task-id"""
         resp = self.app.post('/api/2/inf/gateway',
@@ -66,6 +111,145 @@ class TestGatewayView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_bad_network(self):
+        """GatewayView - POST on /api/2/inf/gateway returns 400 when a network does not exist"""
+        self.fake_network_exists.return_value = False
+        self.fake_task.get.return_value = {'content': ['someWAN']}
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN"})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], 'No such network for LAN: bob_someLAN')
+
+    def test_post_new_network(self):
+        """GatewayView - POST on /api/2/inf/gateway asks a worker about networks it doesn't know"""
+        self.fake_network_exists.return_value = False
+        self.fake_task.get.return_value = {'content': ['someWAN', 'bob_someLAN']}
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN"})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_post_network_check_timeout(self):
+        """GatewayView - POST on /api/2/inf/gateway creates the gateway if networks cannot be checked"""
+        self.fake_network_exists.return_value = False
+        self.fake_task.get.side_effect = RuntimeError('testing')
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN"})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_post_default_image(self):
+        """GatewayView - POST on /api/2/inf/gateway deploys the default image when none is supplied"""
+        self.app.post('/api/2/inf/gateway',
+                      headers={'X-Auth': self.token},
+                      json={'wan': "someWAN", 'lan': "someLAN"})
+
+        the_args = self.fake_celery.send_task.call_args[0][1]
+
+        self.assertEqual(the_args, ['bob', 'someWAN', 'bob_someLAN', 'defaultgateway-IPAM.ova', 'noId'])
+
+    def test_post_version(self):
+        """GatewayView - POST on /api/2/inf/gateway finds the image of a version"""
+        self.fake_get_images.return_value.append(_image('gw-2.0.ova'))
+        self.app.post('/api/2/inf/gateway',
+                      headers={'X-Auth': self.token},
+                      json={'wan': "someWAN", 'lan': "someLAN", 'version': 'gw-2.0'})
+
+        the_args = self.fake_celery.send_task.call_args[0][1]
+
+        self.assertEqual(the_args[3], 'gw-2.0.ova')
+
+    def test_post_bad_image(self):
+        """GatewayView - POST on /api/2/inf/gateway returns 400 for an image that doesn't exist"""
+        self.fake_task.get.return_value = {'content': [_image('defaultgateway-IPAM.ova')], 'error': None}
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'image': 'nope.ova'})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], 'No such image: nope.ova')
+
+    def test_post_broken_image(self):
+        """GatewayView - POST on /api/2/inf/gateway returns 400 for an image that cannot be deployed"""
+        self.fake_get_images.return_value = [_image('broken.ova', error='testing')]
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'image': 'broken.ova'})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(self.fake_celery.send_task.called)
+
+    def test_post_new_image(self):
+        """GatewayView - POST on /api/2/inf/gateway asks a worker about images it doesn't know"""
+        self.fake_task.get.return_value = {'content': [_image('new.ova')], 'error': None}
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'image': 'new.ova'})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_post_image_check_timeout(self):
+        """GatewayView - POST on /api/2/inf/gateway creates the gateway if images cannot be checked"""
+        self.fake_task.get.side_effect = RuntimeError('testing')
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'version': 'gw-3.0'})
+
+        the_args = self.fake_celery.send_task.call_args[0][1]
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(the_args[3], 'gw-3.0.ova')
+
+    def test_post_image_unpublished(self):
+        """GatewayView - POST on /api/2/inf/gateway does not wait on a worker when no catalog is published"""
+        self.fake_get_images.return_value = None
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'version': 'gw-3.0'})
+        sent = [x[0][0] for x in self.fake_celery.send_task.call_args_list]
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertFalse('gateway.image' in sent)
+
+    def test_post_image_path(self):
+        """GatewayView - POST on /api/2/inf/gateway rejects an image outside of the images dir"""
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': "someWAN", 'lan': "someLAN", 'image': '../etc/passwd'})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_image(self):
+        """GatewayView - GET on /api/2/inf/gateway/image lists the versions that can be deployed"""
+        self.fake_get_images.return_value.append(_image('broken.ova', error='testing'))
+        resp = self.app.get('/api/2/inf/gateway/image',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content']['image'], ['defaultgateway-IPAM'])
+        self.assertEqual(len(resp.json['content']['details']), 2)
+
+    def test_image_unpublished(self):
+        """GatewayView - GET on /api/2/inf/gateway/image returns 503, without waiting on a worker, when no catalog is published"""
+        self.fake_get_images.return_value = None
+        resp = self.app.get('/api/2/inf/gateway/image',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(self.fake_celery.send_task.called)
+
+    def test_describe(self):
+        """GatewayView - GET on /api/2/inf/gateway?describe=true describes every method, including PUT"""
+        resp = self.app.get('/api/2/inf/gateway?describe=true',
+                            headers={'X-Auth': self.token})
+        methods = sorted(ujson.loads(resp.data)['content'].keys())
+
+        self.assertEqual(methods, ['delete', 'get', 'post', 'put'])
+
     def test_post_task_link(self):
         """GatewayView - POST on /api/2/inf/gateway sets the Link header"""
         resp = self.app.post('/api/2/inf/gateway',
@@ -97,6 +281,344 @@ class TestGatewayView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_put_task(self):
+        """GatewayView - PUT on /api/2/inf/gateway returns a task-id"""
+        resp = self.app.put('/api/2/inf/gateway',
+                            headers={'X-Auth': self.token})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(task_id, expected)
+
+    def test_put_task_name(self):
+        """GatewayView - PUT on /api/2/inf/gateway sends the reconfigure task"""
+        self.app.put('/api/2/inf/gateway',
+                     headers={'X-Auth': self.token})
+
+        operation = self.fake_claim_inflight.call_args[0][0]
+        task_name = self.fake_celery.send_task.call_args[0][0]
+
+        self.assertEqual(operation, 'reconfigure')
+        self.assertEqual(task_name, 'gateway.reconfigure')
+
+    @patch.object(gateway_view.cache, 'claim_inflight')
+    def test_post_inflight(self, fake_claim_inflight):
+        """GatewayView - POST on /api/2/inf/gateway returns the task already in flight"""
+        fake_claim_inflight.return_value = 'some-other-task'
+        resp = self.app.post('/api/2/inf/gateway',
+                             headers={'X-Auth': self.token},
+                             json={'wan': 'someWAN', 'lan': 'someLAN'})
+
+        self.assertEqual(resp.json['content']['task-id'], 'some-other-task')
+        self.assertFalse(self.fake_celery.send_task.called)
+
+    @patch.object(gateway_view.cache, 'claim_inflight')
+    def test_get_inflight_link(self, fake_claim_inflight):
+        """GatewayView - GET on /api/2/inf/gateway links to the task already in flight"""
+        fake_claim_inflight.return_value = 'some-other-task'
+        resp = self.app.get('/api/2/inf/gateway',
+                            headers={'X-Auth': self.token})
+
+        expected = '<https://localhost/api/2/inf/gateway/task/some-other-task>; rel=status'
+
+        self.assertEqual(resp.headers['Link'], expected)
+
+    @patch.object(gateway_view.cache, 'release_inflight')
+    @patch.object(gateway_view.cache, 'claim_inflight')
+    def test_delete_send_fails(self, fake_claim_inflight, fake_release_inflight):
+        """GatewayView - DELETE on /api/2/inf/gateway releases its claim if the task cannot be queued"""
+        fake_claim_inflight.return_value = None
+        self.fake_celery.send_task.side_effect = RuntimeError('testing')
+        with self.assertRaises(RuntimeError):
+            self.app.delete('/api/2/inf/gateway',
+                            headers={'X-Auth': self.token})
+
+        self.assertTrue(fake_release_inflight.called)
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events streams every event until the task is done"""
+        fake_events.return_value = ('bob', [(1, {'stage': 'queued', 'detail': None}),
+                                            (2, {'stage': 'complete', 'detail': {'error': None}})])
+        resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                            headers={'X-Auth': self.token})
+        body = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertTrue('id: 2\nevent: complete\n' in body)
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events_resume(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events resumes after the Last-Event-ID"""
+        fake_events.return_value = ('bob', [(3, {'stage': 'complete', 'detail': {'error': None}})])
+        resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                            headers={'X-Auth': self.token, 'Last-Event-ID': '2'})
+        resp.get_data()
+
+        self.assertEqual(fake_events.call_args[0], ('asdf', 2))
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events_other_user(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events returns 404 for another user's task"""
+        fake_events.return_value = ('alice', [])
+        resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 404)
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events_unusable(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events returns 503 when the store is unusable"""
+        fake_events.side_effect = [OSError('testing')]
+        resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 503)
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events_capped(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events returns 429 when too many streams are open"""
+        fake_events.return_value = ('bob', [])
+        with patch.object(gateway_view, '_STREAMS', gateway_view.threading.BoundedSemaphore(1)) as streams:
+            streams.acquire()
+            resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                                headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Link'], '<https://localhost/api/2/inf/gateway/task/asdf>; rel=status')
+
+    @patch.object(gateway_view.progress, 'events')
+    def test_task_events_released(self, fake_events):
+        """GatewayView - GET on /api/2/inf/gateway/task/<id>/events frees its slot once the stream closes"""
+        fake_events.return_value = ('bob', [(1, {'stage': 'complete', 'detail': {'error': None}})])
+        with patch.object(gateway_view, '_STREAMS', gateway_view.threading.BoundedSemaphore(1)) as streams:
+            resp = self.app.get('/api/2/inf/gateway/task/asdf/events',
+                                headers={'X-Auth': self.token})
+            resp.get_data()
+            resp.close()
+
+            self.assertTrue(streams.acquire(blocking=False))
+
+    @patch.object(gateway_view.progress, 'publish')
+    def test_post_queued_event(self, fake_publish):
+        """GatewayView - POST on /api/2/inf/gateway publishes a queued event for the new task"""
+        self.app.post('/api/2/inf/gateway',
+                      headers={'X-Auth': self.token},
+                      json={'wan': 'someWAN', 'lan': 'someLAN'})
+
+        fake_publish.assert_called_with('asdf-asdf-asdf', 'bob', 'queued')
+
+
+class TestGatewayViewBulk(unittest.TestCase):
+    """A set of test cases for the bulk end points of GatewayView"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.token = generate_v2_test_token(username='bob')
+        cls.admin_token = generate_v2_test_token(username='admin')
+        # The decorators hold a reference to this list
+        gateway_view.const.VLAB_GATEWAY_ADMINS.append('admin')
+
+    @classmethod
+    def tearDownClass(cls):
+        """Runs once, after every test case"""
+        gateway_view.const.VLAB_GATEWAY_ADMINS.remove('admin')
+
+    def setUp(self):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        gateway_view.GatewayView.register(app)
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        app.celery_app = MagicMock()
+        self.fake_celery = app.celery_app
+        self.fake_celery.send_task.return_value.id = 'asdf-asdf-asdf'
+        self.body = {'action': 'create',
+                     'users': [{'username': 'alice', 'wan': 'someWAN', 'lan': 'someLAN'},
+                               {'username': 'sam', 'wan': 'someWAN', 'lan': 'someLAN'}]}
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk returns the bulk-id"""
+        fake_start.return_value = 'bulk1'
+        resp = self.app.post('/api/2/inf/gateway/bulk',
+                             headers={'X-Auth': self.admin_token},
+                             json=self.body)
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['bulk-id'], 'bulk1')
+        self.assertEqual(resp.headers['Link'], '<https://localhost/api/2/inf/gateway/bulk/bulk1>; rel=status')
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk_lan_name(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk prefixes the LAN with the username"""
+        fake_start.return_value = 'bulk1'
+        self.app.post('/api/2/inf/gateway/bulk',
+                      headers={'X-Auth': self.admin_token},
+                      json=self.body)
+        users = fake_start.call_args[0][1]
+
+        self.assertEqual(users[0]['lan'], 'alice_someLAN')
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk_admin_only(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk is only for admins"""
+        resp = self.app.post('/api/2/inf/gateway/bulk',
+                             headers={'X-Auth': self.token},
+                             json=self.body)
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(fake_start.called)
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk_create_needs_networks(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk returns 400 if a user has no WAN/LAN"""
+        self.body['users'].append({'username': 'pat'})
+        resp = self.app.post('/api/2/inf/gateway/bulk',
+                             headers={'X-Auth': self.admin_token},
+                             json=self.body)
+
+        self.assertEqual(resp.status_code, 400)
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk_duplicate_users(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk returns 400 if a user is supplied twice"""
+        self.body['users'].append(self.body['users'][0])
+        resp = self.app.post('/api/2/inf/gateway/bulk',
+                             headers={'X-Auth': self.admin_token},
+                             json=self.body)
+
+        self.assertEqual(resp.status_code, 400)
+
+    @patch.object(gateway_view.bulk, 'start')
+    def test_bulk_delete(self, fake_start):
+        """GatewayView - POST on /api/2/inf/gateway/bulk does not need networks to delete"""
+        fake_start.return_value = 'bulk1'
+        resp = self.app.post('/api/2/inf/gateway/bulk',
+                             headers={'X-Auth': self.admin_token},
+                             json={'action': 'delete', 'users': [{'username': 'alice'}]})
+
+        self.assertEqual(resp.status_code, 202)
+
+    @patch.object(gateway_view.bulk, 'status')
+    def test_bulk_status(self, fake_status):
+        """GatewayView - GET on /api/2/inf/gateway/bulk/<id> returns 200 once every user is done"""
+        fake_status.return_value = {'complete': True}
+        resp = self.app.get('/api/2/inf/gateway/bulk/bulk1',
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 200)
+
+    @patch.object(gateway_view.bulk, 'status')
+    def test_bulk_status_running(self, fake_status):
+        """GatewayView - GET on /api/2/inf/gateway/bulk/<id> returns 202 while users are not done"""
+        fake_status.return_value = {'complete': False}
+        resp = self.app.get('/api/2/inf/gateway/bulk/bulk1',
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 202)
+
+    @patch.object(gateway_view.bulk, 'status')
+    def test_bulk_status_404(self, fake_status):
+        """GatewayView - GET on /api/2/inf/gateway/bulk/<id> returns 404 for an unknown bulk-id"""
+        fake_status.return_value = None
+        resp = self.app.get('/api/2/inf/gateway/bulk/bulk1',
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 404)
+
+
+class TestGatewayViewFleet(unittest.TestCase):
+    """A set of test cases for the fleet end point of GatewayView"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.token = generate_v2_test_token(username='bob')
+        cls.admin_token = generate_v2_test_token(username='admin')
+        # The decorators hold a reference to this list
+        gateway_view.const.VLAB_GATEWAY_ADMINS.append('admin')
+
+    @classmethod
+    def tearDownClass(cls):
+        """Runs once, after every test case"""
+        gateway_view.const.VLAB_GATEWAY_ADMINS.remove('admin')
+
+    def setUp(self):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        gateway_view.GatewayView.register(app)
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        app.celery_app = MagicMock()
+        self.fake_celery = app.celery_app
+        self.fake_celery.send_task.return_value.id = 'asdf-asdf-asdf'
+
+    def test_fleet(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet returns a task-id"""
+        resp = self.app.get('/api/2/inf/gateway/fleet',
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['task-id'], 'asdf-asdf-asdf')
+        self.assertEqual(resp.headers['Link'], '<https://localhost/api/2/inf/gateway/task/asdf-asdf-asdf>; rel=status')
+
+    def test_fleet_params(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet sends the filters and page to the task"""
+        self.app.get('/api/2/inf/gateway/fleet?version=1.1.0&generation=2&after=bob:vm-1&limit=10',
+                     headers={'X-Auth': self.admin_token, 'X-REQUEST-ID': 'myId'})
+        params = self.fake_celery.send_task.call_args[0][1]
+
+        self.assertEqual(params, ['admin', '1.1.0', 2, 'bob:vm-1', 10, 'myId'])
+
+    def test_fleet_admin_only(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet is only for admins"""
+        resp = self.app.get('/api/2/inf/gateway/fleet',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(self.fake_celery.send_task.called)
+
+    def test_fleet_bad_generation(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet returns 400 for a generation that isn't a number"""
+        resp = self.app.get('/api/2/inf/gateway/fleet?generation=two',
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_fleet_bad_limit(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet returns 400 for a page bigger than VLAB_GATEWAY_FLEET_PAGE"""
+        resp = self.app.get('/api/2/inf/gateway/fleet?limit={}'.format(gateway_view.const.VLAB_GATEWAY_FLEET_PAGE + 1),
+                            headers={'X-Auth': self.admin_token})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_fleet_ndjson(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet streams every page as NDJSON, when asked to"""
+        pages = [{'content': {'gateways': [{'username': 'alice'}, {'username': 'bob'}], 'next': 'bob:vm-2'}, 'error': None},
+                 {'content': {'gateways': [{'username': 'sam'}], 'next': None}, 'error': None}]
+        self.fake_celery.send_task.return_value.get.side_effect = pages
+        resp = self.app.get('/api/2/inf/gateway/fleet?limit=2',
+                            headers={'X-Auth': self.admin_token, 'Accept': 'application/x-ndjson'})
+        lines = [ujson.loads(x) for x in resp.data.decode().splitlines()]
+        afters = [x[0][1][3] for x in self.fake_celery.send_task.call_args_list]
+
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertEqual([x['username'] for x in lines], ['alice', 'bob', 'sam'])
+        self.assertEqual(afters, [None, 'bob:vm-2'])
+
+    def test_fleet_ndjson_error(self):
+        """GatewayView - GET on /api/2/inf/gateway/fleet ends the stream with the error when a page fails"""
+        self.fake_celery.send_task.return_value.get.side_effect = RuntimeError('testing')
+        resp = self.app.get('/api/2/inf/gateway/fleet',
+                            headers={'X-Auth': self.admin_token, 'Accept': 'application/x-ndjson'})
+        lines = [ujson.loads(x) for x in resp.data.decode().splitlines()]
+
+        self.assertEqual(len(lines), 1)
+        self.assertTrue('error' in lines[0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the health.py module
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_gateway_api.lib import health, cache
+
+
+class TestHealth(unittest.TestCase):
+    """A set of test cases for health.py"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db')))
+        self.patcher.start()
+        self.celery_app = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_timed_check(self):
+        """``timed_check`` reports how long a healthy check took"""
+        output = health.timed_check(lambda: None)
+
+        self.assertTrue(output['ok'])
+        self.assertEqual(output['error'], None)
+        self.assertTrue(output['latency'] >= 0)
+
+    def test_timed_check_error(self):
+        """``timed_check`` reports why a check failed"""
+        def check():
+            raise RuntimeError('doh')
+
+        output = health.timed_check(check)
+
+        self.assertFalse(output['ok'])
+        self.assertEqual(output['error'], 'doh')
+
+    def test_timed_check_error_no_message(self):
+        """``timed_check`` uses the name of the exception when it has no message"""
+        def check():
+            raise TimeoutError()
+
+        output = health.timed_check(check)
+
+        self.assertEqual(output['error'], 'TimeoutError')
+
+    def test_probe(self):
+        """``probe`` checks the broker, the workers, and vCenter"""
+        health.heartbeat('celery@a', lambda: None)
+
+        output = health.probe(self.celery_app)
+
+        self.assertTrue(output['broker']['ok'])
+        self.assertTrue(output['workers']['ok'])
+        self.assertEqual(output['workers']['alive'], ['celery@a'])
+        self.assertTrue(output['vcenter']['ok'])
+        self.assertEqual(output['vcenter']['worker'], 'celery@a')
+
+    def test_probe_broker(self):
+        """``probe`` reports when the broker cannot be reached"""
+        conn = self.celery_app.connection_for_write.return_value.__enter__.return_value
+        conn.ensure_connection.side_effect = ConnectionRefusedError('no broker')
+
+        output = health.probe(self.celery_app)
+
+        self.assertFalse(output['broker']['ok'])
+        self.assertEqual(output['broker']['error'], 'no broker')
+
+    def test_probe_no_workers(self):
+        """``probe`` reports when no worker has checked in"""
+        output = health.probe(self.celery_app)
+
+        self.assertFalse(output['workers']['ok'])
+        self.assertFalse(output['vcenter']['ok'])
+
+    def test_probe_dead_worker(self):
+        """``probe`` ignores a worker that stopped checking in"""
+        record = {'checked': time.time() - (health.const.VLAB_GATEWAY_HEALTH_INTERVAL * health.MISSED_CHECKS),
+                  'vcenter': health.timed_check(lambda: None)}
+        cache.STORE.set('health-workers', {'celery@a': record})
+
+        output = health.probe(self.celery_app)
+
+        self.assertEqual(output['workers']['alive'], [])
+        self.assertFalse(output['workers']['ok'])
+
+    def test_probe_store(self):
+        """``probe`` reports when the shared store cannot be read"""
+        with patch.object(cache, 'STORE', cache.Store('/no/such/dir/test.db')):
+            output = health.probe(self.celery_app)
+
+        self.assertFalse(output['workers']['ok'])
+        self.assertNotEqual(output['workers']['error'], 'No worker has checked in')
+
+    def test_probe_vcenter(self):
+        """``probe`` reports how vCenter is doing, according to the latest worker to check in"""
+        def check():
+            raise RuntimeError('vCenter did not honor the session')
+        health.heartbeat('celery@a', lambda: None)
+        health.heartbeat('celery@b', check)
+
+        output = health.probe(self.celery_app)
+
+        self.assertFalse(output['vcenter']['ok'])
+        self.assertEqual(output['vcenter']['worker'], 'celery@b')
+
+    @patch.object(health.threading, 'Thread')
+    def test_start(self, fake_Thread):
+        """``start`` only starts checking once per process"""
+        with patch.dict(health._STATE, {'pid': None}):
+            health.start(self.celery_app)
+            health.start(self.celery_app)
+
+        self.assertEqual(fake_Thread.return_value.start.call_count, 1)
+
+    @patch.object(health.threading, 'Thread')
+    def test_start_forked(self, fake_Thread):
+        """``start`` starts checking again in a forked process"""
+        with patch.dict(health._STATE, {'pid': -1}):
+            health.start(self.celery_app)
+
+        self.assertTrue(fake_Thread.return_value.start.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
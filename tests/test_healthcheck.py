@@ -21,7 +21,16 @@ class TestHealthView(unittest.TestCase):
         app = Flask(__name__)
         healthcheck.HealthView.register(app)
         app.config['TESTING'] = True
+        app.celery_app = MagicMock()
         cls.app = app.test_client()
+        cls.celery_app = app.celery_app
+        cls.patcher = patch.object(healthcheck.health, 'start')
+        cls.fake_start = cls.patcher.start()
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        cls.patcher.stop()
 
     def test_get(self):
         """HealthView for /api/1/inf/vlan/heathcheck supports GET"""
@@ -31,6 +40,29 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(resp.status_code, expected)
 
+    def test_get_starts_probing(self):
+        """HealthView - GET starts checking the dependencies in the background"""
+        self.app.get('/api/1/inf/gateway/healthcheck')
+
+        self.fake_start.assert_called_with(self.celery_app)
+
+    @patch.object(healthcheck.health, 'results')
+    def test_get_dependencies(self, fake_results):
+        """HealthView - GET returns the results of the last dependency checks"""
+        fake_results.return_value = {'broker': {'ok': True}}
+
+        resp = self.app.get('/api/1/inf/gateway/healthcheck')
+
+        self.assertEqual(ujson.loads(resp.data)['dependencies'], {'broker': {'ok': True}})
+
+    @patch.object(healthcheck.health.pkg_resources, 'get_distribution')
+    def test_get_version(self, fake_get_distribution):
+        """HealthView - GET doesn't look up the version on every request"""
+        resp = self.app.get('/api/1/inf/gateway/healthcheck')
+
+        self.assertEqual(ujson.loads(resp.data)['version'], healthcheck.health.VERSION)
+        self.assertFalse(fake_get_distribution.called)
+
 
 if __name__ == '__main__':
     unittest.main()
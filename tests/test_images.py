@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the images.py module
+"""
+import io
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_gateway_api.lib import cache
+from vlab_gateway_api.lib.worker import images, mapped_ova
+
+
+def _make_ova(location, networks=('WAN', 'LAN')):
+    """Write a small OVA file"""
+    ovf = ''.join('<Network ovf:name="{}"></Network>'.format(x) for x in networks).encode()
+    with tarfile.open(location, 'w') as the_tar:
+        for name, content in (('gw.ovf', ovf), ('gw-disk1.vmdk', b'some disk')):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            the_tar.addfile(info, io.BytesIO(content))
+
+
+class TestImages(unittest.TestCase):
+    """A set of test cases for images.py"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.images_dir = os.path.join(self.tmp_dir, 'images')
+        os.mkdir(self.images_dir)
+        _make_ova(os.path.join(self.images_dir, 'gw-1.0.ova'))
+        mapped_ova._CACHE.clear()
+        self.patchers = [patch.object(images, 'const', images.const._replace(VLAB_GATEWAY_IMAGES_DIR=self.images_dir)),
+                         patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db')))]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan(self):
+        """``scan`` indexes every OVA by version"""
+        with open(os.path.join(self.images_dir, 'README'), 'w') as the_file:
+            the_file.write('not an image')
+
+        output = images.scan()
+
+        self.assertEqual(len(output), 1)
+        self.assertEqual(output[0]['image'], 'gw-1.0.ova')
+        self.assertEqual(output[0]['version'], 'gw-1.0')
+        self.assertEqual(output[0]['networks'], ['WAN', 'LAN'])
+        self.assertEqual(output[0]['error'], None)
+
+    def test_scan_bad_networks(self):
+        """``scan`` flags an OVA with networks a gateway doesn't have"""
+        _make_ova(os.path.join(self.images_dir, 'other.ova'), networks=('WAN', 'DMZ'))
+
+        output = images.scan()
+
+        self.assertTrue(output[1]['error'].startswith('Unexpected networks'))
+
+    def test_scan_corrupt(self):
+        """``scan`` flags an OVA that cannot be read"""
+        with open(os.path.join(self.images_dir, 'corrupt.ova'), 'wb') as the_file:
+            the_file.write(b'not a tarball')
+
+        output = images.scan()
+
+        self.assertTrue(output[0]['error'].startswith('Unable to read OVA'))
+
+    def test_scan_keeps_checksum(self):
+        """``scan`` keeps the checksum of an OVA that hasn't changed"""
+        previous = images.scan()
+        previous[0]['sha256'] = 'abc'
+
+        output = images.scan(previous)
+
+        self.assertEqual(output[0]['sha256'], 'abc')
+
+    def test_scan_replaced(self):
+        """``scan`` drops the checksum of an OVA that was replaced"""
+        previous = images.scan()
+        previous[0]['sha256'] = 'abc'
+        previous[0]['modified'] -= 10
+
+        output = images.scan(previous)
+
+        self.assertEqual(output[0]['sha256'], None)
+
+    def test_checksum(self):
+        """``checksum`` returns the SHA-256 of the file"""
+        ova_path = os.path.join(self.images_dir, 'gw-1.0.ova')
+        with open(ova_path, 'rb') as the_file:
+            expected = hashlib.sha256(the_file.read()).hexdigest()
+
+        self.assertEqual(images.checksum(ova_path), expected)
+
+    def test_refresh(self):
+        """``refresh`` publishes the catalog"""
+        images.refresh(MagicMock())
+
+        self.assertEqual(cache.get_images()[0]['sha256'], None)
+
+    def test_refresh_checksums(self):
+        """``refresh`` publishes the checksums, when told to compute them"""
+        images.refresh(MagicMock(), checksums=True)
+
+        self.assertEqual(len(cache.get_images()[0]['sha256']), 64)
+
+    @patch.object(images, 'checksum')
+    def test_refresh_checksums_once(self, fake_checksum):
+        """``refresh`` doesn't checksum an OVA again when it hasn't changed"""
+        fake_checksum.return_value = 'abc'
+        images.refresh(MagicMock(), checksums=True)
+        images.refresh(MagicMock(), checksums=True)
+
+        self.assertEqual(fake_checksum.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in inventory.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_gateway_api.lib.worker import inventory
+
+
+vmodl = inventory.vmodl
+vim = inventory.vim
+
+
+def _update(obj, kind='enter', **props):
+    """Create the ObjectUpdate the PropertyCollector sends when an object changes"""
+    changes = [vmodl.query.PropertyCollector.Change(name=k.replace('_', '.'), op='assign', val=v) for k, v in props.items()]
+    return vmodl.query.PropertyCollector.ObjectUpdate(obj=obj, kind=kind, changeSet=changes)
+
+
+def _result(version, updates, truncated=False):
+    """Create the output of WaitForUpdatesEx"""
+    filter_set = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+    return vmodl.query.PropertyCollector.UpdateSet(version=version, filterSet=[filter_set], truncated=truncated)
+
+
+class TestInventory(unittest.TestCase):
+    """A set of test cases for the Inventory object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.content.viewManager.CreateContainerView.return_value = vim.view.ContainerView('session-1')
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.folder = vim.Folder('group-1')
+        self.other_folder = vim.Folder('group-2')
+        self.the_vm = vim.VirtualMachine('vm-1')
+        self.other_vm = vim.VirtualMachine('vm-2')
+        self.collector.WaitForUpdatesEx.side_effect = [
+            _result('1', [_update(self.folder, name='alice'),
+                          _update(self.other_folder, name='bob'),
+                          _update(self.the_vm, name='defaultGateway', parent=self.folder,
+                                  config_annotation=ujson.dumps({'component': 'defaultGateway'})),
+                          _update(self.other_vm, name='defaultGateway', parent=self.other_folder)]),
+            None,
+        ]
+        self.index = inventory.Inventory(self.fake_vcenter)
+        self.index.update()
+
+    def test_find_vm(self):
+        """``Inventory.find_vm`` returns the VM in the user's folder"""
+        output = self.index.find_vm('alice', 'defaultGateway')
+
+        self.assertTrue(output is self.the_vm)
+
+    def test_find_vms(self):
+        """``Inventory.find_vms`` returns only the VMs in the user's folder"""
+        output = self.index.find_vms('alice', 'defaultGateway')
+
+        self.assertEqual(output, [self.the_vm])
+
+    def test_find_vm_none(self):
+        """``Inventory.find_vm`` returns None when there's no such VM"""
+        output = self.index.find_vm('alice', 'someOtherVM')
+
+        self.assertTrue(output is None)
+
+    def test_find_vm_no_folder(self):
+        """``Inventory.find_vm`` raises ValueError when the user has no folder"""
+        with self.assertRaises(ValueError):
+            self.index.find_vm('eve', 'defaultGateway')
+
+    def test_owned_vms(self):
+        """``Inventory.owned_vms`` returns the VMs with a name in every folder, and who owns them"""
+        output = sorted(self.index.owned_vms('defaultGateway'), key=lambda x: x[0])
+        expected = [('alice', self.the_vm), ('bob', self.other_vm)]
+
+        self.assertEqual(output, expected)
+
+    def test_meta(self):
+        """``Inventory.meta`` returns the annotation of the VM"""
+        output = self.index.meta(self.the_vm)
+        expected = {'component': 'defaultGateway'}
+
+        self.assertEqual(output, expected)
+
+    def test_meta_none(self):
+        """``Inventory.meta`` returns an empty dictionary when a VM has no annotation"""
+        output = self.index.meta(self.other_vm)
+
+        self.assertEqual(output, {})
+
+    def test_update_leave(self):
+        """``Inventory.update`` removes objects that were deleted"""
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [_update(self.the_vm, kind='leave')])]
+        self.index.update()
+
+        self.assertTrue(self.index.find_vm('alice', 'defaultGateway') is None)
+
+    def test_update_moved(self):
+        """``Inventory.update`` tracks a VM that moved to another folder"""
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [_update(self.the_vm, kind='modify',
+                                                                             parent=self.other_folder)])]
+        self.index.update()
+
+        self.assertEqual(self.index.find_vms('alice', 'defaultGateway'), [])
+        self.assertEqual(len(self.index.find_vms('bob', 'defaultGateway')), 2)
+
+    def test_update_renamed_folder(self):
+        """``Inventory.update`` finds a folder by its new name once it's renamed"""
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [_update(self.folder, kind='modify', name='carol')])]
+        self.index.update()
+
+        self.assertTrue(self.index.find_vm('carol', 'defaultGateway') is self.the_vm)
+        with self.assertRaises(ValueError):
+            self.index.folder('alice')
+
+    def test_update_folder_leave(self):
+        """``Inventory.update`` forgets a folder that was deleted"""
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [_update(self.other_vm, kind='leave'),
+                                                                     _update(self.other_folder, kind='leave')])]
+        self.index.update()
+
+        with self.assertRaises(ValueError):
+            self.index.folder('bob')
+
+    def test_update_version(self):
+        """``Inventory.update`` only asks for the changes since the last update"""
+        self.collector.WaitForUpdatesEx.side_effect = [None]
+        self.index.update()
+
+        self.assertEqual(self.collector.WaitForUpdatesEx.call_args[0][0], '1')
+
+    def test_update_truncated(self):
+        """``Inventory.update`` keeps asking for changes when the update was truncated"""
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [], truncated=True),
+                                                       _result('3', [_update(self.the_vm, kind='leave')])]
+        self.index.update()
+
+        self.assertTrue(self.index.find_vm('alice', 'defaultGateway') is None)
+
+    def test_one_collector(self):
+        """``Inventory.update`` only creates the PropertyCollector once"""
+        self.collector.WaitForUpdatesEx.side_effect = [None]
+        self.index.update()
+
+        self.assertEqual(self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.call_count, 1)
+
+    @patch.object(inventory, 'Inventory')
+    def test_get_reused(self, fake_Inventory):
+        """``get`` returns the same index for the same session"""
+        first = inventory.get(self.fake_vcenter)
+        second = inventory.get(self.fake_vcenter)
+
+        self.assertTrue(first is second)
+        self.assertEqual(fake_Inventory.call_count, 1)
+
+    @patch.object(inventory, 'Inventory')
+    def test_get_rebuild(self, fake_Inventory):
+        """``get`` creates a new index if the PropertyCollector is gone"""
+        broken = MagicMock()
+        broken.update.side_effect = vmodl.fault.ManagedObjectNotFound()
+        fake_Inventory.side_effect = [broken, MagicMock()]
+
+        output = inventory.get(MagicMock())
+
+        self.assertFalse(output is broken)
+
+
+class TestNetworkIndex(unittest.TestCase):
+    """A set of test cases for the NetworkIndex object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.content.viewManager.CreateContainerView.return_value = vim.view.ContainerView('session-1')
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.wan = vim.Network('network-1')
+        self.lan = vim.dvs.DistributedVirtualPortgroup('dvportgroup-1')
+        self.collector.WaitForUpdatesEx.side_effect = [_result('1', [_update(self.wan, name='frontend'),
+                                                                     _update(self.lan, name='alice_lan')])]
+
+    @patch.object(inventory.cache, 'set_network_names')
+    def test_networks(self, fake_set_network_names):
+        """``NetworkIndex`` maps network names to networks"""
+        index = inventory.NetworkIndex(self.fake_vcenter)
+        index.update()
+        expected = {'frontend': self.wan, 'alice_lan': self.lan}
+
+        self.assertEqual(index.networks, expected)
+
+    @patch.object(inventory.cache, 'set_network_names')
+    def test_networks_removed(self, fake_set_network_names):
+        """``NetworkIndex`` forgets networks that are deleted"""
+        index = inventory.NetworkIndex(self.fake_vcenter)
+        index.update()
+        self.collector.WaitForUpdatesEx.side_effect = [_result('2', [_update(self.lan, kind='leave')])]
+        index.update()
+
+        self.assertFalse(index.exists('alice_lan'))
+
+    @patch.object(inventory.cache, 'set_network_names')
+    def test_publish(self, fake_set_network_names):
+        """``NetworkIndex`` publishes the network names when they change"""
+        index = inventory.NetworkIndex(self.fake_vcenter)
+        index.update()
+        self.collector.WaitForUpdatesEx.side_effect = [None]
+        index.update()
+
+        self.assertEqual(fake_set_network_names.call_count, 1)
+        self.assertEqual(sorted(fake_set_network_names.call_args[0][0]), ['alice_lan', 'frontend'])
+
+    @patch.object(inventory.cache, 'set_network_names')
+    def test_get_networks(self, fake_set_network_names):
+        """``get_networks`` primes the network cache of the vCenter object"""
+        index = inventory.get_networks(self.fake_vcenter)
+
+        self.assertTrue(self.fake_vcenter._net_cache is index.networks)
+
+
+if __name__ == '__main__':
+    unittest.main()
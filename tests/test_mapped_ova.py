@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the mapped_ova.py module
+"""
+import io
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_inf_common.vmware import ova as inf_ova
+
+from vlab_gateway_api.lib.worker import mapped_ova
+
+
+OVF = '<Network ovf:name="WAN"></Network><Network ovf:name="LAN"></Network>'
+# Bigger than a chunk, and not a multiple of one
+DISK = os.urandom(mapped_ova.CHUNK_SIZE + 12345)
+
+
+def _make_ova(location, disk=DISK):
+    """Write a small OVA file"""
+    with tarfile.open(location, 'w') as the_tar:
+        for name, content in (('gw.ovf', OVF.encode()), ('gw-disk1.vmdk', disk)):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            the_tar.addfile(info, io.BytesIO(content))
+
+
+class TestParse(unittest.TestCase):
+    """A set of test cases for ``mapped_ova.parse``"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.tmp_dir, 'gw.ova')
+        _make_ova(self.ova_path)
+        mapped_ova._CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        """``parse`` reads the OVF, network names, and where the VMDK is"""
+        output = mapped_ova.parse(self.ova_path)
+        offset, size = output.disks['gw-disk1.vmdk']
+        with open(self.ova_path, 'rb') as the_file:
+            the_file.seek(offset)
+            content = the_file.read(size)
+
+        self.assertEqual(output.ovf, OVF)
+        self.assertEqual(output.networks, ['WAN', 'LAN'])
+        self.assertEqual(content, DISK)
+
+    @patch.object(mapped_ova.tarfile, 'open', wraps=tarfile.open)
+    def test_parse_cached(self, fake_open):
+        """``parse`` only reads an OVA once"""
+        mapped_ova.parse(self.ova_path)
+        mapped_ova.parse(self.ova_path)
+
+        self.assertEqual(fake_open.call_count, 1)
+
+    def test_parse_replaced(self):
+        """``parse`` reads an OVA again once the file is replaced"""
+        mapped_ova.parse(self.ova_path)
+        _make_ova(self.ova_path, disk=b'new disk')
+        later = time.time() + 10
+        os.utime(self.ova_path, (later, later))
+
+        output = mapped_ova.parse(self.ova_path)
+
+        self.assertEqual(output.disks['gw-disk1.vmdk'][1], len(b'new disk'))
+        self.assertEqual(len(mapped_ova._CACHE), 1)
+
+    def test_parse_bounded(self):
+        """``parse`` keeps no more than MAX_CACHED OVAs"""
+        for idx in range(mapped_ova.MAX_CACHED + 2):
+            location = os.path.join(self.tmp_dir, 'gw{}.ova'.format(idx))
+            _make_ova(location, disk=b'disk')
+            mapped_ova.parse(location)
+
+        self.assertEqual(len(mapped_ova._CACHE), mapped_ova.MAX_CACHED)
+
+
+class TestMappedOva(unittest.TestCase):
+    """A set of test cases for ``mapped_ova.MappedOva``"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.tmp_dir, 'gw.ova')
+        _make_ova(self.ova_path)
+        self.ova = mapped_ova.MappedOva(self.ova_path)
+
+    def tearDown(self):
+        self.ova.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_properties(self):
+        """MappedOva has the same OVF, networks, and VMDKs as Ova"""
+        the_ova = inf_ova.Ova(self.ova_path)
+        try:
+            self.assertEqual(self.ova.ovf, the_ova.ovf)
+            self.assertEqual(self.ova.networks, the_ova.networks)
+            self.assertEqual(self.ova.vmdks, the_ova.vmdks)
+        finally:
+            the_ova.close()
+
+    def test_disk(self):
+        """Iterating a MappedDisk yields the whole VMDK, in chunks"""
+        disk = self.ova._disks['gw-disk1.vmdk']
+
+        chunks = [bytes(x) for x in disk]
+
+        self.assertEqual(b''.join(chunks), DISK)
+        self.assertEqual(len(chunks), 2)
+
+    def test_close(self):
+        """MappedOva can be closed once a VMDK has been read"""
+        list(self.ova._disks['gw-disk1.vmdk'])
+
+        self.ova.close()
+
+    @patch.object(inf_ova.Ova, '_chime_progress')
+    @patch.object(inf_ova, 'urlopen')
+    def test_deploy(self, fake_urlopen, fake_chime_progress):
+        """MappedOva uploads the VMDK with the deploy code of Ova"""
+        sent = []
+        fake_urlopen.side_effect = lambda req, context: sent.append(b''.join(bytes(x) for x in req.data))
+        file_item = MagicMock()
+        file_item.path = 'gw-disk1.vmdk'
+        file_item.deviceId = 'disk1'
+        device_url = MagicMock()
+        device_url.importKey = 'disk1'
+        device_url.url = 'https://some-host/nfc/disk1'
+        lease = MagicMock()
+        lease.info.deviceUrl = [device_url]
+        spec = MagicMock()
+        spec.fileItem = [file_item]
+
+        self.ova.deploy(spec, lease, 'some-host')
+        headers = fake_urlopen.call_args[0][0].headers
+
+        self.assertEqual(sent, [DISK])
+        self.assertEqual(headers['Content-length'], len(DISK))
+        self.assertTrue(lease.Complete.called)
+        self.assertTrue(self.ova._handle.progress() > 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics.py module
+"""
+import os
+import unittest
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+
+from vlab_gateway_api.lib import metrics
+from vlab_gateway_api.lib.views import MetricsView
+
+
+def _sample(name, **labels):
+    """Find the value and exemplar of one sample
+
+    :Returns: Tuple - (value, exemplar)
+    """
+    for metric in metrics.REGISTRY.collect():
+        for sample in metric.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value, sample.exemplar
+    return None, None
+
+
+class TestMetrics(unittest.TestCase):
+    """A set of test cases for metrics.py"""
+    def tearDown(self):
+        metrics.task_done('test.task', 'SUCCESS')
+
+    def test_timed(self):
+        """``timed`` records how long a stage took"""
+        before, _ = _sample('vlab_gateway_stage_seconds_count', stage='test_timed')
+
+        with metrics.timed('test_timed'):
+            pass
+        after, _ = _sample('vlab_gateway_stage_seconds_count', stage='test_timed')
+
+        self.assertEqual((before or 0) + 1, after)
+
+    def test_timed_logs(self):
+        """``timed`` logs how long a stage took, when supplied a logger"""
+        fake_logger = MagicMock()
+
+        with metrics.timed('test_timed_logs', fake_logger):
+            pass
+
+        self.assertTrue(fake_logger.info.called)
+
+    def test_timed_error(self):
+        """``timed`` counts a stage that raised, and re-raises the exception"""
+        with self.assertRaises(RuntimeError):
+            with metrics.timed('test_timed_error'):
+                raise RuntimeError('testing')
+        errors, _ = _sample('vlab_gateway_stage_errors_total', stage='test_timed_error')
+        count, _ = _sample('vlab_gateway_stage_seconds_count', stage='test_timed_error')
+
+        self.assertEqual(errors, 1)
+        self.assertEqual(count, 1)
+
+    def test_exemplar(self):
+        """``timed`` tags the sample with the txn_id bound to the thread"""
+        metrics.bind('myId')
+
+        with metrics.timed('test_exemplar'):
+            pass
+        _, exemplar = _sample('vlab_gateway_stage_seconds_bucket', stage='test_exemplar', le='0.05')
+
+        self.assertEqual(exemplar.labels, {'txn_id': 'myId'})
+
+    def test_exemplar_long_txn_id(self):
+        """``timed`` truncates a txn_id that's too long for an exemplar"""
+        metrics.bind('a' * 500)
+
+        with metrics.timed('test_exemplar_long_txn_id'):
+            pass
+        _, exemplar = _sample('vlab_gateway_stage_seconds_bucket', stage='test_exemplar_long_txn_id', le='0.05')
+
+        self.assertEqual(len(exemplar.labels['txn_id']), metrics.MAX_TXN_ID)
+
+    def test_no_exemplar(self):
+        """``timed`` records no exemplar when the thread isn't bound to a txn_id"""
+        with metrics.timed('test_no_exemplar'):
+            pass
+        _, exemplar = _sample('vlab_gateway_stage_seconds_bucket', stage='test_no_exemplar', le='0.05')
+
+        self.assertEqual(exemplar, None)
+
+    def test_session_checkout(self):
+        """``session_checkout`` counts the vCenter sessions the pool handed out"""
+        before, _ = _sample('vlab_gateway_vcenter_sessions_total', outcome='hit')
+
+        metrics.session_checkout('hit')
+        after, _ = _sample('vlab_gateway_vcenter_sessions_total', outcome='hit')
+
+        self.assertEqual((before or 0) + 1, after)
+
+    def test_admitted(self):
+        """``admitted`` records how long a task waited to be admitted"""
+        metrics.admitted('test_admitted', 1.5)
+        total, _ = _sample('vlab_gateway_admission_seconds_sum', operation='test_admitted')
+
+        self.assertEqual(total, 1.5)
+
+    def test_task_done(self):
+        """``task_done`` records how long the bound task took, and unbinds it"""
+        metrics.bind('myId')
+
+        metrics.task_done('test.task_done', 'SUCCESS')
+        count, _ = _sample('vlab_gateway_task_seconds_count', task='test.task_done', state='SUCCESS')
+
+        self.assertEqual(count, 1)
+        self.assertEqual(metrics._exemplar(), None)
+
+    def test_task_done_unbound(self):
+        """``task_done`` records nothing if no task was bound"""
+        metrics.task_done('test.task_done_unbound', 'SUCCESS')
+        count, _ = _sample('vlab_gateway_task_seconds_count', task='test.task_done_unbound', state='SUCCESS')
+
+        self.assertEqual(count, None)
+
+    def test_registry(self):
+        """``registry`` returns the default registry for a single process"""
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertTrue(metrics.registry() is metrics.REGISTRY)
+
+    @patch.object(metrics.multiprocess, 'MultiProcessCollector')
+    def test_registry_multiprocess(self, fake_MultiProcessCollector):
+        """``registry`` collects the metrics of every process when PROMETHEUS_MULTIPROC_DIR is set"""
+        with patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': '/tmp/metrics'}):
+            output = metrics.registry()
+
+        self.assertFalse(output is metrics.REGISTRY)
+        self.assertTrue(fake_MultiProcessCollector.called)
+
+
+class TestInstrument(unittest.TestCase):
+    """A set of test cases for the metrics of the API"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        app = Flask(__name__)
+        MetricsView.register(app)
+        metrics.instrument(app)
+        app.config['TESTING'] = True
+        cls.app = app.test_client()
+
+    def test_request_seconds(self):
+        """``instrument`` records how long the API took to respond"""
+        self.app.get('/api/1/inf/gateway/metrics', headers={'X-REQUEST-ID': 'someId'})
+        count, _ = _sample('vlab_gateway_request_seconds_count', method='GET',
+                           endpoint='/api/1/inf/gateway/metrics', status='200')
+
+        self.assertTrue(count >= 1)
+
+    def test_request_exemplar(self):
+        """``instrument`` tags the sample with the X-REQUEST-ID of the request"""
+        self.app.get('/api/1/inf/gateway/metrics', headers={'X-REQUEST-ID': 'someId'})
+        _, exemplar = _sample('vlab_gateway_request_seconds_bucket', method='GET',
+                              endpoint='/api/1/inf/gateway/metrics', status='200', le='0.05')
+
+        self.assertEqual(exemplar.labels, {'txn_id': 'someId'})
+
+    def test_metrics_view(self):
+        """MetricsView - GET on /api/1/inf/gateway/metrics returns the metrics"""
+        resp = self.app.get('/api/1/inf/gateway/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(b'vlab_gateway_stage_seconds' in resp.data)
+
+    def test_metrics_view_openmetrics(self):
+        """MetricsView - GET on /api/1/inf/gateway/metrics supports the OpenMetrics format"""
+        resp = self.app.get('/api/1/inf/gateway/metrics',
+                            headers={'Accept': 'application/openmetrics-text; version=1.0.0'})
+
+        self.assertTrue(resp.content_type.startswith('application/openmetrics-text'))
+
+
+if __name__ == '__main__':
+    unittest.main()
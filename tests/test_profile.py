@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the profile.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import ujson
+
+from vlab_gateway_api.lib.worker import profile
+
+
+class TestProfile(unittest.TestCase):
+    """A set of test cases for profile.py"""
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def _profile_file(self, content):
+        """Write a profile file, and return its location"""
+        location = os.path.join(self.tmp_dir, 'profile.json')
+        with open(location, 'w') as the_file:
+            the_file.write(content)
+        return location
+
+    def test_load(self):
+        """``load`` defines every setting, by default"""
+        with patch.object(profile, 'const', profile.const._replace(VLAB_GATEWAY_PROFILE='')):
+            output = profile.load('10.1.1.1')
+
+        self.assertEqual(output.version, profile.DEFAULT_VERSION)
+        self.assertEqual(list(output.settings.keys()), list(profile.SETTINGS.keys()))
+        self.assertEqual(output.settings['ntp'], '10.1.1.1')
+
+    def test_load_file(self):
+        """``load`` overrides the defaults with the profile file"""
+        location = self._profile_file(ujson.dumps({'version': '1.1.0', 'settings': {'ntp': '10.2.2.2'}}))
+        with patch.object(profile, 'const', profile.const._replace(VLAB_GATEWAY_PROFILE=location)):
+            output = profile.load('10.1.1.1')
+
+        self.assertEqual(output.version, '1.1.0')
+        self.assertEqual(output.settings['ntp'], '10.2.2.2')
+        self.assertEqual(output.settings['dns_forwarder'], '10.1.1.1')
+
+    def test_load_unknown(self):
+        """``load`` raises ValueError for a setting that doesn't exist"""
+        location = self._profile_file(ujson.dumps({'settings': {'nope': 'foo'}}))
+        with patch.object(profile, 'const', profile.const._replace(VLAB_GATEWAY_PROFILE=location)):
+            with self.assertRaises(ValueError):
+                profile.load('10.1.1.1')
+
+    def test_load_invalid(self):
+        """``load`` raises ValueError for a profile file that isn't JSON"""
+        location = self._profile_file('{not json')
+        with patch.object(profile, 'const', profile.const._replace(VLAB_GATEWAY_PROFILE=location)):
+            with self.assertRaises(ValueError):
+                profile.load('10.1.1.1')
+
+    def test_record(self):
+        """``record`` only keeps a fingerprint of a secret"""
+        output = profile.record({'ntp': '10.1.1.1', 'log_key': 'hunter2'})
+
+        self.assertEqual(output['ntp'], '10.1.1.1')
+        self.assertTrue(output['log_key'].startswith('sha256:'))
+        self.assertFalse('hunter2' in output['log_key'])
+
+    def test_diff(self):
+        """``diff`` returns only the settings that changed"""
+        recorded = profile.record({'ntp': '10.1.1.1', 'log_key': 'hunter2'})
+
+        output = profile.diff(recorded, {'ntp': '10.1.1.1', 'log_key': 'hunter3'})
+
+        self.assertEqual(dict(output), {'log_key': 'hunter3'})
+
+    def test_diff_unrecorded(self):
+        """``diff`` treats a setting that was never recorded as changed"""
+        output = profile.diff({}, {'ntp': '10.1.1.1'})
+
+        self.assertEqual(dict(output), {'ntp': '10.1.1.1'})
+
+    def test_needs_reboot(self):
+        """``needs_reboot`` is False when every changed setting has a service to restart"""
+        self.assertFalse(profile.needs_reboot(['ntp', 'dns_forwarder']))
+
+    def test_needs_reboot_true(self):
+        """``needs_reboot`` is True when any changed setting is only read at boot"""
+        self.assertTrue(profile.needs_reboot(['ntp', 'vlab_url']))
+
+    def test_pattern_original(self):
+        """``pattern`` matches the text the OVA ships with, for a setting that was never recorded"""
+        output = profile.pattern('ntp', {})
+
+        self.assertEqual(output, r'1\.us\.pool\.ntp\.org')
+
+    def test_pattern_recorded(self):
+        """``pattern`` matches the whole setting, with the recorded value"""
+        output = profile.pattern('salt_master', {'salt_master': '10.1.1.1'})
+
+        self.assertEqual(output, r'master: 10\.1\.1\.1')
+
+    def test_pattern_grep(self):
+        """``pattern`` leaves slashes alone in a regex for grep"""
+        output = profile.pattern('vlab_url', {'vlab_url': 'https://a.b'}, sed=False)
+
+        self.assertEqual(output, r'VLAB_URL=https://a\.b')
+
+    def test_recorded_or_baseline(self):
+        """``recorded_or_baseline`` returns what a gateway recorded"""
+        output = profile.recorded_or_baseline({'ntp': '10.9.9.9'}, '10.1.1.1')
+
+        self.assertEqual(output, {'ntp': '10.9.9.9'})
+
+    def test_recorded_or_baseline_legacy(self):
+        """``recorded_or_baseline`` returns the settings from the environment, for a gateway that never recorded any"""
+        output = profile.recorded_or_baseline(None, '10.1.1.1')
+
+        self.assertEqual(output, profile.record(profile.baseline('10.1.1.1')))
+
+    def test_replacement(self):
+        """``replacement`` escapes the characters that are special to sed"""
+        output = profile.replacement('vlab_url', 'https://a&b')
+
+        self.assertEqual(output, r'VLAB_URL=https:\/\/a\&b')
+
+
+if __name__ == '__main__':
+    unittest.main()
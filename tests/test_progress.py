@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in progress.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_gateway_api.lib import cache, progress
+
+
+class TestProgress(unittest.TestCase):
+    """A set of test cases for progress.py"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db')))
+        self.patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_events(self):
+        """``events`` returns the published events, in order"""
+        progress.publish('task1', 'alice', progress.QUEUED)
+        progress.publish('task1', 'alice', 'deploy', {'foo': 1})
+
+        owner, found = progress.events('task1')
+        stages = [(x, y['stage'], y['detail']) for x, y in found]
+
+        self.assertEqual(owner, 'alice')
+        self.assertEqual(stages, [(1, 'queued', None), (2, 'deploy', {'foo': 1})])
+
+    def test_events_after(self):
+        """``events`` only returns the events after the supplied id"""
+        progress.publish('task1', 'alice', progress.QUEUED)
+        progress.publish('task1', 'alice', 'deploy')
+
+        _, found = progress.events('task1', after=1)
+
+        self.assertEqual([x for x, _ in found], [2])
+
+    def test_events_unknown(self):
+        """``events`` returns no owner when there's no such task"""
+        output = progress.events('task1')
+
+        self.assertEqual(output, (None, []))
+
+    def test_reporter(self):
+        """``reporter`` publishes the events of one task"""
+        report = progress.reporter('task1', 'alice')
+        report('boot_wait')
+
+        _, found = progress.events('task1')
+
+        self.assertEqual(found[0][1]['stage'], 'boot_wait')
+
+    def test_publish_unusable(self):
+        """``publish`` does not raise when the store cannot be opened"""
+        with patch.object(cache, 'STORE', cache.Store('/no/such/dir/test.db')):
+            progress.publish('task1', 'alice', 'deploy')
+
+
+if __name__ == '__main__':
+    unittest.main()
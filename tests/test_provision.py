@@ -0,0 +1,344 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in provision.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from vlab_gateway_api.lib.worker import provision
+
+
+def _all_steps(username, vlab_ip):
+    """Every step a new gateway runs, like ``context.build`` and ``_setup_gateway`` combine them"""
+    return provision.user_steps(username) + provision.common_steps(vlab_ip)
+
+
+class TestProvision(unittest.TestCase):
+    """A set of test cases for the provision.py module"""
+
+    def test_steps(self):
+        """``user_steps`` and ``common_steps`` return lists of Step objects"""
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+
+        self.assertTrue(all(isinstance(x, provision.Step) for x in steps))
+
+    def test_common_steps_settings(self):
+        """``common_steps`` uses the settings it's given, instead of loading the profile"""
+        steps = provision.common_steps(vlab_ip='10.1.1.1', settings={'ntp': '10.2.2.2'})
+
+        self.assertEqual([x.name for x in steps], ['ntp', 'kern_log'])
+        self.assertTrue('10.2.2.2' in steps[0].command)
+
+    def test_steps_unique(self):
+        """``user_steps`` and ``common_steps`` give every step a unique name"""
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+        names = [x.name for x in steps]
+
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_user_steps_salt_order(self):
+        """``user_steps`` sets the hostname before enabling the salt-minion"""
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+        names = [x.name for x in steps]
+
+        self.assertTrue(names.index('hostname') < names.index('salt_enable'))
+
+    def test_common_steps_vlab_url(self):
+        """``common_steps`` escapes the slashes in VLAB_URL for sed"""
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+        command = [x.command for x in steps if x.name == 'vlab_url'][0]
+        expected = (r"/bin/grep -q -e 'VLAB_URL=https://localhost' /etc/environment && "
+                    r"/bin/sed -i -e 's/VLAB_URL=https:\/\/localhost/VLAB_URL=https:\/\/localhost/g' /etc/environment")
+
+        self.assertEqual(command, expected)
+
+    def test_common_steps_environment(self):
+        """``common_steps`` never edits /etc/environment with two steps at once"""
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+        batches = provision.plan(steps)
+        edits = [len([x for x in batch if '/etc/environment' in x.command]) for batch in batches]
+
+        self.assertEqual(max(edits), 1)
+
+    def test_setting_steps_recorded(self):
+        """``setting_steps`` replaces the recorded value of a setting, not the text the OVA shipped with"""
+        steps = provision.setting_steps({'ntp': '10.2.2.2'}, recorded={'ntp': '10.1.1.1'})
+        expected = (r"/bin/grep -q -e '10\.1\.1\.1' /etc/chrony/chrony.conf && "
+                    r"/bin/sed -i -e 's/10\.1\.1\.1/10.2.2.2/g' /etc/chrony/chrony.conf")
+
+        self.assertEqual(steps[0].command, expected)
+
+    def test_setting_steps_secret(self):
+        """``setting_steps`` matches the whole line of a secret, because only its fingerprint is recorded"""
+        steps = provision.setting_steps({'ddns': 'newKey'}, recorded={'ddns': 'sha256:abc'})
+        expected = ("/bin/grep -q -e '^VLAB_DDNS_KEY=.*$' /etc/environment && "
+                    "/bin/sed -i -e 's/^VLAB_DDNS_KEY=.*$/VLAB_DDNS_KEY=newKey/g' /etc/environment")
+
+        self.assertEqual(steps[0].command, expected)
+
+    def test_setting_steps_secret_flagged(self):
+        """``setting_steps`` marks the steps that have a secret in their command"""
+        steps = provision.setting_steps({'ddns': 'newKey', 'ntp': '10.2.2.2'}, recorded={})
+        secret = {x.name: x.secret for x in steps}
+
+        self.assertEqual(secret, {'ddns': True, 'ntp': False})
+
+    def test_setting_steps_quote(self):
+        """``setting_steps`` escapes a single quote in a value for the shell"""
+        steps = provision.setting_steps({'log_key': "it's"}, recorded={})
+        expected = "/bin/grep -q -e 'changeME' /etc/vlab/log_sender.key && /bin/sed -i -e 's/changeME/it'\\''s/g' /etc/vlab/log_sender.key"
+
+        self.assertEqual(steps[0].command, expected)
+
+    def test_setting_steps_verified(self):
+        """``setting_steps`` fails a step when the setting isn't in the file, instead of changing nothing"""
+        steps = provision.setting_steps({'ntp': '10.2.2.2'}, recorded={})
+
+        self.assertTrue(steps[0].command.startswith("/bin/grep -q -e '1\\.us\\.pool\\.ntp\\.org' /etc/chrony/chrony.conf && "))
+
+    def test_setting_steps_chained(self):
+        """``setting_steps`` runs edits of the same file one after another"""
+        steps = provision.setting_steps({'vlab_url': 'https://foo', 'ddns': 'key'}, recorded={})
+
+        self.assertEqual(steps[1].after, ('vlab_url',))
+
+    def test_setting_steps_restart(self):
+        """``setting_steps`` restarts a service once the settings it reads are changed"""
+        steps = provision.setting_steps({'ntp': '10.2.2.2'}, recorded={}, restart=True)
+
+        self.assertEqual(steps[1], provision.Step('restart_chrony', '/bin/systemctl restart chrony',
+                                                  'Failed to restart chrony', after=('ntp',)))
+
+    def test_setting_steps_no_restart(self):
+        """``setting_steps`` leaves the services alone by default, because the gateway gets rebooted"""
+        steps = provision.setting_steps({'ntp': '10.2.2.2'}, recorded={})
+
+        self.assertEqual([x.name for x in steps], ['ntp'])
+
+    def test_plan(self):
+        """``plan`` runs a step after the steps it depends on"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed', after=('bar',)),
+                 provision.Step('bar', '/bin/true', 'bar failed')]
+
+        batches = provision.plan(steps)
+        names = [[x.name for x in batch] for batch in batches]
+
+        self.assertEqual(names, [['bar'], ['foo']])
+
+    def test_plan_parallel(self):
+        """``plan`` puts steps that don't depend on each other in the same batch"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed'),
+                 provision.Step('bar', '/bin/true', 'bar failed')]
+
+        batches = provision.plan(steps)
+
+        self.assertEqual(len(batches), 1)
+
+    def test_plan_max_parallel(self):
+        """``plan`` runs no more than MAX_PARALLEL steps at once"""
+        steps = [provision.Step('step{}'.format(x), '/bin/true', 'failed') for x in range(provision.MAX_PARALLEL + 1)]
+
+        batches = provision.plan(steps)
+
+        self.assertEqual([len(x) for x in batches], [provision.MAX_PARALLEL, 1])
+
+    def test_plan_unknown(self):
+        """``plan`` raises ValueError when a step depends on a step that doesn't exist"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed', after=('nope',))]
+
+        with self.assertRaises(ValueError):
+            provision.plan(steps)
+
+    def test_plan_circular(self):
+        """``plan`` raises ValueError when steps depend on each other"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed', after=('bar',)),
+                 provision.Step('bar', '/bin/true', 'bar failed', after=('foo',))]
+
+        with self.assertRaises(ValueError):
+            provision.plan(steps)
+
+    def test_render_script(self):
+        """``render_script`` records the exit code and duration of every step"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed'),
+                 provision.Step('bar', '/bin/false', 'bar failed')]
+
+        script = provision.render_script(steps)
+
+        self.assertTrue('/bin/true\nrecord foo $? $START ) &\n' in script)
+        self.assertTrue('/bin/false\nrecord bar $? $START ) &\n' in script)
+
+    def test_render_script_order(self):
+        """``render_script`` waits on a batch of steps before starting the next"""
+        steps = [provision.Step('foo', '/bin/true', 'foo failed', after=('bar',)),
+                 provision.Step('bar', '/bin/false', 'bar failed')]
+
+        script = provision.render_script(steps)
+
+        self.assertTrue(script.index('record bar') < script.index('wait') < script.index('record foo'))
+
+    def test_render_script_exit(self):
+        """``render_script`` exits with the number of failed steps"""
+        script = provision.render_script([])
+
+        self.assertTrue(script.endswith("exit $(awk '$2 != 0' \"$RESULTS\" | wc -l)\n"))
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_one_command(self, fake_run_command, fake_requests):
+        """``run_steps`` executes all the steps with one guest command"""
+        fake_run_command.return_value.exitCode = 0
+        steps = _all_steps(username='jane', vlab_ip='10.1.1.1')
+
+        provision.run_steps(MagicMock(), MagicMock(), steps, MagicMock())
+
+        self.assertEqual(fake_run_command.call_count, 1)
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_ok(self, fake_run_command, fake_requests):
+        """``run_steps`` reports the exit code and seconds taken of every step"""
+        fake_run_command.return_value.exitCode = 0
+        fake_requests.get.return_value.text = 'foo 0 1500\n'
+        steps = [provision.Step('foo', '/bin/true', 'foo failed')]
+
+        output = provision.run_steps(MagicMock(), MagicMock(), steps, MagicMock())
+        expected = [{'name': 'foo', 'exit_code': 0, 'seconds': 1.5}]
+
+        self.assertEqual(output, expected)
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_failure(self, fake_run_command, fake_requests):
+        """``run_steps`` logs the error of each step that failed"""
+        fake_run_command.return_value.exitCode = 1
+        fake_requests.get.return_value.text = 'foo 0 10\nbar 2 20\n'
+        fake_logger = MagicMock()
+        steps = [provision.Step('foo', '/bin/true', 'foo failed'),
+                 provision.Step('bar', '/bin/false', 'bar failed')]
+
+        output = provision.run_steps(MagicMock(), MagicMock(), steps, fake_logger)
+        expected = [{'name': 'foo', 'exit_code': 0, 'seconds': 0.01},
+                    {'name': 'bar', 'exit_code': 2, 'seconds': 0.02}]
+        errors = [x[0][0] for x in fake_logger.error.call_args_list]
+
+        self.assertEqual(output, expected)
+        self.assertTrue('bar failed' in errors)
+        self.assertFalse('foo failed' in errors)
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_never_ran(self, fake_run_command, fake_requests):
+        """``run_steps`` logs the steps the script never got to"""
+        fake_run_command.return_value.exitCode = 1
+        fake_requests.get.return_value.text = 'foo 1 10\nba'
+        fake_logger = MagicMock()
+        steps = [provision.Step('foo', '/bin/true', 'foo failed'),
+                 provision.Step('bar', '/bin/false', 'bar failed')]
+
+        provision.run_steps(MagicMock(), MagicMock(), steps, fake_logger)
+        errors = [x[0][0] for x in fake_logger.error.call_args_list]
+
+        self.assertTrue('bar failed (step never ran)' in errors)
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_upload(self, fake_run_command, fake_requests):
+        """``run_steps`` uploads the rendered script to the guest"""
+        fake_run_command.return_value.exitCode = 0
+        steps = [provision.Step('foo', '/bin/true', 'foo failed')]
+
+        provision.run_steps(MagicMock(), MagicMock(), steps, MagicMock())
+        uploaded = fake_requests.put.call_args[1]['data'].decode()
+
+        self.assertEqual(uploaded, provision.render_script(steps))
+
+    @patch.object(provision, 'requests')
+    @patch.object(provision.virtual_machine, 'run_command')
+    def test_run_steps_redacts(self, fake_run_command, fake_requests):
+        """``run_steps`` does not log the command of a failed step that has a secret in it"""
+        fake_run_command.return_value.exitCode = 1
+        fake_requests.get.return_value.text = 'ddns 1 10\n'
+        fake_logger = MagicMock()
+        steps = [provision.Step('ddns', '/bin/sed -i -e s/a/newKey/g /etc/environment', 'ddns failed', secret=True)]
+
+        provision.run_steps(MagicMock(), MagicMock(), steps, fake_logger)
+        errors = ' '.join(x[0][0] for x in fake_logger.error.call_args_list)
+
+        self.assertFalse('newKey' in errors)
+        self.assertTrue('CMD: <redacted>' in errors)
+
+    @patch.object(provision.time, 'sleep')
+    @patch.object(provision, 'requests')
+    def test_upload_tools_starting(self, fake_requests, fake_sleep):
+        """``_upload`` retries while VMware Tools is still starting"""
+        fake_vcenter = MagicMock()
+        file_manager = fake_vcenter.content.guestOperationsManager.fileManager
+        file_manager.InitiateFileTransferToGuest.side_effect = [provision.vim.fault.GuestOperationsUnavailable(),
+                                                                'https://esxi/guestFile']
+
+        provision._upload(fake_vcenter, MagicMock(), MagicMock(), '/tmp/foo', 'content')
+
+        self.assertEqual(fake_requests.put.call_args[0][0], 'https://esxi/guestFile')
+
+    @patch.object(provision.time, 'sleep')
+    @patch.object(provision, 'requests')
+    def test_upload_tools_timeout(self, fake_requests, fake_sleep):
+        """``_upload`` raises ValueError when VMware Tools never becomes available"""
+        fake_vcenter = MagicMock()
+        file_manager = fake_vcenter.content.guestOperationsManager.fileManager
+        file_manager.InitiateFileTransferToGuest.side_effect = provision.vim.fault.GuestOperationsUnavailable()
+
+        with self.assertRaises(ValueError):
+            provision._upload(fake_vcenter, MagicMock(), MagicMock(), '/tmp/foo', 'content')
+
+    @patch.object(provision, 'const')
+    @patch.object(provision.time, 'sleep')
+    @patch.object(provision, 'requests')
+    def test_upload_tools_boot_timeout(self, fake_requests, fake_sleep, fake_const):
+        """``_upload`` waits on VMware Tools for as long as a gateway has to boot"""
+        fake_const.VLAB_GATEWAY_BOOT_TIMEOUT = 20
+        fake_vcenter = MagicMock()
+        file_manager = fake_vcenter.content.guestOperationsManager.fileManager
+        file_manager.InitiateFileTransferToGuest.side_effect = provision.vim.fault.GuestOperationsUnavailable()
+
+        with self.assertRaises(ValueError):
+            provision._upload(fake_vcenter, MagicMock(), MagicMock(), '/tmp/foo', 'content')
+        waited = sum(x[0][0] for x in fake_sleep.call_args_list)
+
+        self.assertEqual(waited, 20)
+
+    @patch.object(provision.time, 'sleep')
+    @patch.object(provision, 'requests')
+    def test_upload_fails(self, fake_requests, fake_sleep):
+        """``_upload`` raises ValueError when the file cannot be written"""
+        fake_requests.RequestException = requests.RequestException
+        fake_requests.put.return_value.raise_for_status.side_effect = requests.HTTPError('500')
+
+        with self.assertRaises(ValueError):
+            provision._upload(MagicMock(), MagicMock(), MagicMock(), '/tmp/foo', 'content')
+
+    def test_download_missing(self):
+        """``_download`` raises ValueError, naming the file, when it does not exist"""
+        fake_vcenter = MagicMock()
+        file_manager = fake_vcenter.content.guestOperationsManager.fileManager
+        file_manager.InitiateFileTransferFromGuest.side_effect = provision.vim.fault.FileNotFound()
+
+        with self.assertRaises(ValueError) as err:
+            provision._download(fake_vcenter, MagicMock(), MagicMock(), provision.RESULTS_PATH)
+
+        self.assertTrue(provision.RESULTS_PATH in '{}'.format(err.exception))
+
+    @patch.object(provision, 'requests')
+    def test_download_fails(self, fake_requests):
+        """``_download`` raises ValueError when the file cannot be read"""
+        fake_requests.RequestException = requests.RequestException
+        fake_requests.get.return_value.raise_for_status.side_effect = requests.HTTPError('404')
+
+        with self.assertRaises(ValueError):
+            provision._download(MagicMock(), MagicMock(), MagicMock(), provision.RESULTS_PATH)
+
+
+if __name__ == '__main__':
+    unittest.main()
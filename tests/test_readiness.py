@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in readiness.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock, PropertyMock
+
+from vlab_gateway_api.lib.worker import readiness
+
+
+def _make_vm(states):
+    """Create a fake VM whose guest reports the supplied ready states, one per poll"""
+    fake_vm = MagicMock()
+    type(fake_vm.guest).guestOperationsReady = PropertyMock(side_effect=states)
+    fake_vm.guestHeartbeatStatus = 'green'
+    return fake_vm
+
+
+class TestReadiness(unittest.TestCase):
+    """A set of test cases for the readiness.py module"""
+
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_guest(self, fake_sleep):
+        """``wait_for_guest`` returns as soon as guest operations are ready"""
+        fake_vm = _make_vm([False, False, True])
+        fake_logger = MagicMock()
+
+        readiness.wait_for_guest(fake_vm, fake_logger)
+
+        self.assertEqual(fake_sleep.call_count, 2)
+
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_guest_backoff(self, fake_sleep):
+        """``wait_for_guest`` backs off exponentially between polls"""
+        fake_vm = _make_vm([False, False, False, False, False, True])
+        fake_logger = MagicMock()
+
+        readiness.wait_for_guest(fake_vm, fake_logger)
+        delays = [x[0][0] for x in fake_sleep.call_args_list]
+        expected = [1, 2, 4, 5, 5]
+
+        self.assertEqual(delays, expected)
+
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_guest_heartbeat(self, fake_sleep):
+        """``wait_for_guest`` waits on the heartbeat to be green"""
+        fake_vm = MagicMock()
+        fake_vm.guest.guestOperationsReady = True
+        type(fake_vm).guestHeartbeatStatus = PropertyMock(side_effect=['gray', 'yellow', 'green'])
+        fake_logger = MagicMock()
+
+        readiness.wait_for_guest(fake_vm, fake_logger)
+
+        self.assertEqual(fake_sleep.call_count, 2)
+
+    @patch.object(readiness.time, 'time')
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_guest_deadline(self, fake_sleep, fake_time):
+        """``wait_for_guest`` raises ValueError if the guest is not ready by the deadline"""
+        fake_time.side_effect = [0, 5, 11]
+        fake_vm = _make_vm([False, False, False])
+        fake_logger = MagicMock()
+
+        with self.assertRaises(ValueError):
+            readiness.wait_for_guest(fake_vm, fake_logger, deadline=10)
+
+    @patch.object(readiness.time, 'time')
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_guest_seconds(self, fake_sleep, fake_time):
+        """``wait_for_guest`` returns how long the guest took to boot"""
+        fake_time.side_effect = [100, 101, 130]
+        fake_vm = _make_vm([False, True])
+        fake_logger = MagicMock()
+
+        output = readiness.wait_for_guest(fake_vm, fake_logger)
+
+        self.assertEqual(output, 30)
+
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_reboot(self, fake_sleep):
+        """``wait_for_reboot`` waits for the guest to go down, then come back up"""
+        fake_vm = _make_vm([True, False, False, True])
+        fake_logger = MagicMock()
+
+        readiness.wait_for_reboot(fake_vm, fake_logger)
+
+        self.assertTrue('(reboot)' in fake_logger.info.call_args[0][0])
+
+    @patch.object(readiness.time, 'time')
+    @patch.object(readiness.time, 'sleep')
+    def test_wait_for_reboot_missed(self, fake_sleep, fake_time):
+        """``wait_for_reboot`` still waits on the guest if it never saw it go down"""
+        fake_time.side_effect = [0, 9000, 9000, 9000]
+        fake_vm = _make_vm([True, True])
+        fake_logger = MagicMock()
+
+        output = readiness.wait_for_reboot(fake_vm, fake_logger)
+
+        self.assertTrue(output is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the StoreBackend object
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from celery import Celery
+
+from vlab_gateway_api.lib import cache, result_backend
+
+
+class TestStoreBackend(unittest.TestCase):
+    """A set of test cases for the StoreBackend object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db')))
+        self.patcher.start()
+        self.app = Celery('test', backend='vlab_gateway_api.lib.result_backend:StoreBackend')
+        self.app.conf.result_serializer = 'json'
+        self.app.conf.result_expires = 60
+        self.backend = self.app.backend
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_configured(self):
+        """``StoreBackend`` can be selected by name in the Celery config"""
+        self.assertTrue(isinstance(self.backend, result_backend.StoreBackend))
+
+    def test_result(self):
+        """``StoreBackend`` returns the result stored by a task"""
+        self.backend.store_result('task1', {'content': {}, 'error': None, 'params': {}}, 'SUCCESS')
+
+        result = self.app.AsyncResult('task1')
+
+        self.assertEqual(result.status, 'SUCCESS')
+        self.assertEqual(result.result, {'content': {}, 'error': None, 'params': {}})
+
+    def test_result_many_reads(self):
+        """``StoreBackend`` results can be read more than once"""
+        self.backend.store_result('task1', {'error': None}, 'SUCCESS')
+
+        self.app.AsyncResult('task1').result
+        # Like a different API process asking for the same task
+        self.backend._cache.clear()
+        result = self.app.AsyncResult('task1')
+
+        self.assertEqual(result.result, {'error': None})
+
+    def test_result_expires(self):
+        """``StoreBackend`` stores results with the ``result_expires`` TTL"""
+        with patch.object(cache.STORE, 'set_raw') as fake_set_raw:
+            self.backend.store_result('task1', {'error': None}, 'SUCCESS')
+
+        self.assertEqual(fake_set_raw.call_args[1]['ttl'], 60)
+
+    def test_unknown(self):
+        """``StoreBackend`` reports an unknown task as pending"""
+        self.assertEqual(self.app.AsyncResult('task1').status, 'PENDING')
+
+    def test_forget(self):
+        """``StoreBackend`` deletes a forgotten result"""
+        self.backend.store_result('task1', {'error': None}, 'SUCCESS')
+        self.app.AsyncResult('task1').forget()
+        self.backend._cache.clear()
+
+        self.assertEqual(self.app.AsyncResult('task1').status, 'PENDING')
+
+    @patch.object(result_backend.random, 'randint')
+    def test_purges(self, fake_randint):
+        """``StoreBackend`` occasionally deletes expired results when storing one"""
+        fake_randint.return_value = 1
+        with patch.object(cache.STORE, 'purge') as fake_purge:
+            self.backend.store_result('task1', {'error': None}, 'SUCCESS')
+
+        self.assertTrue(fake_purge.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
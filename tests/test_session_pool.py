@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the SessionPool object
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_gateway_api.lib.worker import session_pool
+
+
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the SessionPool object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.factory = MagicMock()
+        self.factory.side_effect = lambda: MagicMock()
+        self.pool = session_pool.SessionPool(factory=self.factory,
+                                             max_sessions=2,
+                                             check_after=60)
+
+    def test_reuses_session(self):
+        """SessionPool - hands out the same session to back-to-back callers"""
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+
+    def test_one_login(self):
+        """SessionPool - only logs into vCenter once for back-to-back callers"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_stats(self):
+        """SessionPool - ``stats`` counts pool hits and misses"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+
+        stats = self.pool.stats()
+        expected = {'hits': 1, 'misses': 1, 'reconnects': 0, 'open': 1, 'idle': 1}
+
+        self.assertEqual(stats, expected)
+
+    def test_concurrent_sessions(self):
+        """SessionPool - callers in parallel get different sessions"""
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                pass
+
+        self.assertFalse(first is second)
+
+    def test_max_sessions(self):
+        """SessionPool - blocks once ``max_sessions`` are checked out"""
+        with self.pool.session():
+            with self.pool.session():
+                acquired = self.pool._slots.acquire(blocking=False)
+
+        self.assertFalse(acquired)
+
+    @patch.object(session_pool.metrics, 'session_checkout')
+    def test_metrics(self, fake_session_checkout):
+        """SessionPool - counts every checkout on the session metric"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+        outcomes = [x[0][0] for x in fake_session_checkout.call_args_list]
+
+        self.assertEqual(outcomes, ['miss', 'hit'])
+
+    @patch.object(session_pool.metrics, 'session_checkout')
+    @patch.object(session_pool.time, 'time')
+    def test_expired_session(self, fake_time, fake_session_checkout):
+        """SessionPool - logs in again when vCenter expired an idle session"""
+        fake_time.side_effect = [0, 9000, 9000]
+        with self.pool.session() as first:
+            first.content.sessionManager.currentSession = None
+        with self.pool.session() as second:
+            pass
+
+        self.assertFalse(first is second)
+        self.assertTrue(first.close.called)
+        self.assertEqual(self.pool.stats()['reconnects'], 1)
+
+    @patch.object(session_pool.metrics, 'session_checkout')
+    @patch.object(session_pool.time, 'time')
+    def test_checks_idle_session(self, fake_time, fake_session_checkout):
+        """SessionPool - keeps using an idle session that vCenter still honors"""
+        fake_time.side_effect = [0, 9000, 9000]
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+
+    def test_session_error(self):
+        """SessionPool - does not reuse a session that raised an authentication error"""
+        with self.assertRaises(session_pool.vim.fault.NotAuthenticated):
+            with self.pool.session() as first:
+                raise session_pool.vim.fault.NotAuthenticated()
+        with self.pool.session() as second:
+            pass
+
+        self.assertFalse(first is second)
+
+    def test_task_error(self):
+        """SessionPool - keeps a session when the task raised a non-session error"""
+        with self.assertRaises(ValueError):
+            with self.pool.session() as first:
+                raise ValueError('testing')
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+
+    def test_close(self):
+        """SessionPool - ``close`` logs out idle sessions"""
+        with self.pool.session() as vcenter:
+            pass
+        self.pool.close()
+
+        self.assertTrue(vcenter.close.called)
+        self.assertEqual(self.pool.stats()['open'], 0)
+
+    def test_reset(self):
+        """SessionPool - ``reset`` forgets sessions without logging out"""
+        with self.pool.session() as vcenter:
+            pass
+        self.pool.reset()
+
+        self.assertFalse(vcenter.close.called)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# -*- coding: UTF-8 -*-
+"""
+End-to-end tests of the worker against the fake vCenter in fake_vcenter.py
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_gateway_api.lib import cache
+from vlab_gateway_api.lib.worker import vmware, tasks, profile
+from tests.fake_vcenter import FakeServer, simulate
+
+
+class TestSimulated(unittest.TestCase):
+    """A set of end-to-end tests for vmware.py"""
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = logging.getLogger(__name__)
+
+    def setUp(self):
+        self.server = FakeServer(networks=['frontend', 'backend'])
+        self.folder = self.server.add_user('alice')
+        self.simulation = simulate(self.server)
+        self.simulation.__enter__()
+
+    def tearDown(self):
+        self.simulation.__exit__(None, None, None)
+
+    def _delete(self, username):
+        """Delete a gateway like the delete/delete_wait tasks do"""
+        deleting = vmware.delete_gateway(username, self.logger)
+        while deleting is not None:
+            deleting = vmware.delete_step(deleting, self.logger)
+
+    def test_lifecycle(self):
+        """A gateway can be created, shown, and deleted"""
+        created = vmware.create_gateway('alice', 'frontend', 'backend', self.logger)
+        shown = vmware.show_gateway('alice')
+        self._delete('alice')
+        setup = created.pop('setup')
+
+        self.assertEqual(created, shown)
+        self.assertTrue(all(x['exit_code'] == 0 for x in setup))
+        self.assertTrue(shown['meta']['configured'])
+        self.assertEqual(vmware.show_gateway('alice'), {})
+        self.assertEqual(self.server.vms(self.folder), [])
+
+    def test_reconfigure(self):
+        """A new gateway already has the profile, and only a changed setting is applied"""
+        vmware.create_gateway('alice', 'frontend', 'backend', self.logger)
+        unchanged = vmware.reconfigure_gateway('alice', self.logger)
+        settings = profile.load(vmware.resolve_name('localhost')).settings
+        settings['ntp'] = '10.9.9.9'
+        with patch.object(vmware.profile, 'load', return_value=profile.Profile('1.1.0', settings)):
+            changed = vmware.reconfigure_gateway('alice', self.logger)
+        shown = vmware.show_gateway('alice')
+
+        self.assertEqual(unchanged['changed'], [])
+        self.assertEqual(changed['changed'], ['ntp'])
+        self.assertEqual(shown['meta']['version'], '1.1.0')
+        self.assertEqual(shown['meta']['generation'], 2)
+
+    def test_create_bad_network(self):
+        """``create_gateway`` raises ValueError for a network vCenter doesn't have"""
+        with self.assertRaises(ValueError):
+            vmware.create_gateway('alice', 'nope', 'backend', self.logger)
+
+    def test_show_round_trips(self):
+        """Once warm, ``show_gateway`` costs the same round trips no matter how many VMs a user has"""
+        vmware.create_gateway('alice', 'frontend', 'backend', self.logger)
+        vmware.show_gateway('alice')
+        self.server.calls.clear()
+        vmware.show_gateway('alice')
+        few = sum(self.server.calls.values())
+
+        for idx in range(50):
+            self.server.add_vm(self.folder, 'someVM{}'.format(idx))
+        vmware.show_gateway('alice')
+        self.server.calls.clear()
+        vmware.show_gateway('alice')
+        many = sum(self.server.calls.values())
+
+        self.assertEqual(few, many)
+
+    def test_fleet(self):
+        """``list_fleet`` costs the same round trips no matter how many users have a gateway"""
+        vmware.create_gateway('alice', 'frontend', 'backend', self.logger)
+        for idx in range(20):
+            self.server.add_vm(self.server.add_user('user{}'.format(idx)), vmware.COMPONENT_NAME)
+        vmware.list_fleet()
+        self.server.calls.clear()
+        first = vmware.list_fleet()
+        few = sum(self.server.calls.values())
+
+        for idx in range(20, 60):
+            self.server.add_vm(self.server.add_user('user{}'.format(idx)), vmware.COMPONENT_NAME)
+        vmware.list_fleet()
+        self.server.calls.clear()
+        everyone = vmware.list_fleet(limit=100)
+        many = sum(self.server.calls.values())
+
+        self.assertEqual(first['gateways'][0]['username'], 'alice')
+        self.assertEqual(first['gateways'][0]['version'], profile.DEFAULT_VERSION)
+        self.assertEqual(len(everyone['gateways']), 61)
+        self.assertEqual(few, many)
+
+    def test_delete_waits_concurrently(self):
+        """``delete_step`` waits on every power off at once, not one after another"""
+        self.server.task_time['PowerOffVM_Task'] = 0.2
+        for _ in range(5):
+            self.server.add_vm(self.folder, vmware.COMPONENT_NAME)
+
+        started = time.time()
+        self._delete('alice')
+        elapsed = time.time() - started
+
+        self.assertEqual(self.server.vms(self.folder), [])
+        self.assertLess(elapsed, 0.2 * 5)
+
+    def test_delete_powered_off(self):
+        """Deleting a gateway that's already powered off works"""
+        self.server.add_vm(self.folder, vmware.COMPONENT_NAME, powered_on=False)
+
+        self._delete('alice')
+
+        self.assertEqual(self.server.vms(self.folder), [])
+
+
+class TestSimulatedTasks(unittest.TestCase):
+    """A set of end-to-end tests for tasks.py"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = FakeServer(networks=['frontend', 'backend'])
+        self.server.add_user('alice')
+        self.patchers = [patch.object(cache, 'STORE', cache.Store(os.path.join(self.tmp_dir, 'test.db'))),
+                         simulate(self.server)]
+        for patcher in self.patchers:
+            patcher.__enter__()
+
+    def tearDown(self):
+        for patcher in reversed(self.patchers):
+            patcher.__exit__(None, None, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lifecycle(self):
+        """The create, show, and delete tasks work together"""
+        created = tasks.create.apply(args=['alice', 'frontend', 'backend', 'defaultgateway-IPAM.ova', 'myId']).get()
+        shown = tasks.show.apply(args=['alice', 'myId']).get()
+        deleted = tasks.delete.apply(args=['alice', 'myId']).get()
+        gone = tasks.show.apply(args=['alice', 'myId']).get()
+
+        self.assertEqual(created['error'], None)
+        self.assertEqual(created['content']['moid'], shown['content']['moid'])
+        self.assertEqual(deleted['error'], None)
+        self.assertEqual(gone['content'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in task_waiter.py
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from vlab_gateway_api.lib.worker import task_waiter
+
+
+vmodl = task_waiter.vmodl
+vim = task_waiter.vim
+
+
+def _update(moid, **props):
+    """Create the ObjectUpdate the PropertyCollector sends when a task changes"""
+    changes = [vmodl.query.PropertyCollector.Change(name=k.replace('_', '.'), op='assign', val=v) for k, v in props.items()]
+    return vmodl.query.PropertyCollector.ObjectUpdate(obj=vim.Task(moid), kind='enter', changeSet=changes)
+
+
+def _result(version, updates, truncated=False):
+    """Create the output of WaitForUpdatesEx"""
+    filter_set = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+    return vmodl.query.PropertyCollector.UpdateSet(version=version, filterSet=[filter_set], truncated=truncated)
+
+
+class TestTaskWaiter(unittest.TestCase):
+    """A set of test cases for task_waiter.py"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+
+    def test_watch(self):
+        """``watch`` returns the state of every task once they're all done"""
+        fault = vim.fault.InvalidPowerState(msg='already off')
+        self.collector.WaitForUpdatesEx.side_effect = [
+            _result('1', [_update('task-1', info_state='running', info_error=None),
+                          _update('task-2', info_state='error', info_error=fault)]),
+            _result('2', [_update('task-1', info_state='success')]),
+        ]
+
+        output = task_waiter.watch(self.fake_vcenter, ['task-1', 'task-2'], max_wait=10)
+
+        self.assertEqual(output['task-1'], {'state': 'success', 'error': None})
+        self.assertTrue(output['task-2']['error'] is fault)
+
+    def test_watch_one_collector(self):
+        """``watch`` uses a single PropertyCollector for every task"""
+        self.collector.WaitForUpdatesEx.side_effect = [
+            _result('1', [_update('task-1', info_state='success', info_error=None),
+                          _update('task-2', info_state='success', info_error=None)]),
+        ]
+
+        task_waiter.watch(self.fake_vcenter, ['task-1', 'task-2'], max_wait=10)
+        filter_spec = self.collector.CreateFilter.call_args[0][0]
+
+        self.assertEqual(len(filter_spec.objectSet), 2)
+        self.assertEqual(self.collector.WaitForUpdatesEx.call_count, 1)
+
+    def test_watch_timeout(self):
+        """``watch`` returns the tasks that are still running once nothing changes"""
+        self.collector.WaitForUpdatesEx.side_effect = [
+            _result('1', [_update('task-1', info_state='running', info_error=None)]),
+            None,
+        ]
+
+        output = task_waiter.watch(self.fake_vcenter, ['task-1'], max_wait=10)
+
+        self.assertFalse(task_waiter.all_finished(output))
+
+    def test_watch_destroys_collector(self):
+        """``watch`` destroys its PropertyCollector, even if vCenter has an error"""
+        self.collector.WaitForUpdatesEx.side_effect = [RuntimeError('testing')]
+
+        with self.assertRaises(RuntimeError):
+            task_waiter.watch(self.fake_vcenter, ['task-1'], max_wait=10)
+
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+    def test_watch_nothing(self):
+        """``watch`` doesn't talk to vCenter when there are no tasks"""
+        output = task_waiter.watch(self.fake_vcenter, [], max_wait=10)
+
+        self.assertEqual(output, {})
+        self.assertFalse(self.collector.CreateFilter.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -39,7 +39,7 @@ class TestTasks(unittest.TestCase):
         """``create`` returns a dictionary when everything works as expected"""
         fake_vmware.create_gateway.return_value = {'worked': True}
 
-        output = tasks.create(username='bob', wan='SomeWan', lan='someLan', txn_id='myId')
+        output = tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
         expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
 
         self.assertEqual(output, expected)
@@ -50,7 +50,7 @@ class TestTasks(unittest.TestCase):
         """``create`` sets the error in the dictionary to the ValueError message"""
         fake_vmware.create_gateway.side_effect = [ValueError("testing")]
 
-        output = tasks.create(username='bob', wan='SomeWan', lan='someLan', txn_id='myId')
+        output = tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
         expected = {'content' : {}, 'error': 'testing', 'params': {}}
 
         self.assertEqual(output, expected)
@@ -59,12 +59,65 @@ class TestTasks(unittest.TestCase):
     @patch.object(tasks, 'vmware')
     def test_delete_ok(self, fake_vmware, fake_get_task_logger):
         """``delete`` returns a dictionary when everything works as expected"""
-        fake_vmware.delete_gateway.return_value = {'worked': True}
+        fake_vmware.delete_gateway.return_value = None
 
         output = tasks.delete(username='bob', txn_id='myId')
-        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+        expected = {'content' : {}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks.delete, 'replace')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_delete_replaced(self, fake_vmware, fake_get_task_logger, fake_replace):
+        """``delete`` hands off to ``delete_wait`` once the VMs are powering off"""
+        fake_vmware.delete_gateway.return_value = {'stage': 'power'}
+
+        tasks.delete(username='bob', txn_id='myId')
+        wait = fake_replace.call_args[0][0]
+
+        self.assertEqual(wait.task, 'gateway.delete_wait')
+        self.assertEqual(wait.args, ('bob', {'stage': 'power'}, 'myId'))
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_delete_wait(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``delete_wait`` returns a dictionary once every VM is destroyed"""
+        fake_vmware.delete_step.return_value = None
+
+        output = tasks.delete_wait(username='bob', deleting={'stage': 'destroy'}, txn_id='myId')
+        expected = {'content' : {}, 'error': None, 'params': {}}
 
         self.assertEqual(output, expected)
+        self.assertTrue(fake_cache.invalidate_show.called)
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_delete_wait_error(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``delete_wait`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.delete_step.side_effect = [ValueError('testing')]
+
+        output = tasks.delete_wait(username='bob', deleting={'stage': 'destroy'}, txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks.delete_wait, 'retry')
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_delete_wait_retry(self, fake_vmware, fake_get_task_logger, fake_cache, fake_retry):
+        """``delete_wait`` retries with the new progress until vCenter is done"""
+        fake_vmware.delete_step.return_value = {'stage': 'destroy'}
+        fake_retry.return_value = RuntimeError('retry')
+
+        with self.assertRaises(RuntimeError):
+            tasks.delete_wait(username='bob', deleting={'stage': 'power'}, txn_id='myId')
+        _, the_kwargs = fake_retry.call_args
+
+        self.assertEqual(the_kwargs['args'], ['bob', {'stage': 'destroy'}, 'myId'])
 
     @patch.object(tasks, 'get_task_logger')
     @patch.object(tasks, 'vmware')
@@ -77,6 +130,390 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_reconfigure(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``reconfigure`` returns what was changed, and drops the cached show of the gateway"""
+        fake_vmware.reconfigure_gateway.return_value = {'changed': ['ntp'], 'setup': [], 'rebooted': False}
+
+        output = tasks.reconfigure(username='bob', txn_id='myId')
+        expected = {'content' : {'changed': ['ntp'], 'setup': [], 'rebooted': False}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.assertTrue(fake_cache.invalidate_show.called)
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_reconfigure_value_error(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``reconfigure`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.reconfigure_gateway.side_effect = [ValueError("testing")]
+
+        output = tasks.reconfigure(username='bob', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_show_caches(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``show`` caches the info, unless it was invalidated while querying vCenter"""
+        fake_vmware.show_gateway.return_value = {'worked': True}
+        fake_cache.show_generation.return_value = 3
+
+        tasks.show(username='bob', txn_id='myId')
+
+        fake_cache.set_show.assert_called_with('bob', {'worked': True}, 3)
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_show_error_not_cached(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``show`` does not cache errors"""
+        fake_vmware.show_gateway.side_effect = [ValueError("testing")]
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.assertFalse(fake_cache.set_show.called)
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_create_invalidates(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``create`` invalidates the cached info before and after creating the gateway"""
+        tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
+
+        self.assertEqual(fake_cache.invalidate_show.call_count, 2)
+
+    @patch.object(tasks, 'cache')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_delete_invalidates(self, fake_vmware, fake_get_task_logger, fake_cache):
+        """``delete`` invalidates the cached info, even if the delete fails"""
+        fake_vmware.delete_gateway.side_effect = [ValueError("testing")]
+
+        tasks.delete(username='bob', txn_id='myId')
+
+        self.assertEqual(fake_cache.invalidate_show.call_count, 2)
+
+    @patch.object(tasks, 'dispatch')
+    @patch.object(tasks, 'bulk')
+    @patch.object(tasks, 'get_task_logger')
+    def test_bulk_dispatch(self, fake_get_task_logger, fake_bulk, fake_dispatch):
+        """``bulk_dispatch`` sends a task for every user in the batch"""
+        entry = {'wan': 'someWAN', 'lan': 'alice_lan'}
+        fake_bulk.next_batch.return_value = ('create', [('alice', entry, 'task1')], True)
+        fake_dispatch.send_once.return_value = 'task1'
+
+        tasks.bulk_dispatch('bulk1', 'myId')
+
+        fake_dispatch.send_once.assert_called_with(tasks.app, 'create', 'alice', ['someWAN', 'alice_lan', 'defaultgateway-IPAM.ova'], 'myId',
+                                                   fake_get_task_logger.return_value, task_id='task1')
+        self.assertFalse(fake_bulk.follow.called)
+
+    @patch.object(tasks, 'dispatch')
+    @patch.object(tasks, 'bulk')
+    @patch.object(tasks, 'get_task_logger')
+    def test_bulk_dispatch_inflight(self, fake_get_task_logger, fake_bulk, fake_dispatch):
+        """``bulk_dispatch`` waits on the task a user already has in flight"""
+        fake_bulk.next_batch.return_value = ('delete', [('alice', {}, 'task1')], True)
+        fake_dispatch.send_once.return_value = 'userTask'
+
+        tasks.bulk_dispatch('bulk1', 'myId')
+
+        fake_bulk.follow.assert_called_with('task1', 'userTask')
+
+    @patch.object(tasks.bulk_dispatch, 'apply_async')
+    @patch.object(tasks, 'app')
+    @patch.object(tasks, 'bulk')
+    @patch.object(tasks, 'get_task_logger')
+    def test_bulk_dispatch_reschedules(self, fake_get_task_logger, fake_bulk, fake_app, fake_apply_async):
+        """``bulk_dispatch`` reschedules itself until the bulk operation is complete"""
+        fake_bulk.next_batch.return_value = ('delete', [], False)
+
+        tasks.bulk_dispatch('bulk1', 'myId')
+
+        self.assertTrue(fake_apply_async.called)
+
+    @patch.object(tasks, 'bulk')
+    def test_record_bulk(self, fake_bulk):
+        """``_record_bulk`` records the error from a create/delete task"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.create'
+
+        tasks._record_bulk(task_id='task1', task=fake_task, retval={'error': 'doh'}, state='SUCCESS')
+
+        fake_bulk.record_result.assert_called_with('task1', 'doh')
+
+    @patch.object(tasks, 'bulk')
+    def test_record_bulk_other(self, fake_bulk):
+        """``_record_bulk`` ignores other tasks"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.show'
+
+        tasks._record_bulk(task_id='task1', task=fake_task, retval={'error': None}, state='SUCCESS')
+
+        self.assertFalse(fake_bulk.record_result.called)
+
+    @patch.object(tasks, 'bulk')
+    def test_record_bulk_retry(self, fake_bulk):
+        """``_record_bulk`` ignores a create/delete task that's being retried"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.create'
+
+        tasks._record_bulk(task_id='task1', task=fake_task, retval=MagicMock(), state='RETRY')
+
+        self.assertFalse(fake_bulk.record_result.called)
+
+    @patch.object(tasks, 'cache')
+    def test_release_inflight(self, fake_cache):
+        """``_release_inflight`` releases the claim the API made for the task"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.create'
+
+        tasks._release_inflight(task_id='task1', task=fake_task, args=['bob', 'wan', 'lan', 'txn'], state='SUCCESS')
+
+        fake_cache.release_inflight.assert_called_with('create', 'bob', ['wan', 'lan'], 'task1')
+
+    @patch.object(tasks, 'cache')
+    def test_release_inflight_delete_wait(self, fake_cache):
+        """``_release_inflight`` releases the claim of the gateway.delete that ``delete_wait`` took over"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.delete_wait'
+
+        tasks._release_inflight(task_id='task1', task=fake_task, args=['bob', {}, 'txn'], state='SUCCESS')
+
+        fake_cache.release_inflight.assert_called_with('delete', 'bob', [], 'task1')
+
+    @patch.object(tasks, 'progress')
+    def test_publish_result(self, fake_progress):
+        """``_publish_result`` publishes the output of a create as the last event"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.create'
+        retval = {'content': {}, 'error': None, 'params': {}}
+
+        tasks._publish_result(task_id='task1', task=fake_task, args=['bob', 'wan', 'lan', 'txn'],
+                              retval=retval, state='SUCCESS')
+
+        fake_progress.publish.assert_called_with('task1', 'bob', fake_progress.COMPLETE, retval)
+
+    @patch.object(tasks, 'progress')
+    def test_publish_result_error(self, fake_progress):
+        """``_publish_result`` publishes a failed event when the task had an error"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.delete_wait'
+        retval = {'content': {}, 'error': 'doh', 'params': {}}
+
+        tasks._publish_result(task_id='task1', task=fake_task, args=['bob', {}, 'txn'],
+                              retval=retval, state='SUCCESS')
+
+        fake_progress.publish.assert_called_with('task1', 'bob', fake_progress.FAILED, retval)
+
+    @patch.object(tasks, 'progress')
+    def test_publish_result_replaced(self, fake_progress):
+        """``_publish_result`` ignores a delete that delete_wait took over"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.delete'
+
+        tasks._publish_result(task_id='task1', task=fake_task, args=['bob', 'txn'],
+                              retval=MagicMock(), state='IGNORED')
+
+        self.assertFalse(fake_progress.publish.called)
+
+    @patch.object(tasks, 'cache')
+    def test_release_inflight_retry(self, fake_cache):
+        """``_release_inflight`` keeps the claim while the task is being retried"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.delete'
+
+        tasks._release_inflight(task_id='task1', task=fake_task, args=['bob', 'txn'], state='RETRY')
+
+        self.assertFalse(fake_cache.release_inflight.called)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_show_time_limit(self, fake_vmware, fake_get_task_logger):
+        """``show`` returns an error if it runs out of time"""
+        fake_vmware.show_gateway.side_effect = [tasks.SoftTimeLimitExceeded()]
+
+        output = tasks.show(username='bob', txn_id='myId')
+        expected = {'content' : {}, 'error': 'Timed out looking up gateway; try again later', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_routes(self):
+        """Reads and provisioning tasks go to different queues"""
+        router = tasks.app.amqp.router
+        read_queue = router.route({}, 'gateway.show')['queue'].name
+        provision_queue = router.route({}, 'gateway.create')['queue'].name
+
+        self.assertNotEqual(read_queue, provision_queue)
+
+    def test_show_priority(self):
+        """``gateway.show`` has priority over the other reads"""
+        route = tasks.app.amqp.router.route({}, 'gateway.show')
+
+        self.assertEqual(route['priority'], tasks.app.conf.task_queues[0].queue_arguments['x-max-priority'])
+
+    @patch.object(tasks.create, 'retry')
+    @patch.object(tasks.admission, 'admit')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_create_busy(self, fake_vmware, fake_get_task_logger, fake_admit, fake_retry):
+        """``create`` is retried later when there are too many creates running"""
+        fake_admit.return_value.__enter__.side_effect = tasks.admission.Busy('create', 2)
+        fake_retry.return_value = RuntimeError('retry')
+
+        with self.assertRaises(RuntimeError):
+            tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
+
+        self.assertFalse(fake_vmware.create_gateway.called)
+        self.assertTrue(fake_retry.called)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_networks(self, fake_vmware, fake_get_task_logger):
+        """``networks`` returns the names of the networks in vCenter"""
+        fake_vmware.network_names.return_value = ['someWAN']
+
+        output = tasks.networks(txn_id='myId')
+        expected = {'content' : ['someWAN'], 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_fleet(self, fake_vmware, fake_get_task_logger):
+        """``fleet`` returns a page of gateways, with the filters it was sent"""
+        fake_vmware.list_fleet.return_value = {'gateways': [], 'next': None}
+
+        output = tasks.fleet(username='admin', version='1.0.0', generation=2, after='bob:vm-1', limit=10, txn_id='myId')
+
+        self.assertEqual(output['content'], {'gateways': [], 'next': None})
+        fake_vmware.list_fleet.assert_called_with(version='1.0.0', generation=2, after='bob:vm-1', limit=10)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_fleet_timeout(self, fake_vmware, fake_get_task_logger):
+        """``fleet`` sets the error when listing the gateways takes too long"""
+        fake_vmware.list_fleet.side_effect = tasks.SoftTimeLimitExceeded()
+
+        output = tasks.fleet(username='admin', version=None, generation=None, after=None, limit=10, txn_id='myId')
+
+        self.assertTrue(output['error'].startswith('Timed out'))
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'images')
+    def test_image(self, fake_images, fake_get_task_logger):
+        """``image`` returns the catalog of gateway images"""
+        fake_images.refresh.return_value = [{'image': 'gw.ova'}]
+
+        output = tasks.image(txn_id='myId')
+        expected = {'content' : [{'image': 'gw.ova'}], 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'images')
+    def test_image_error(self, fake_images, fake_get_task_logger):
+        """``image`` sets the error when the images dir cannot be read"""
+        fake_images.refresh.side_effect = FileNotFoundError('testing')
+
+        output = tasks.image(txn_id='myId')
+
+        self.assertEqual(output['error'], 'Unable to list gateway images')
+
+    @patch.object(tasks, 'images')
+    def test_refresh_images(self, fake_images):
+        """``_refresh_images`` logs, instead of raising, when the images dir cannot be read"""
+        fake_images.refresh.side_effect = FileNotFoundError('testing')
+        fake_logger = MagicMock()
+
+        tasks._refresh_images(fake_logger, checksums=True)
+
+        self.assertTrue(fake_logger.error.called)
+
+    @patch.object(tasks.threading, 'Thread')
+    def test_check_in(self, fake_Thread):
+        """``_check_in`` starts checking in as a live worker, with how vCenter is doing"""
+        sender = MagicMock()
+        sender.hostname = 'celery@a'
+
+        tasks._check_in(sender)
+        kwargs = fake_Thread.call_args[1]
+
+        self.assertEqual(kwargs['target'], tasks.health.heartbeat_forever)
+        self.assertEqual(kwargs['args'], ('celery@a', tasks.vmware.check_session))
+        self.assertTrue(fake_Thread.return_value.start.called)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_create_image(self, fake_vmware, fake_get_task_logger):
+        """``create`` deploys the image it was sent"""
+        tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
+
+        self.assertEqual(fake_vmware.create_gateway.call_args[1]['image_name'], 'gw.ova')
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_pool_refill(self, fake_vmware, fake_get_task_logger):
+        """``pool_refill`` fills the warm pool of spare gateways"""
+        tasks.pool_refill(txn_id='myId')
+
+        self.assertTrue(fake_vmware.refill_pool.called)
+
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_pool_refill_fails(self, fake_vmware, fake_get_task_logger):
+        """``pool_refill`` logs, instead of raising, when a spare cannot be added"""
+        fake_logger = MagicMock()
+        fake_get_task_logger.return_value = fake_logger
+        fake_vmware.refill_pool.side_effect = ValueError('testing')
+
+        tasks.pool_refill(txn_id='myId')
+
+        fake_logger.error.assert_called_with('Task failed: testing')
+
+    @patch.object(tasks, 'pool_refill')
+    @patch.object(tasks, 'const')
+    @patch.object(tasks, 'get_task_logger')
+    @patch.object(tasks, 'vmware')
+    def test_create_refills_pool(self, fake_vmware, fake_get_task_logger, fake_const, fake_pool_refill):
+        """``create`` refills the warm pool when it's enabled"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 2
+
+        tasks.create(username='bob', wan='SomeWan', lan='someLan', image='gw.ova', txn_id='myId')
+
+        self.assertTrue(fake_pool_refill.delay.called)
+
+
+    @patch.object(tasks, 'metrics')
+    def test_bind_metrics_args(self, fake_metrics):
+        """``_bind_metrics`` tags the metrics with the txn_id, when it's a positional argument"""
+        tasks._bind_metrics(task_id='task1', task=MagicMock(), args=['bob', 'txn'], kwargs={})
+
+        fake_metrics.bind.assert_called_with('txn')
+
+    @patch.object(tasks, 'metrics')
+    def test_bind_metrics_kwargs(self, fake_metrics):
+        """``_bind_metrics`` tags the metrics with the txn_id, when it's a keyword argument"""
+        tasks._bind_metrics(task_id='task1', task=MagicMock(), args=[], kwargs={'txn_id': 'beat'})
+
+        fake_metrics.bind.assert_called_with('beat')
+
+    @patch.object(tasks, 'metrics')
+    def test_record_metrics(self, fake_metrics):
+        """``_record_metrics`` records how long the task took, and how it ended"""
+        fake_task = MagicMock()
+        fake_task.name = 'gateway.show'
+
+        tasks._record_metrics(task_id='task1', task=fake_task, state='SUCCESS')
+
+        fake_metrics.task_done.assert_called_with('gateway.show', 'SUCCESS')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,232 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in template.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_gateway_api.lib.worker import template
+
+
+def _make_network(moid):
+    """Create a standard network whose properties are served by a fake stub"""
+    stub = MagicMock()
+    stub.InvokeAccessor.return_value = 'network-{}'.format(moid)
+    return template.vim.Network(moid, stub)
+
+
+def _make_nic(label, network):
+    """Create a virtual NIC connected to a standard network"""
+    nic = template.vim.vm.device.VirtualE1000()
+    nic.deviceInfo = template.vim.Description(label=label, summary=label)
+    nic.backing = template.vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(network=network)
+    return nic
+
+
+class TestTemplate(unittest.TestCase):
+    """A set of test cases for the template.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.wan = _make_network('wan-1')
+        self.lan = _make_network('lan-1')
+        wan_map = template.vim.OvfManager.NetworkMapping(name='wan', network=self.wan)
+        lan_map = template.vim.OvfManager.NetworkMapping(name='lan', network=self.lan)
+        self.network_map = [wan_map, lan_map]
+        self.fake_template = MagicMock()
+        self.fake_template.name = 'defaultgateway-IPAM-1234'
+        self.fake_template.config.hardware.device = [_make_nic('Network adapter 1', self.lan),
+                                                     _make_nic('Network adapter 2', self.wan)]
+        self.fake_template.config.annotation = ujson.dumps({'nics': {'wan': 'Network adapter 2',
+                                                                     'lan': 'Network adapter 1'}})
+        self.fake_template.snapshot.currentSnapshot = template.vim.vm.Snapshot('snapshot-1')
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.resource_pools = {'Resources': template.vim.ResourcePool('resgroup-1')}
+
+    @patch.object(template.os, 'stat')
+    def test_template_name(self, fake_stat):
+        """``template_name`` includes the modified time of the OVA"""
+        fake_stat.return_value.st_mtime = 1234.5
+
+        output = template.template_name('/images/defaultgateway-IPAM.ova')
+        expected = 'defaultgateway-IPAM-1234'
+
+        self.assertEqual(output, expected)
+
+    @patch.object(template.os, 'stat')
+    def test_template_name_valid(self, fake_stat):
+        """``template_name`` only uses characters that are valid in a VM name"""
+        fake_stat.return_value.st_mtime = 1234
+
+        output = template.template_name('/images/gateway_v1.2.ova')
+        expected = 'gateway-v1-2-1234'
+
+        self.assertEqual(output, expected)
+
+    @patch.object(template, 'template_name')
+    @patch.object(template, '_import_template')
+    def test_get_template_exists(self, fake_import_template, fake_template_name):
+        """``get_template`` does not import an OVA that already has a template"""
+        fake_template_name.return_value = 'defaultgateway-IPAM-1234'
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value.childEntity = [self.fake_template]
+
+        output = template.get_template(fake_vcenter, MagicMock(), '/images/foo.ova', self.network_map, MagicMock())
+
+        self.assertTrue(output is self.fake_template)
+        self.assertFalse(fake_import_template.called)
+
+    @patch.object(template.cache, 'release_template_import')
+    @patch.object(template.cache, 'claim_template_import')
+    @patch.object(template, 'template_name')
+    @patch.object(template, '_import_template')
+    def test_get_template_imports(self, fake_import_template, fake_template_name, fake_claim, fake_release):
+        """``get_template`` imports the OVA when there's no template for it"""
+        fake_template_name.return_value = 'defaultgateway-IPAM-1234'
+        fake_claim.return_value = True
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value.childEntity = []
+
+        template.get_template(fake_vcenter, MagicMock(), '/images/foo.ova', self.network_map, MagicMock())
+
+        self.assertTrue(fake_import_template.called)
+        fake_release.assert_called_with('defaultgateway-IPAM-1234')
+
+    @patch.object(template.cache, 'claim_template_import')
+    @patch.object(template, 'template_name')
+    @patch.object(template, '_import_template')
+    def test_get_template_importing(self, fake_import_template, fake_template_name, fake_claim):
+        """``get_template`` returns None while another worker imports the template"""
+        fake_template_name.return_value = 'defaultgateway-IPAM-1234'
+        fake_claim.return_value = False
+        self.fake_template.snapshot = None
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value.childEntity = [self.fake_template]
+
+        output = template.get_template(fake_vcenter, MagicMock(), '/images/foo.ova', self.network_map, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_import_template.called)
+        self.assertFalse(self.fake_template.Destroy_Task.called)
+
+    @patch.object(template, 'consume_task')
+    @patch.object(template.cache, 'release_template_import')
+    @patch.object(template.cache, 'claim_template_import')
+    @patch.object(template, 'template_name')
+    @patch.object(template, '_import_template')
+    def test_get_template_failed_import(self, fake_import_template, fake_template_name, fake_claim,
+                                        fake_release, fake_consume_task):
+        """``get_template`` destroys a template left without a snapshot, and imports it again"""
+        fake_template_name.return_value = 'defaultgateway-IPAM-1234'
+        fake_claim.return_value = True
+        fake_import_template.return_value = 'newTemplate'
+        self.fake_template.snapshot = None
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value.childEntity = [self.fake_template]
+
+        output = template.get_template(fake_vcenter, MagicMock(), '/images/foo.ova', self.network_map, MagicMock())
+
+        self.assertTrue(self.fake_template.Destroy_Task.called)
+        self.assertEqual(output, 'newTemplate')
+
+    @patch.object(template.cache, 'release_template_import')
+    @patch.object(template.cache, 'claim_template_import')
+    @patch.object(template, 'template_name')
+    @patch.object(template, '_import_template')
+    def test_get_template_import_error(self, fake_import_template, fake_template_name, fake_claim, fake_release):
+        """``get_template`` returns None, and lets another worker try, when the import fails"""
+        fake_template_name.return_value = 'defaultgateway-IPAM-1234'
+        fake_claim.return_value = True
+        fake_import_template.side_effect = RuntimeError('testing')
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value.childEntity = []
+        fake_logger = MagicMock()
+
+        output = template.get_template(fake_vcenter, MagicMock(), '/images/foo.ova', self.network_map, fake_logger)
+
+        self.assertTrue(output is None)
+        self.assertTrue(fake_release.called)
+        self.assertTrue(fake_logger.warning.called)
+
+    @patch.object(template, 'consume_task')
+    @patch.object(template.virtual_machine, 'deploy_from_ova')
+    def test_import_template(self, fake_deploy_from_ova, fake_consume_task):
+        """``_import_template`` deploys the OVA powered off, and snapshots it"""
+        fake_deploy_from_ova.return_value = self.fake_template
+
+        template._import_template(MagicMock(), MagicMock(), 'foo', self.network_map, MagicMock())
+
+        self.assertFalse(fake_deploy_from_ova.call_args[1]['power_on'])
+        self.assertTrue(self.fake_template.CreateSnapshot_Task.called)
+
+    @patch.object(template, 'consume_task')
+    @patch.object(template.virtual_machine, 'deploy_from_ova')
+    def test_import_template_error(self, fake_deploy_from_ova, fake_consume_task):
+        """``_import_template`` destroys the template when it cannot be snapshotted"""
+        fake_deploy_from_ova.return_value = self.fake_template
+        fake_consume_task.side_effect = [None, RuntimeError('testing'), None]
+
+        with self.assertRaises(RuntimeError):
+            template._import_template(MagicMock(), MagicMock(), 'foo', self.network_map, MagicMock())
+
+        self.assertTrue(self.fake_template.Destroy_Task.called)
+
+    @patch.object(template, 'consume_task')
+    @patch.object(template.virtual_machine, 'deploy_from_ova')
+    def test_import_template_nics(self, fake_deploy_from_ova, fake_consume_task):
+        """``_import_template`` records which NIC is connected to which OVA network"""
+        fake_deploy_from_ova.return_value = self.fake_template
+
+        template._import_template(MagicMock(), MagicMock(), 'foo', self.network_map, MagicMock())
+        spec = self.fake_template.ReconfigVM_Task.call_args[0][0]
+        nics = ujson.loads(spec.annotation)['nics']
+        expected = {'wan': 'Network adapter 2', 'lan': 'Network adapter 1'}
+
+        self.assertEqual(nics, expected)
+
+    def test_clone_spec_linked(self):
+        """``_clone_spec`` creates a linked clone"""
+        spec = template._clone_spec(self.fake_vcenter, self.fake_template, self.network_map)
+
+        self.assertEqual(spec.location.diskMoveType, 'createNewChildDiskBacking')
+
+    def test_clone_spec_networks(self):
+        """``_clone_spec`` connects the NICs to the networks from the network map"""
+        new_wan = _make_network('wan-2')
+        new_lan = _make_network('lan-2')
+        network_map = [template.vim.OvfManager.NetworkMapping(name='wan', network=new_wan),
+                       template.vim.OvfManager.NetworkMapping(name='lan', network=new_lan)]
+
+        spec = template._clone_spec(self.fake_vcenter, self.fake_template, network_map)
+        connected = {x.device.deviceInfo.label: x.device.backing.network._moId for x in spec.config.deviceChange}
+        expected = {'Network adapter 2': 'wan-2', 'Network adapter 1': 'lan-2'}
+
+        self.assertEqual(connected, expected)
+
+    @patch.object(template, 'consume_task')
+    @patch.object(template, 'get_template')
+    def test_clone_gateway(self, fake_get_template, fake_consume_task):
+        """``clone_gateway`` returns the new VM"""
+        fake_get_template.return_value = self.fake_template
+        fake_consume_task.return_value = 'newVM'
+
+        output = template.clone_gateway(self.fake_vcenter, MagicMock(), '/images/foo.ova',
+                                        self.network_map, 'alice', 'defaultGateway', MagicMock())
+
+        self.assertEqual(output, 'newVM')
+
+    @patch.object(template, 'get_template')
+    def test_clone_gateway_no_template(self, fake_get_template):
+        """``clone_gateway`` returns None when the template is not ready"""
+        fake_get_template.return_value = None
+
+        output = template.clone_gateway(MagicMock(), MagicMock(), '/images/foo.ova',
+                                        self.network_map, 'alice', 'defaultGateway', MagicMock())
+
+        self.assertTrue(output is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in vm_utils.py
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from vlab_gateway_api.lib.worker import vm_utils
+
+
+def _make_network(moid):
+    """Create a standard network whose properties are served by a fake stub"""
+    stub = MagicMock()
+    stub.InvokeAccessor.return_value = 'network-{}'.format(moid)
+    return vm_utils.vim.Network(moid, stub)
+
+
+def _make_nic(label, network):
+    """Create a virtual NIC connected to a standard network"""
+    nic = vm_utils.vim.vm.device.VirtualE1000()
+    nic.deviceInfo = vm_utils.vim.Description(label=label, summary=label)
+    nic.backing = vm_utils.vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(network=network)
+    return nic
+
+
+class TestVmUtils(unittest.TestCase):
+    """A set of test cases for the vm_utils.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.wan = _make_network('wan-1')
+        self.lan = _make_network('lan-1')
+        self.network_map = [vm_utils.vim.OvfManager.NetworkMapping(name='wan', network=self.wan),
+                            vm_utils.vim.OvfManager.NetworkMapping(name='lan', network=self.lan)]
+        self.fake_vm = MagicMock()
+        self.fake_vm.config.hardware.device = [_make_nic('Network adapter 1', self.lan),
+                                               _make_nic('Network adapter 2', self.wan),
+                                               vm_utils.vim.vm.device.VirtualDisk()]
+
+    def test_ensure_folder(self):
+        """``ensure_folder`` returns an existing folder"""
+        fake_vcenter = MagicMock()
+
+        vm_utils.ensure_folder(fake_vcenter, 'someFolder')
+
+        self.assertFalse(fake_vcenter.create_vm_folder.called)
+
+    def test_ensure_folder_creates(self):
+        """``ensure_folder`` creates the folder under INF_VCENTER_TOP_LVL_DIR when it doesn't exist"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.side_effect = [ValueError('testing'), MagicMock()]
+
+        vm_utils.ensure_folder(fake_vcenter, 'someFolder')
+
+        fake_vcenter.create_vm_folder.assert_called_with('/vlab/someFolder')
+
+    def test_nic_labels(self):
+        """``nic_labels`` maps the OVA network names to NIC labels"""
+        output = vm_utils.nic_labels(self.fake_vm, self.network_map)
+        expected = {'wan': 'Network adapter 2', 'lan': 'Network adapter 1'}
+
+        self.assertEqual(output, expected)
+
+    def test_nic_changes(self):
+        """``nic_changes`` connects each NIC to its new network"""
+        labels = {'wan': 'Network adapter 2', 'lan': 'Network adapter 1'}
+        network_map = [vm_utils.vim.OvfManager.NetworkMapping(name='wan', network=_make_network('wan-2')),
+                       vm_utils.vim.OvfManager.NetworkMapping(name='lan', network=_make_network('lan-2'))]
+
+        changes = vm_utils.nic_changes(self.fake_vm, labels, network_map)
+        connected = {x.device.deviceInfo.label: x.device.backing.network._moId for x in changes}
+        expected = {'Network adapter 2': 'wan-2', 'Network adapter 1': 'lan-2'}
+
+        self.assertEqual(connected, expected)
+
+    def test_backing_dvs(self):
+        """``_backing`` connects to a distributed port group by key"""
+        network = MagicMock(spec=vm_utils.vim.dvs.DistributedVirtualPortgroup)
+        network.key = 'dvportgroup-1'
+        network.config.distributedVirtualSwitch.uuid = 'aa bb cc'
+
+        output = vm_utils._backing(network)
+
+        self.assertEqual(output.port.portgroupKey, 'dvportgroup-1')
+
+    def test_connected_to_dvs(self):
+        """``_connected_to`` matches a distributed port group by key"""
+        network = MagicMock(spec=vm_utils.vim.dvs.DistributedVirtualPortgroup)
+        network.key = 'dvportgroup-1'
+        network.config.distributedVirtualSwitch.uuid = 'aa bb cc'
+        nic = vm_utils.vim.vm.device.VirtualVmxnet3()
+        nic.backing = vm_utils._backing(network)
+
+        self.assertTrue(vm_utils._connected_to(nic, network))
+
+
+if __name__ == '__main__':
+    unittest.main()
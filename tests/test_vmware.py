@@ -2,10 +2,11 @@
 """
 A suite of tests for the functions in vmware.py
 """
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
-from vlab_gateway_api.lib.worker import vmware
+from vlab_gateway_api.lib.worker import vmware, profile
 
 
 class TestVMware(unittest.TestCase):
@@ -14,15 +15,17 @@ class TestVMware(unittest.TestCase):
     def setUpClass(cls):
         vmware.logger = MagicMock()
 
+    def setUp(self):
+        """Runs before every test case"""
+        # Otherwise a session from a previous test gets reused
+        vmware.SESSIONS.reset()
+        vmware.context.reset()
+
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware, 'vCenter')
-    def test_show_gateway(self, fake_vCenter, fake_get_info):
+    def test_show_gateway(self, fake_vCenter, fake_get_info, fake_inventory):
         """``show_gateway`` returns a dictionary when everything works as expected"""
-        fake_vm = MagicMock()
-        fake_vm.name = 'defaultGateway'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
         fake_get_info.return_value = {'worked': True}
 
         output = vmware.show_gateway(username='alice')
@@ -30,51 +33,403 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(vmware, 'inventory')
     @patch.object(vmware, 'vCenter')
-    def test_show_gateway_nothing(self, fake_vCenter):
+    def test_show_gateway_nothing(self, fake_vCenter, fake_inventory):
         """``show_gateway`` returns an empty dictionary no gateway is found"""
+        fake_inventory.get.return_value.find_vm.return_value = None
         output = vmware.show_gateway(username='alice')
         expected = {}
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware, 'Ova')
+    def _fleet(self, fake_inventory, count=5):
+        """Make the inventory have a gateway for ``count`` users, in no particular order"""
+        vms = {}
+        for idx in reversed(range(count)):
+            the_vm = MagicMock()
+            the_vm._moId = 'vm-{}'.format(idx)
+            vms['user{}'.format(idx)] = the_vm
+        index = fake_inventory.get.return_value
+        index.owned_vms.side_effect = lambda name: iter(vms.items())
+        index.meta.side_effect = lambda the_vm: {'version': '1.0.0', 'generation': int(the_vm._moId[-1]) % 2 + 1}
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'vCenter')
+    def test_list_fleet(self, fake_vCenter, fake_inventory):
+        """``list_fleet`` returns every gateway, sorted by owner"""
+        self._fleet(fake_inventory)
+
+        output = vmware.list_fleet()
+        owners = [x['username'] for x in output['gateways']]
+
+        self.assertEqual(owners, ['user0', 'user1', 'user2', 'user3', 'user4'])
+        self.assertEqual(output['next'], None)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'vCenter')
+    def test_list_fleet_pages(self, fake_vCenter, fake_inventory):
+        """``list_fleet`` returns the next page, starting after the cursor"""
+        self._fleet(fake_inventory)
+
+        first = vmware.list_fleet(limit=2)
+        second = vmware.list_fleet(after=first['next'], limit=2)
+        third = vmware.list_fleet(after=second['next'], limit=2)
+        owners = [x['username'] for x in first['gateways'] + second['gateways'] + third['gateways']]
+
+        self.assertEqual(owners, ['user0', 'user1', 'user2', 'user3', 'user4'])
+        self.assertEqual(third['next'], None)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'vCenter')
+    def test_list_fleet_filter(self, fake_vCenter, fake_inventory):
+        """``list_fleet`` only returns gateways with the version and generation asked for"""
+        self._fleet(fake_inventory)
+
+        output = vmware.list_fleet(version='1.0.0', generation=2)
+        nothing = vmware.list_fleet(version='9.9.9')
+
+        self.assertEqual([x['username'] for x in output['gateways']], ['user1', 'user3'])
+        self.assertEqual(nothing['gateways'], [])
+
+    @patch.object(vmware, 'vCenter')
+    def test_check_session(self, fake_vCenter):
+        """``check_session`` returns None when vCenter honors the session"""
+        self.assertEqual(vmware.check_session(), None)
+
+    @patch.object(vmware, 'vCenter')
+    def test_check_session_expired(self, fake_vCenter):
+        """``check_session`` raises RuntimeError when vCenter doesn't honor the session"""
+        fake_vCenter.return_value.content.sessionManager.currentSession = None
+
+        with self.assertRaises(RuntimeError):
+            vmware.check_session()
+
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_no_image(self, fake_vCenter, fake_MappedOva):
+        """``create_gateway`` raises ValueError for an image that doesn't exist"""
+        fake_MappedOva.side_effect = FileNotFoundError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_gateway('alice', 'someWAN', 'someLAN', MagicMock(), image_name='nope.ova')
+
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_image_path(self, fake_vCenter, fake_MappedOva):
+        """``create_gateway`` never deploys an image from outside the images dir"""
+        fake_MappedOva.side_effect = FileNotFoundError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_gateway('alice', 'someWAN', 'someLAN', MagicMock(), image_name='../../etc/gw.ova')
+        ova_path = fake_MappedOva.call_args[0][0]
+
+        self.assertEqual(ova_path, '/images/gw.ova')
+
+    @patch.object(vmware, 'MappedOva')
     @patch.object(vmware, '_setup_gateway')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
     @patch.object(vmware, '_create_network_map')
     @patch.object(vmware, 'vCenter')
     def test_create_gateway(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova, fake_get_info, fake_setup_gateway, fake_Ova):
-        """``create_gateway`` returns the new gateway's info when everything works"""
+        """``create_gateway`` returns the new gateway's info, and the setup report, when everything works"""
         fake_get_info.return_value = {'worked' : True}
+        fake_setup_gateway.return_value = [{'name': 'hostname', 'exit_code': 0, 'seconds': 0.1}]
         fake_logger = MagicMock()
 
         output = vmware.create_gateway(username='alice',
                                        wan='someWAN',
                                        lan='someLAN',
                                        logger=fake_logger)
-        expected = {'worked': True}
+        expected = {'worked': True, 'setup': [{'name': 'hostname', 'exit_code': 0, 'seconds': 0.1}]}
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.readiness, '_poll')
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_boot_timeout(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova,
+                                         fake_get_info, fake_Ova, fake_resolve_name, fake_poll):
+        """``create_gateway`` raises ValueError when the new gateway doesn't boot in time"""
+        fake_resolve_name.return_value = '10.1.1.1'
+        fake_poll.return_value = None
+
+        with self.assertRaises(ValueError):
+            vmware.create_gateway(username='alice', wan='someWAN', lan='someLAN', logger=MagicMock())
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'template')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_setup_gateway')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_create_network_map')
     @patch.object(vmware, 'vCenter')
-    def test_delete_gateway(self, fake_vCenter, fake_power, fake_consume_task):
-        """``delete_gateway`` powers off the VM then deletes it"""
+    def test_create_gateway_clone(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova, fake_get_info, fake_setup_gateway, fake_Ova, fake_template, fake_const):
+        """``create_gateway`` deploys a linked clone when VLAB_GATEWAY_DEPLOY_MODE is 'clone'"""
+        fake_const.VLAB_GATEWAY_DEPLOY_MODE = 'clone'
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 0
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'defaultGateway'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
 
-        vmware.delete_gateway(username='alice', logger=fake_logger)
+        vmware.create_gateway(username='alice',
+                              wan='someWAN',
+                              lan='someLAN',
+                              logger=fake_logger)
+
+        self.assertTrue(fake_template.clone_gateway.called)
+        self.assertFalse(fake_deploy_from_ova.called)
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'template')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_setup_gateway')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_clone_fallback(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova, fake_get_info, fake_setup_gateway, fake_Ova, fake_template, fake_const):
+        """``create_gateway`` deploys the OVA when the template is not usable yet"""
+        fake_const.VLAB_GATEWAY_DEPLOY_MODE = 'clone'
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 0
+        fake_template.clone_gateway.return_value = None
+        fake_logger = MagicMock()
 
-        self.assertTrue(fake_power.called)
-        self.assertTrue(fake_vm.Destroy_Task.called)
+        vmware.create_gateway(username='alice',
+                              wan='someWAN',
+                              lan='someLAN',
+                              logger=fake_logger)
+
+        self.assertTrue(fake_deploy_from_ova.called)
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_setup_gateway')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_pooled(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova, fake_get_info, fake_setup_gateway, fake_Ova, fake_warm_pool, fake_const):
+        """``create_gateway`` uses a spare gateway from the warm pool when there is one"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 2
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_logger = MagicMock()
+
+        vmware.create_gateway(username='alice',
+                              wan='someWAN',
+                              lan='someLAN',
+                              logger=fake_logger)
+
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertTrue(fake_setup_gateway.call_args[1]['pooled'])
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_setup_gateway')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_create_gateway_pool_empty(self, fake_vCenter, fake_create_network_map, fake_deploy_from_ova, fake_get_info, fake_setup_gateway, fake_Ova, fake_warm_pool, fake_const):
+        """``create_gateway`` deploys a new gateway when the warm pool is empty"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 2
+        fake_const.VLAB_GATEWAY_DEPLOY_MODE = 'ova'
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_warm_pool.claim.return_value = None
+        fake_logger = MagicMock()
 
-    def test_create_network_map(self):
+        vmware.create_gateway(username='alice',
+                              wan='someWAN',
+                              lan='someLAN',
+                              logger=fake_logger)
+
+        self.assertTrue(fake_deploy_from_ova.called)
+        self.assertFalse(fake_setup_gateway.call_args[1]['pooled'])
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_pool(self, fake_vCenter, fake_create_network_map, fake_deploy, fake_Ova, fake_run_steps, fake_readiness, fake_warm_pool, fake_resolve_name, fake_const):
+        """``refill_pool`` creates no more than VLAB_GATEWAY_POOL_REFILL_RATE spares"""
+        fake_const.VLAB_GATEWAY_POOL_REFILL_RATE = 2
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_const.VLAB_URL = 'https://vlab.local'
+        fake_warm_pool.missing.return_value = 5
+
+        output = vmware.refill_pool(MagicMock())
+        expected = 2
+
+        self.assertEqual(output, expected)
+        self.assertEqual(fake_warm_pool.mark_ready.call_count, 2)
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_pool_boot_timeout(self, fake_vCenter, fake_create_network_map, fake_deploy, fake_Ova, fake_run_steps, fake_readiness, fake_warm_pool, fake_resolve_name, fake_const):
+        """``refill_pool`` destroys a spare that does not boot in time"""
+        fake_const.VLAB_GATEWAY_POOL_REFILL_RATE = 2
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_warm_pool.missing.return_value = 5
+        fake_readiness.wait_for_guest.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.refill_pool(MagicMock())
+
+        fake_warm_pool.discard.assert_called_once()
+        self.assertEqual(fake_warm_pool.discard.call_args[0][0], fake_deploy.return_value)
+        self.assertFalse(fake_warm_pool.mark_ready.called)
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_pool_step_fails(self, fake_vCenter, fake_create_network_map, fake_deploy, fake_Ova, fake_run_steps, fake_readiness, fake_warm_pool, fake_resolve_name, fake_const):
+        """``refill_pool`` destroys a spare that cannot be configured"""
+        fake_const.VLAB_GATEWAY_POOL_REFILL_RATE = 2
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_warm_pool.missing.return_value = 5
+        fake_run_steps.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.refill_pool(MagicMock())
+
+        self.assertTrue(fake_warm_pool.discard.called)
+
+    @patch.object(vmware, 'const')
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware, 'warm_pool')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware, 'MappedOva')
+    @patch.object(vmware, '_deploy')
+    @patch.object(vmware, '_create_network_map')
+    @patch.object(vmware, 'vCenter')
+    def test_refill_pool_full(self, fake_vCenter, fake_create_network_map, fake_deploy, fake_Ova, fake_run_steps, fake_readiness, fake_warm_pool, fake_resolve_name, fake_const):
+        """``refill_pool`` does not deploy anything when the pool is full"""
+        fake_const.VLAB_GATEWAY_POOL_REFILL_RATE = 2
+        fake_const.VLAB_GATEWAY_IMAGES_DIR = '/images'
+        fake_const.VLAB_URL = 'https://vlab.local'
+        fake_warm_pool.missing.return_value = 0
+
+        output = vmware.refill_pool(MagicMock())
+
+        self.assertEqual(output, 0)
+        self.assertFalse(fake_deploy.called)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_gateway(self, fake_vCenter, fake_inventory):
+        """``delete_gateway`` starts powering off every VM, without waiting"""
+        fake_logger = MagicMock()
+        fake_vm1 = MagicMock()
+        fake_vm1._moId = 'vm-1'
+        fake_vm1.PowerOffVM_Task.return_value._moId = 'task-1'
+        fake_vm2 = MagicMock()
+        fake_vm2._moId = 'vm-2'
+        fake_vm2.PowerOffVM_Task.return_value._moId = 'task-2'
+        fake_inventory.get.return_value.find_vms.return_value = [fake_vm1, fake_vm2]
+
+        output = vmware.delete_gateway(username='alice', logger=fake_logger)
+
+        self.assertEqual(output['stage'], 'power')
+        self.assertEqual(output['vms'], ['vm-1', 'vm-2'])
+        self.assertEqual(output['tasks'], ['task-1', 'task-2'])
+        self.assertFalse(fake_vm1.Destroy_Task.called)
+
+    @patch.object(vmware, 'inventory')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_gateway_none(self, fake_vCenter, fake_inventory):
+        """``delete_gateway`` returns None when there's nothing to delete"""
+        fake_inventory.get.return_value.find_vms.return_value = []
+
+        output = vmware.delete_gateway(username='alice', logger=MagicMock())
+
+        self.assertTrue(output is None)
+
+    @patch.object(vmware.task_waiter, 'watch')
+    @patch.object(vmware, 'vim')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_step_destroys(self, fake_vCenter, fake_vim, fake_watch):
+        """``delete_step`` destroys every VM once they're powered off"""
+        fake_watch.return_value = {'task-1': {'state': 'success', 'error': None}}
+        fake_vim.VirtualMachine.return_value.Destroy_Task.return_value._moId = 'task-2'
+        progress = {'stage': 'power', 'vms': ['vm-1'], 'tasks': ['task-1'], 'deadline': time.time() + 60}
+
+        output = vmware.delete_step(progress, MagicMock())
+
+        self.assertEqual(output['stage'], 'destroy')
+        self.assertEqual(output['tasks'], ['task-2'])
+
+    @patch.object(vmware.task_waiter, 'watch')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_step_waiting(self, fake_vCenter, fake_watch):
+        """``delete_step`` returns the same progress while vCenter is still working"""
+        fake_watch.return_value = {'task-1': {'state': 'running', 'error': None}}
+        progress = {'stage': 'power', 'vms': ['vm-1'], 'tasks': ['task-1'], 'deadline': time.time() + 60}
+
+        output = vmware.delete_step(progress, MagicMock())
+
+        self.assertEqual(output, progress)
+
+    @patch.object(vmware.task_waiter, 'watch')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_step_timeout(self, fake_vCenter, fake_watch):
+        """``delete_step`` raises ValueError once the delete takes too long"""
+        fake_watch.return_value = {'task-1': {'state': 'running', 'error': None}}
+        progress = {'stage': 'power', 'vms': ['vm-1'], 'tasks': ['task-1'], 'deadline': time.time() - 1}
+
+        with self.assertRaises(ValueError):
+            vmware.delete_step(progress, MagicMock())
+
+    @patch.object(vmware.task_waiter, 'watch')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_step_done(self, fake_vCenter, fake_watch):
+        """``delete_step`` returns None once every VM is destroyed"""
+        fake_watch.return_value = {'task-2': {'state': 'success', 'error': None}}
+        progress = {'stage': 'destroy', 'vms': ['vm-1'], 'tasks': ['task-2'], 'deadline': time.time() + 60}
+
+        output = vmware.delete_step(progress, MagicMock())
+
+        self.assertTrue(output is None)
+
+    @patch.object(vmware.task_waiter, 'watch')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_step_error(self, fake_vCenter, fake_watch):
+        """``delete_step`` raises ValueError when a VM cannot be destroyed"""
+        fault = vmware.vim.fault.TaskInProgress(msg='busy')
+        fake_watch.return_value = {'task-2': {'state': 'error', 'error': fault}}
+        progress = {'stage': 'destroy', 'vms': ['vm-1'], 'tasks': ['task-2'], 'deadline': time.time() + 60}
+
+        with self.assertRaises(ValueError):
+            vmware.delete_step(progress, MagicMock())
+
+    @patch.object(vmware.inventory, 'get_networks')
+    def test_create_network_map(self, fake_get_networks):
         """``_create_network_map`` returns a List when everything works as expected"""
         fake_logger = MagicMock()
         fake_ova = MagicMock()
@@ -82,7 +437,7 @@ class TestVMware(unittest.TestCase):
         fake_vcenter = MagicMock()
         wan = vmware.vim.Network(moId='asdf')
         lan = vmware.vim.Network(moId='asdf')
-        fake_vcenter.networks = {'someWAN' : wan, 'someLAN': lan}
+        fake_get_networks.return_value.networks = {'someWAN' : wan, 'someLAN': lan}
 
         output = vmware._create_network_map(vcenter=fake_vcenter,
                                             ova=fake_ova,
@@ -92,7 +447,8 @@ class TestVMware(unittest.TestCase):
 
         self.assertTrue(isinstance(output, list))
 
-    def test_create_network_map_bad_wan(self):
+    @patch.object(vmware.inventory, 'get_networks')
+    def test_create_network_map_bad_wan(self, fake_get_networks):
         """``_create_network_map`` raises ValueError when the supplied WAN doesn't exist"""
         fake_logger = MagicMock()
         fake_ova = MagicMock()
@@ -100,7 +456,7 @@ class TestVMware(unittest.TestCase):
         fake_vcenter = MagicMock()
         wan = vmware.vim.Network(moId='asdf')
         lan = vmware.vim.Network(moId='asdf')
-        fake_vcenter.networks = {'someWAN' : wan, 'someLAN': lan}
+        fake_get_networks.return_value.networks = {'someWAN' : wan, 'someLAN': lan}
 
         with self.assertRaises(ValueError):
             vmware._create_network_map(vcenter=fake_vcenter,
@@ -110,7 +466,8 @@ class TestVMware(unittest.TestCase):
                                         logger=fake_logger)
 
 
-    def test_create_network_map_bad_lan(self):
+    @patch.object(vmware.inventory, 'get_networks')
+    def test_create_network_map_bad_lan(self, fake_get_networks):
         """``_create_network_map`` raises ValueError when the supplied LAN doesn't exist"""
         fake_logger = MagicMock()
         fake_ova = MagicMock()
@@ -118,7 +475,7 @@ class TestVMware(unittest.TestCase):
         fake_vcenter = MagicMock()
         wan = vmware.vim.Network(moId='asdf')
         lan = vmware.vim.Network(moId='asdf')
-        fake_vcenter.networks = {'someWAN' : wan, 'someLAN': lan}
+        fake_get_networks.return_value.networks = {'someWAN' : wan, 'someLAN': lan}
 
         with self.assertRaises(ValueError):
             vmware._create_network_map(vcenter=fake_vcenter,
@@ -127,7 +484,8 @@ class TestVMware(unittest.TestCase):
                                         lan='dohLAN',
                                         logger=fake_logger)
 
-    def test_create_network_map_bad_ova(self):
+    @patch.object(vmware.inventory, 'get_networks')
+    def test_create_network_map_bad_ova(self, fake_get_networks):
         """``_create_network_map`` raises RuntimeError when the supplied OVA has unexpected networks defined"""
         fake_logger = MagicMock()
         fake_ova = MagicMock()
@@ -135,7 +493,7 @@ class TestVMware(unittest.TestCase):
         fake_vcenter = MagicMock()
         wan = vmware.vim.Network(moId='asdf')
         lan = vmware.vim.Network(moId='asdf')
-        fake_vcenter.networks = {'someWAN' : wan, 'someLAN': lan}
+        fake_get_networks.return_value.networks = {'someWAN' : wan, 'someLAN': lan}
 
         with self.assertRaises(RuntimeError):
             vmware._create_network_map(vcenter=fake_vcenter,
@@ -145,29 +503,254 @@ class TestVMware(unittest.TestCase):
                                         logger=fake_logger)
 
     @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware.time, 'sleep') # so unittests run faster
+    @patch.object(vmware, 'readiness') # so unittests run faster
+    @patch.object(vmware.provision, 'run_steps')
     @patch.object(vmware.virtual_machine, 'run_command')
-    def test_setup_gateway_returns_none(self, fake_run_command, fake_sleep, fake_set_meta):
-        """``_setup_gateway`` returns None"""
+    def test_setup_gateway_returns_report(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta):
+        """``_setup_gateway`` returns the report of the setup steps"""
         fake_logger = MagicMock()
         fake_vcenter = MagicMock()
         fake_vm = MagicMock()
         fake_result = MagicMock()
         fake_result.exitCode = 1
-        # one Mock for every setup cmd that gets ran
-        fake_run_command.side_effect = [fake_result, MagicMock(), MagicMock(),
-                                        MagicMock(),  MagicMock(), MagicMock(),
-                                        MagicMock(), MagicMock(), MagicMock(),
-                                        MagicMock(), MagicMock(), MagicMock(),
-                                        MagicMock()]
+        fake_run_command.return_value = fake_result
 
         result = vmware._setup_gateway(vcenter=fake_vcenter,
                                        the_vm=fake_vm,
                                        username='jane',
-                                       gateway_version='1.0.0',
                                        logger=fake_logger)
 
-        self.assertTrue(result is None)
+        self.assertTrue(result is fake_run_steps.return_value)
+
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_reboots(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta):
+        """``_setup_gateway`` reboots the gateway after running the setup steps in one batch"""
+        fake_logger = MagicMock()
+        fake_vcenter = MagicMock()
+        fake_vm = MagicMock()
+
+        vmware._setup_gateway(vcenter=fake_vcenter,
+                              the_vm=fake_vm,
+                              username='jane',
+                              logger=fake_logger)
+        the_args = fake_run_command.call_args[1]['arguments']
+
+        self.assertEqual(fake_run_steps.call_count, 1)
+        self.assertEqual(fake_run_command.call_count, 1)
+        self.assertEqual(the_args, '/sbin/reboot')
+
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware.warm_pool, 'applied')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_pooled(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta,
+                                  fake_applied, fake_resolve_name):
+        """``_setup_gateway`` only runs the user specific steps on a gateway from the warm pool"""
+        fake_resolve_name.return_value = '10.1.1.1'
+        fake_applied.return_value = profile.record(profile.load('10.1.1.1').settings)
+        fake_logger = MagicMock()
+        fake_vcenter = MagicMock()
+        fake_vm = MagicMock()
+
+        vmware._setup_gateway(vcenter=fake_vcenter,
+                              the_vm=fake_vm,
+                              username='jane',
+                              logger=fake_logger,
+                              pooled=True)
+        steps = [x.name for x in fake_run_steps.call_args[0][2]]
+        expected = [x.name for x in vmware.provision.user_steps('jane')]
+
+        self.assertEqual(steps, expected)
+        self.assertFalse(fake_readiness.wait_for_guest.called)
+
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_reports(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta):
+        """``_setup_gateway`` reports every stage, and the outcome of every config step"""
+        fake_report = MagicMock()
+        fake_run_steps.return_value = [{'name': 'hostname', 'exit_code': 0, 'seconds': 0.1},
+                                       {'name': 'hosts', 'exit_code': 1, 'seconds': 0.2}]
+
+        vmware._setup_gateway(vcenter=MagicMock(),
+                              the_vm=MagicMock(),
+                              username='jane',
+                              logger=MagicMock(),
+                              pooled=True,
+                              report=fake_report)
+        stages = [x[0][0] for x in fake_report.call_args_list]
+        step_details = [x[0][1] for x in fake_report.call_args_list if x[0][0] == 'configure_step']
+
+        self.assertEqual(stages[0], 'configure')
+        self.assertEqual(stages[-2:], ['reboot', 'reboot_wait'])
+        self.assertEqual(step_details[1], {'name': 'hosts', 'exit_code': 1, 'seconds': 0.2})
+
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware.warm_pool, 'applied')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_pooled_old_profile(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta,
+                                              fake_applied, fake_resolve_name):
+        """``_setup_gateway`` changes the settings of a spare that was configured with an older profile"""
+        fake_resolve_name.return_value = '10.1.1.1'
+        recorded = profile.record(profile.load('10.1.1.1').settings)
+        recorded['ntp'] = '10.9.9.9'
+        fake_applied.return_value = recorded
+
+        vmware._setup_gateway(vcenter=MagicMock(),
+                              the_vm=MagicMock(),
+                              username='jane',
+                              logger=MagicMock(),
+                              pooled=True)
+        steps = [x.name for x in fake_run_steps.call_args[0][2]]
+        expected = [x.name for x in vmware.provision.user_steps('jane')] + ['ntp']
+
+        self.assertEqual(steps, expected)
+
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_meta(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta,
+                                fake_resolve_name):
+        """``_setup_gateway`` records the profile version, and only the settings that were applied"""
+        fake_resolve_name.return_value = '10.1.1.1'
+        fake_run_steps.return_value = [{'name': 'ntp', 'exit_code': 0, 'seconds': 0.1},
+                                       {'name': 'salt_master', 'exit_code': 1, 'seconds': 0.1}]
+
+        vmware._setup_gateway(vcenter=MagicMock(),
+                              the_vm=MagicMock(),
+                              username='jane',
+                              logger=MagicMock())
+        meta_data = fake_set_meta.call_args[0][1]
+
+        self.assertEqual(meta_data['version'], profile.DEFAULT_VERSION)
+        self.assertEqual(meta_data['profile'], {'ntp': '10.1.1.1'})
+
+    @patch.object(vmware.context, 'build', wraps=vmware.context.build)
+    @patch.object(vmware, 'resolve_name')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'readiness')
+    @patch.object(vmware.provision, 'run_steps')
+    @patch.object(vmware.virtual_machine, 'run_command')
+    def test_setup_gateway_context(self, fake_run_command, fake_run_steps, fake_readiness, fake_set_meta,
+                                   fake_resolve_name, fake_build):
+        """``_setup_gateway`` only renders the steps that are the same for every user once"""
+        fake_resolve_name.return_value = '10.1.1.1'
+        fake_run_steps.return_value = []
+
+        for username in ('jane', 'bob'):
+            vmware._setup_gateway(vcenter=MagicMock(),
+                                  the_vm=MagicMock(),
+                                  username=username,
+                                  logger=MagicMock())
+        steps = fake_run_steps.call_args[0][2]
+
+        self.assertEqual(fake_build.call_count, 1)
+        self.assertEqual(steps, vmware.provision.user_steps('bob') + list(vmware.context.build('10.1.1.1').common_steps))
+
+
+class TestReconfigure(unittest.TestCase):
+    """A set of test cases for ``vmware.reconfigure_gateway``"""
+    def setUp(self):
+        """Runs before every test case"""
+        vmware.SESSIONS.reset()
+        self.settings = profile.load('10.1.1.1').settings
+        self.meta_data = {'component': 'defaultGateway',
+                          'created': 1234,
+                          'version': '1.0.0',
+                          'configured': True,
+                          'generation': 1,
+                          'profile': profile.record(self.settings)}
+        patchers = [patch.object(vmware, 'vCenter'),
+                    patch.object(vmware, 'inventory'),
+                    patch.object(vmware, 'resolve_name', return_value='10.1.1.1'),
+                    patch.object(vmware, 'readiness'),
+                    patch.object(vmware.provision, 'run_steps'),
+                    patch.object(vmware.virtual_machine, 'run_command'),
+                    patch.object(vmware.virtual_machine, 'set_meta')]
+        self.fakes = {x.attribute: x.start() for x in patchers}
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.fakes['inventory'].get.return_value.meta.return_value = self.meta_data
+        self.fakes['run_steps'].side_effect = lambda vcenter, the_vm, steps, logger: \
+            [{'name': x.name, 'exit_code': 0, 'seconds': 0.1} for x in steps]
+
+    def test_no_gateway(self):
+        """``reconfigure_gateway`` raises ValueError if the user has no gateway"""
+        self.fakes['inventory'].get.return_value.find_vm.return_value = None
+
+        with self.assertRaises(ValueError):
+            vmware.reconfigure_gateway('alice', MagicMock())
+
+    def test_unchanged(self):
+        """``reconfigure_gateway`` does nothing when the gateway already has the profile"""
+        output = vmware.reconfigure_gateway('alice', MagicMock())
+
+        self.assertEqual(output, {'changed': [], 'setup': [], 'rebooted': False})
+        self.assertFalse(self.fakes['run_steps'].called)
+        self.assertFalse(self.fakes['set_meta'].called)
+
+    def test_legacy(self):
+        """``reconfigure_gateway`` edits the values a gateway was set up with, when it has no recorded profile"""
+        del self.meta_data['profile']
+        custom = profile.Profile('1.1.0', dict(self.settings, ntp='10.9.9.9'))
+
+        with patch.object(vmware.profile, 'load', return_value=custom):
+            output = vmware.reconfigure_gateway('alice', MagicMock())
+        command = self.fakes['run_steps'].call_args[0][2][0].command
+
+        self.assertEqual(output['changed'], ['ntp'])
+        self.assertTrue("'10\\.1\\.1\\.1'" in command)
+
+    def test_restart(self):
+        """``reconfigure_gateway`` restarts the service that reads a changed setting, instead of rebooting"""
+        self.meta_data['profile']['ntp'] = '10.9.9.9'
+
+        output = vmware.reconfigure_gateway('alice', MagicMock())
+        steps = [x['name'] for x in output['setup']]
+        meta_data = self.fakes['set_meta'].call_args[0][1]
+
+        self.assertEqual(steps, ['ntp', 'restart_chrony'])
+        self.assertFalse(output['rebooted'])
+        self.assertFalse(self.fakes['run_command'].called)
+        self.assertEqual(meta_data['generation'], 2)
+        self.assertEqual(meta_data['profile']['ntp'], '10.1.1.1')
+
+    def test_reboot(self):
+        """``reconfigure_gateway`` reboots the gateway when a changed setting is only read at boot"""
+        self.meta_data['profile']['log_key'] = 'sha256:old'
+
+        output = vmware.reconfigure_gateway('alice', MagicMock())
+
+        self.assertEqual([x['name'] for x in output['setup']], ['log_key'])
+        self.assertTrue(output['rebooted'])
+        self.assertEqual(self.fakes['run_command'].call_args[1]['arguments'], '/sbin/reboot')
+        self.assertTrue(self.fakes['readiness'].wait_for_reboot.called)
+
+    def test_failed(self):
+        """``reconfigure_gateway`` raises ValueError, and keeps the old value recorded, when a setting fails"""
+        self.meta_data['profile']['ntp'] = '10.9.9.9'
+        self.meta_data['version'] = '0.9.0'
+        self.fakes['run_steps'].side_effect = None
+        self.fakes['run_steps'].return_value = [{'name': 'ntp', 'exit_code': 1, 'seconds': 0.1}]
+
+        with self.assertRaises(ValueError):
+            vmware.reconfigure_gateway('alice', MagicMock())
+        meta_data = self.fakes['set_meta'].call_args[0][1]
+
+        self.assertEqual(meta_data['profile']['ntp'], '10.9.9.9')
+        self.assertEqual(meta_data['version'], '0.9.0')
+
 
 if __name__ == '__main__':
     unittest.main()
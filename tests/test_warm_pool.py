@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in warm_pool.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_gateway_api.lib.worker import warm_pool
+
+
+def _make_spare(name, meta_data):
+    """Create a spare gateway with the supplied pool state in its annotation"""
+    spare = MagicMock()
+    spare.name = name
+    spare.config.annotation = ujson.dumps(meta_data)
+    spare.config.changeVersion = '2019-01-01T00:00:00.000000Z'
+    return spare
+
+
+class TestWarmPool(unittest.TestCase):
+    """A set of test cases for the warm_pool.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.ready = {'pool': 'ready', 'image': 'gw.ova', 'nics': {'wan': 'Network adapter 1'}}
+
+    def test_spare_name(self):
+        """``spare_name`` returns a different name every time"""
+        self.assertNotEqual(warm_pool.spare_name(), warm_pool.spare_name())
+
+    @patch.object(warm_pool, 'const')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_missing(self, fake_ensure_folder, fake_const):
+        """``missing`` returns how many spares are needed to fill the pool"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 3
+        fake_ensure_folder.return_value.childEntity = [MagicMock()]
+
+        output = warm_pool.missing(MagicMock())
+        expected = 2
+
+        self.assertEqual(output, expected)
+
+    @patch.object(warm_pool, 'const')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_missing_shrunk(self, fake_ensure_folder, fake_const):
+        """``missing`` returns zero when the pool has more spares than needed"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 1
+        fake_ensure_folder.return_value.childEntity = [MagicMock(), MagicMock()]
+
+        output = warm_pool.missing(MagicMock())
+
+        self.assertEqual(output, 0)
+
+    @patch.object(warm_pool, 'const')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_missing_claimed(self, fake_ensure_folder, fake_const):
+        """``missing`` does not count spares that are already claimed"""
+        fake_const.VLAB_GATEWAY_POOL_SIZE = 2
+        fake_ensure_folder.return_value.childEntity = [_make_spare('spare-1', self.ready),
+                                                       _make_spare('spare-2', dict(self.ready, pool='claimed'))]
+
+        output = warm_pool.missing(MagicMock())
+
+        self.assertEqual(output, 1)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_labels')
+    def test_mark_ready(self, fake_nic_labels, fake_consume_task):
+        """``mark_ready`` records the image and NICs of the spare in its annotation"""
+        fake_nic_labels.return_value = {'wan': 'Network adapter 1'}
+        fake_vm = MagicMock()
+
+        warm_pool.mark_ready(fake_vm, [], 'gw.ova')
+        spec = fake_vm.ReconfigVM_Task.call_args[0][0]
+        meta_data = ujson.loads(spec.annotation)
+
+        self.assertEqual(meta_data['pool'], 'ready')
+        self.assertEqual(meta_data['image'], 'gw.ova')
+        self.assertEqual(meta_data['nics'], {'wan': 'Network adapter 1'})
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_labels')
+    def test_mark_ready_applied(self, fake_nic_labels, fake_consume_task):
+        """``mark_ready`` records the profile settings the spare was configured with"""
+        fake_nic_labels.return_value = {}
+        fake_vm = MagicMock()
+
+        warm_pool.mark_ready(fake_vm, [], 'gw.ova', applied={'ntp': '10.1.1.1'})
+        spec = fake_vm.ReconfigVM_Task.call_args[0][0]
+        meta_data = ujson.loads(spec.annotation)
+
+        self.assertEqual(meta_data['profile'], {'ntp': '10.1.1.1'})
+
+    def test_applied(self):
+        """``applied`` reads the profile settings out of the annotation of a spare"""
+        fake_vm = MagicMock()
+        fake_vm.config.annotation = ujson.dumps({'pool': 'claimed', 'profile': {'ntp': '10.1.1.1'}})
+
+        self.assertEqual(warm_pool.applied(fake_vm), {'ntp': '10.1.1.1'})
+
+    def test_applied_legacy(self):
+        """``applied`` returns None for a spare configured before profiles were recorded"""
+        fake_vm = MagicMock()
+        fake_vm.config.annotation = ujson.dumps({'pool': 'claimed'})
+
+        self.assertTrue(warm_pool.applied(fake_vm) is None)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_changes')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim(self, fake_ensure_folder, fake_nic_changes, fake_consume_task):
+        """``claim`` moves and renames the spare it claims"""
+        fake_nic_changes.return_value = []
+        spare = _make_spare('spare-1', self.ready)
+        fake_ensure_folder.return_value.childEntity = [spare]
+        fake_vcenter = MagicMock()
+
+        output = warm_pool.claim(fake_vcenter, 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+
+        self.assertTrue(output is spare)
+        self.assertTrue(fake_vcenter.get_by_name.return_value.MoveIntoFolder_Task.called)
+        spare.Rename_Task.assert_called_with('defaultGateway')
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_changes')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim_change_version(self, fake_ensure_folder, fake_nic_changes, fake_consume_task):
+        """``claim`` only reconfigures the spare if nobody else changed it first"""
+        fake_nic_changes.return_value = []
+        spare = _make_spare('spare-1', self.ready)
+        fake_ensure_folder.return_value.childEntity = [spare]
+
+        warm_pool.claim(MagicMock(), 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+        spec = spare.ReconfigVM_Task.call_args[0][0]
+
+        self.assertEqual(spec.changeVersion, '2019-01-01T00:00:00.000000Z')
+        self.assertEqual(ujson.loads(spec.annotation)['pool'], 'claimed')
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_changes')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim_lost_race(self, fake_ensure_folder, fake_nic_changes, fake_consume_task):
+        """``claim`` tries the next spare when another worker claimed the first one"""
+        fake_nic_changes.return_value = []
+        fake_consume_task.side_effect = [RuntimeError('changed'), None, None, None]
+        spare1 = _make_spare('spare-1', self.ready)
+        spare2 = _make_spare('spare-2', self.ready)
+        fake_ensure_folder.return_value.childEntity = [spare1, spare2]
+
+        output = warm_pool.claim(MagicMock(), 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+
+        self.assertTrue(output is spare2)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim_skips(self, fake_ensure_folder, fake_consume_task):
+        """``claim`` ignores spares that are claimed, still deploying, or from another image"""
+        claimed = _make_spare('spare-1', dict(self.ready, pool='claimed'))
+        other_image = _make_spare('spare-2', dict(self.ready, image='other.ova'))
+        deploying = MagicMock()
+        deploying.config = None
+        fake_ensure_folder.return_value.childEntity = [claimed, other_image, deploying]
+
+        output = warm_pool.claim(MagicMock(), 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_changes')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim_handoff_fails(self, fake_ensure_folder, fake_nic_changes, fake_consume_task):
+        """``claim`` destroys the spare it claimed, when it cannot be given to the user"""
+        fake_nic_changes.return_value = []
+        spare = _make_spare('spare-1', self.ready)
+        fake_ensure_folder.return_value.childEntity = [spare]
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            warm_pool.claim(fake_vcenter, 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+
+        self.assertTrue(spare.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool.vm_utils, 'nic_changes')
+    @patch.object(warm_pool.vm_utils, 'ensure_folder')
+    def test_claim_discard_fails(self, fake_ensure_folder, fake_nic_changes, fake_consume_task):
+        """``claim`` raises the original error, even if the claimed spare cannot be destroyed"""
+        fake_nic_changes.return_value = []
+        # claim, move, power off, destroy
+        fake_consume_task.side_effect = [None, ValueError('move failed'), None, RuntimeError('destroy failed')]
+        spare = _make_spare('spare-1', self.ready)
+        fake_ensure_folder.return_value.childEntity = [spare]
+
+        with self.assertRaises(ValueError):
+            warm_pool.claim(MagicMock(), 'alice', 'defaultGateway', [], 'gw.ova', MagicMock())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,18 @@
 from flask import Flask
 from celery import Celery
 
-from vlab_gateway_api.lib import const
-from vlab_gateway_api.lib.views import GatewayView, HealthView
+from vlab_gateway_api.lib import metrics
+from vlab_gateway_api.lib.views import GatewayView, HealthView, MetricsView
 
 app = Flask(__name__)
-app.celery_app = Celery('gateway', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app = Celery('gateway')
+app.celery_app.config_from_object('vlab_gateway_api.lib.celery_config')
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
 
 GatewayView.register(app)
 HealthView.register(app)
+MetricsView.register(app)
+metrics.instrument(app)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+# -*- coding: UTF-8 -*-
+"""
+Track bulk operations, where one API call creates or deletes the gateways of
+many users.
+
+The state of a bulk operation lives in the shared store, so the API can report
+progress for every user, and the ``gateway.bulk`` task can send the work to the
+workers a few users at a time. Celery groups/chords would need a result backend
+that supports chords, and still would not limit how many users hit vCenter at
+once.
+"""
+import time
+import uuid
+
+from vlab_gateway_api.lib import const, cache
+
+
+PENDING = 'pending'
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+ACTIONS = ('create', 'delete')
+
+
+def start(action, users):
+    """Record a new bulk operation
+
+    :Returns: String - The id of the bulk operation
+
+    :Raises: sqlite3.Error or OSError if the store is unusable
+
+    :param action: What to do to every user's gateway; "create" or "delete"
+    :type action: String
+
+    :param users: The users, and their WAN/LAN when creating gateways
+    :type users: List of Dictionaries
+    """
+    bulk_id = uuid.uuid4().hex
+    record = {'action': action,
+              'created': time.time(),
+              'order': [x['username'] for x in users],
+              'users': {x['username']: {'state': PENDING,
+                                        'wan': x.get('wan'),
+                                        'lan': x.get('lan'),
+                                        'task-id': None,
+                                        'queued': None,
+                                        'error': None} for x in users}}
+    cache.STORE.set(_key(bulk_id), record, ttl=const.VLAB_GATEWAY_BULK_TTL)
+    return bulk_id
+
+
+def status(bulk_id):
+    """Obtain the progress of a bulk operation
+
+    :Returns: Dictionary, or None if there's no such bulk operation
+
+    :Raises: sqlite3.Error or OSError if the store is unusable
+
+    :param bulk_id: The output from ``start``
+    :type bulk_id: String
+    """
+    record = cache.STORE.get(_key(bulk_id))
+    if record is None:
+        return None
+    states = [x['state'] for x in record['users'].values()]
+    progress = {x: states.count(x) for x in (PENDING, QUEUED, DONE, FAILED)}
+    users = []
+    for username in record['order']:
+        entry = record['users'][username]
+        users.append({'username': username,
+                      'state': entry['state'],
+                      'task-id': entry['task-id'],
+                      'error': entry['error']})
+    return {'bulk-id': bulk_id,
+            'action': record['action'],
+            'complete': is_complete(record),
+            'progress': progress,
+            'users': users}
+
+
+def is_complete(record):
+    """Determine if every user in a bulk operation is done (or failed)
+
+    :Returns: Boolean
+
+    :param record: The bulk operation
+    :type record: Dictionary
+    """
+    return all(x['state'] in (DONE, FAILED) for x in record['users'].values())
+
+
+def next_batch(bulk_id, limit):
+    """Pick the next users to send to the workers, and mark them as queued.
+
+    :Returns: Tuple - (action, [(username, entry, task_id), ...], complete)
+
+    :param bulk_id: The output from ``start``
+    :type bulk_id: String
+
+    :param limit: The most users that can be queued (but not done) at once
+    :type limit: Integer
+    """
+    with cache.STORE.transaction():
+        record = cache.STORE.get(_key(bulk_id))
+        if record is None:
+            # Expired, or never existed
+            return None, [], True
+        now = time.time()
+        for entry in record['users'].values():
+            if entry['state'] == QUEUED and now - entry['queued'] > const.VLAB_GATEWAY_BULK_TASK_TIMEOUT:
+                # The worker died, or hit its time limit; task_postrun never ran
+                entry['state'] = FAILED
+                entry['error'] = 'Timed out waiting on task {}'.format(entry['task-id'])
+        queued = [x for x in record['users'].values() if x['state'] == QUEUED]
+        slots = max(limit - len(queued), 0)
+        batch = []
+        for username in record['order']:
+            if len(batch) >= slots:
+                break
+            entry = record['users'][username]
+            if entry['state'] != PENDING:
+                continue
+            task_id = uuid.uuid4().hex
+            entry['state'] = QUEUED
+            entry['task-id'] = task_id
+            entry['queued'] = now
+            # So a finished task can find which bulk operation it belongs to
+            cache.STORE.set(_task_key(task_id), [bulk_id, username], ttl=const.VLAB_GATEWAY_BULK_TTL)
+            batch.append((username, entry, task_id))
+        cache.STORE.set(_key(bulk_id), record, ttl=const.VLAB_GATEWAY_BULK_TTL)
+        return record['action'], batch, is_complete(record)
+
+
+def record_result(task_id, error):
+    """Update a bulk operation with the outcome of one user's task
+
+    :Returns: Boolean - True if the task was part of a bulk operation
+
+    :param task_id: The id of the finished task
+    :type task_id: String
+
+    :param error: Why the task failed, or None if it worked
+    :type error: String
+    """
+    with cache.STORE.transaction():
+        owner = cache.STORE.get(_task_key(task_id))
+        if owner is None:
+            return False
+        bulk_id, username = owner
+        record = cache.STORE.get(_key(bulk_id))
+        if record is None:
+            return False
+        entry = record['users'][username]
+        entry['state'] = FAILED if error else DONE
+        entry['error'] = error
+        cache.STORE.set(_key(bulk_id), record, ttl=const.VLAB_GATEWAY_BULK_TTL)
+        cache.STORE.delete(_task_key(task_id))
+    return True
+
+
+def follow(task_id, existing):
+    """Have a bulk operation wait on a task that was already in flight for a
+    user, instead of the task it was going to send.
+
+    :Returns: None
+
+    :param task_id: The id ``next_batch`` picked for the user's task
+    :type task_id: String
+
+    :param existing: The id of the task already in flight
+    :type existing: String
+    """
+    with cache.STORE.transaction():
+        owner = cache.STORE.get(_task_key(task_id))
+        if owner is None:
+            return
+        cache.STORE.delete(_task_key(task_id))
+        bulk_id, username = owner
+        record = cache.STORE.get(_key(bulk_id))
+        if record is None:
+            return
+        entry = record['users'][username]
+        if cache.STORE.add(_task_key(existing), owner, ttl=const.VLAB_GATEWAY_BULK_TTL):
+            entry['task-id'] = existing
+        else:
+            # Another bulk operation is already waiting on that task
+            entry['state'] = FAILED
+            entry['error'] = 'Task {} was already in flight for another bulk operation'.format(existing)
+        cache.STORE.set(_key(bulk_id), record, ttl=const.VLAB_GATEWAY_BULK_TTL)
+
+def _key(bulk_id):
+    """The store key of a bulk operation
+
+    :Returns: String
+
+    :param bulk_id: The id of the bulk operation
+    :type bulk_id: String
+    """
+    return 'bulk:{}'.format(bulk_id)
+
+
+def _task_key(task_id):
+    """The store key that maps a task to the bulk operation that sent it
+
+    :Returns: String
+
+    :param task_id: The id of the task
+    :type task_id: String
+    """
+    return 'bulk-task:{}'.format(task_id)
@@ -0,0 +1,486 @@
+# -*- coding: UTF-8 -*-
+"""
+A small key/value store that the API and the workers share through a SQLite
+file (``VLAB_GATEWAY_CACHE_DB``) on a volume both containers mount.
+
+The main use is caching ``gateway.show`` results, so the API can answer a GET
+without a round trip through Celery and vCenter. Workers also publish the names
+of the networks in vCenter, and the OVAs they can deploy, so the API can reject a
+bad WAN/LAN or image up front.
+"""
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import ujson
+
+from vlab_gateway_api.lib import const
+
+
+# Errors that mean the store is unusable, like a missing volume
+CACHE_ERRORS = (sqlite3.Error, OSError)
+
+
+class Store(object):
+    """A key/value store, where entries can expire.
+
+    Values must be JSON serializable. Safe to use from many threads and
+    processes; every process/thread gets its own connection to the database.
+
+    :param path: **Required** The location of the SQLite database file
+    :type path: String
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self, key):
+        """Look up a value
+
+        :Returns: The value, or None if there's no (unexpired) entry for the key
+
+        :param key: The name of the entry
+        :type key: String
+        """
+        value = self.get_raw(key)
+        if value is None:
+            return None
+        return ujson.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """Create or replace an entry
+
+        :Returns: None
+
+        :param key: The name of the entry
+        :type key: String
+
+        :param value: The thing to store
+        :type value: Object
+
+        :param ttl: How many seconds the entry is valid for. Never expires if None.
+        :type ttl: Integer
+        """
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                         (key, ujson.dumps(value), _expires(ttl)))
+
+    def add(self, key, value, ttl=None):
+        """Create an entry, only if there isn't one already
+
+        :Returns: Boolean - True if the entry was created
+
+        :param key: The name of the entry
+        :type key: String
+
+        :param value: The thing to store
+        :type value: Object
+
+        :param ttl: How many seconds the entry is valid for. Never expires if None.
+        :type ttl: Integer
+        """
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM kv WHERE key = ? AND expires <= ?', (key, time.time()))
+            cursor = conn.execute('INSERT OR IGNORE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                                  (key, ujson.dumps(value), _expires(ttl)))
+            return cursor.rowcount == 1
+
+    def get_raw(self, key):
+        """Look up a value stored with ``set_raw``
+
+        :Returns: Bytes/String, or None if there's no (unexpired) entry for the key
+
+        :param key: The name of the entry
+        :type key: String
+        """
+        row = self._conn().execute('SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                   (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_raw(self, key, value, ttl=None):
+        """Create or replace an entry with a value that's already serialized
+
+        :Returns: None
+
+        :param key: The name of the entry
+        :type key: String
+
+        :param value: The serialized value
+        :type value: Bytes/String
+
+        :param ttl: How many seconds the entry is valid for. Never expires if None.
+        :type ttl: Integer
+        """
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                         (key, value, _expires(ttl)))
+
+    def purge(self):
+        """Remove every expired entry; ``get`` ignores them, but they take up space
+
+        :Returns: Integer - How many entries were removed
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute('DELETE FROM kv WHERE expires <= ?', (time.time(),))
+            return cursor.rowcount
+
+    def delete(self, key):
+        """Remove an entry; it's not an error if there is no such entry
+
+        :Returns: None
+
+        :param key: The name of the entry
+        :type key: String
+        """
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def incr(self, key, amount=1):
+        """Atomically add to a counter, creating it if needed
+
+        :Returns: Integer - The new value of the counter
+
+        :param key: The name of the counter
+        :type key: String
+
+        :param amount: How much to add to the counter
+        :type amount: Integer
+        """
+        with self.transaction():
+            value = (self.get(key) or 0) + amount
+            self.set(key, value)
+        return value
+
+    @contextmanager
+    def transaction(self):
+        """Group several operations so no other process can interleave with them.
+
+        Transactions can be nested; only the outermost one commits.
+
+        :Returns: sqlite3.Connection
+        """
+        conn = self._conn()
+        if conn.in_transaction:
+            yield conn
+            return
+        # IMMEDIATE takes the write lock up front, so a read-modify-write can't race
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def _conn(self):
+        """Obtain the connection for the current process and thread
+
+        :Returns: sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # A forked child must not reuse its parent's connection
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def _expires(ttl):
+    """Convert a TTL into the epoch time an entry expires at
+
+    :Returns: Float or None
+
+    :param ttl: How many seconds the entry is valid for
+    :type ttl: Integer
+    """
+    if ttl is None:
+        return None
+    return time.time() + ttl
+
+
+STORE = Store(const.VLAB_GATEWAY_CACHE_DB)
+
+
+def get_show(username):
+    """Look up the cached ``gateway.show`` result for a user
+
+    :Returns: Dictionary, or None if nothing is cached
+
+    :param username: The user who owns the gateway
+    :type username: String
+    """
+    try:
+        return STORE.get('show:{}'.format(username))
+    except CACHE_ERRORS:
+        return None
+
+
+def show_generation(username):
+    """Obtain how many times the cached ``gateway.show`` result has been invalidated.
+
+    Read this before querying vCenter, and supply it to ``set_show`` so that a
+    slow ``gateway.show`` cannot cache what a create/delete just invalidated.
+
+    :Returns: Integer, or None if the cache is unusable
+
+    :param username: The user who owns the gateway
+    :type username: String
+    """
+    try:
+        return STORE.get('show-generation:{}'.format(username)) or 0
+    except CACHE_ERRORS:
+        return None
+
+
+def set_show(username, info, generation):
+    """Cache a ``gateway.show`` result, unless it was invalidated since ``generation``
+
+    :Returns: Boolean - True if the result was cached
+
+    :param username: The user who owns the gateway
+    :type username: String
+
+    :param info: The output of ``gateway.show``
+    :type info: Dictionary
+
+    :param generation: The output from ``show_generation``, before vCenter was queried
+    :type generation: Integer
+    """
+    if generation is None:
+        return False
+    try:
+        with STORE.transaction():
+            if (STORE.get('show-generation:{}'.format(username)) or 0) != generation:
+                return False
+            STORE.set('show:{}'.format(username), info, ttl=const.VLAB_GATEWAY_CACHE_TTL)
+    except CACHE_ERRORS:
+        return False
+    return True
+
+
+def invalidate_show(username):
+    """Discard the cached ``gateway.show`` result for a user
+
+    :Returns: None
+
+    :param username: The user who owns the gateway
+    :type username: String
+    """
+    try:
+        with STORE.transaction():
+            STORE.incr('show-generation:{}'.format(username))
+            STORE.delete('show:{}'.format(username))
+    except CACHE_ERRORS:
+        pass
+
+
+def set_network_names(names):
+    """Publish the names of every network in vCenter
+
+    :Returns: None
+
+    :param names: The names of the networks
+    :type names: Iterable
+    """
+    try:
+        STORE.set('networks', sorted(names))
+    except CACHE_ERRORS:
+        pass
+
+
+def network_exists(name):
+    """Check a network name against the last names a worker published
+
+    :Returns: Boolean, or None if no worker has published the names yet
+
+    :param name: The name of the network
+    :type name: String
+    """
+    try:
+        names = STORE.get('networks')
+    except CACHE_ERRORS:
+        return None
+    if names is None:
+        return None
+    return name in names
+
+
+def set_images(catalog):
+    """Publish the OVAs a worker found in ``VLAB_GATEWAY_IMAGES_DIR``
+
+    :Returns: None
+
+    :param catalog: Every OVA, like ``images.scan`` returns
+    :type catalog: List
+    """
+    try:
+        STORE.set('images', catalog)
+    except CACHE_ERRORS:
+        pass
+
+
+def get_images():
+    """Obtain the OVAs a worker last published
+
+    :Returns: List, or None if no worker has published them yet
+    """
+    try:
+        return STORE.get('images')
+    except CACHE_ERRORS:
+        return None
+
+
+def claim_image_checksums(ttl):
+    """Make sure only one worker at a time checksums the OVAs
+
+    :Returns: Boolean - True if this worker should checksum them
+
+    :param ttl: How long the claim lasts, in seconds
+    :type ttl: Integer
+    """
+    try:
+        return STORE.add('images-checksum', time.time(), ttl=ttl)
+    except CACHE_ERRORS:
+        return False
+
+
+def claim_template_import(name, ttl):
+    """Make sure only one worker at a time imports (or cleans up) a template
+
+    :Returns: Boolean - True if this worker should import it
+
+    :param name: The name of the template
+    :type name: String
+
+    :param ttl: How long the claim lasts, in seconds
+    :type ttl: Integer
+    """
+    try:
+        return STORE.add('template-import:{}'.format(name), time.time(), ttl=ttl)
+    except CACHE_ERRORS:
+        return False
+
+
+def release_template_import(name):
+    """Let another worker import a template, once this worker is done with it
+
+    :Returns: None
+
+    :param name: The name of the template
+    :type name: String
+    """
+    try:
+        STORE.delete('template-import:{}'.format(name))
+    except CACHE_ERRORS:
+        pass
+
+
+def set_worker_health(hostname, record, stale_after):
+    """Publish the latest health check of a worker
+
+    :Returns: None
+
+    :param hostname: The name of the worker, like "celery@abc123"
+    :type hostname: String
+
+    :param record: When the worker checked in, and how its dependencies are
+    :type record: Dictionary
+
+    :param stale_after: How many seconds until a worker that stopped checking in is forgotten
+    :type stale_after: Integer
+    """
+    now = time.time()
+    try:
+        with STORE.transaction():
+            workers = STORE.get('health-workers') or {}
+            workers = {k: v for k, v in workers.items() if now - v['checked'] < stale_after}
+            workers[hostname] = record
+            STORE.set('health-workers', workers)
+    except CACHE_ERRORS:
+        pass
+
+
+def get_worker_health():
+    """Obtain the latest health check of every worker
+
+    :Returns: Dictionary - Keyed by worker hostname
+
+    :Raises: Any of CACHE_ERRORS, so a broken store shows up in the health check
+    """
+    return STORE.get('health-workers') or {}
+
+
+def claim_inflight(operation, username, params, task_id, ttl):
+    """Record that a task is about to be queued for a user, unless the same
+    task is already queued (or running) for that user.
+
+    :Returns: String - The id of the task already in flight, or None if the
+              caller should queue its task
+
+    :param operation: The kind of task, like "create"
+    :type operation: String
+
+    :param username: The user who owns the gateway
+    :type username: String
+
+    :param params: The arguments of the task, excluding the username and txn_id
+    :type params: List
+
+    :param task_id: The id the caller will queue its task with
+    :type task_id: String
+
+    :param ttl: When to give up on the task ever finishing, in seconds
+    :type ttl: Integer
+    """
+    key = _inflight_key(operation, username, params)
+    try:
+        with STORE.transaction():
+            if STORE.add(key, task_id, ttl=ttl):
+                return None
+            return STORE.get(key)
+    except CACHE_ERRORS:
+        # Duplicate work is better than no work
+        return None
+
+
+def release_inflight(operation, username, params, task_id):
+    """Forget about a finished task, so the next request queues a new one
+
+    :Returns: None
+
+    :param operation: The kind of task, like "create"
+    :type operation: String
+
+    :param username: The user who owns the gateway
+    :type username: String
+
+    :param params: The arguments of the task, excluding the username and txn_id
+    :type params: List
+
+    :param task_id: The id of the finished task
+    :type task_id: String
+    """
+    key = _inflight_key(operation, username, params)
+    try:
+        with STORE.transaction():
+            # A task that outlived its TTL must not release a newer task's claim
+            if STORE.get(key) == task_id:
+                STORE.delete(key)
+    except CACHE_ERRORS:
+        pass
+
+
+def _inflight_key(operation, username, params):
+    """The store key for the task in flight for a user
+
+    :Returns: String
+    """
+    return 'inflight:{}:{}:{}'.format(operation, username, ujson.dumps(params))
@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+"""
+Celery settings shared by the API (which sends tasks and reads their results)
+and the workers.
+
+Tasks are routed to two queues, so quick reads never wait behind slow
+provisioning. Start a pool of workers per queue with ``QUEUES`` and
+``CONCURRENCY`` (see the WorkerDockerfile). Within the read queue,
+``gateway.show`` jumps ahead of the other reads.
+"""
+from kombu import Queue
+
+from vlab_gateway_api.lib import const
+
+
+broker_url = const.VLAB_MESSAGE_BROKER
+# Every uWSGI thread of the API publishes at once, and send_task blocks until a
+# pooled connection is free; keep at least as many as ``threads`` in app.ini.
+broker_pool_limit = const.VLAB_GATEWAY_BROKER_POOL_LIMIT
+# RabbitMQ acks every publish, so a task is in the queue once send_task returns;
+# otherwise a publish on a pooled connection the broker already dropped is lost.
+broker_transport_options = {'confirm_publish': True}
+# Any API process can look up any result, even after a restart (see result_backend.py)
+result_backend = const.VLAB_GATEWAY_RESULT_BACKEND
+result_serializer = const.VLAB_GATEWAY_RESULT_SERIALIZER
+result_accept_content = ['json', 'msgpack']
+result_expires = const.VLAB_GATEWAY_RESULT_TTL
+
+MAX_PRIORITY = 9
+
+task_queues = (
+    # RabbitMQ only honors message priority on queues declared with a max priority
+    Queue(const.VLAB_GATEWAY_READ_QUEUE, queue_arguments={'x-max-priority': MAX_PRIORITY}),
+    Queue(const.VLAB_GATEWAY_PROVISION_QUEUE),
+)
+task_default_queue = const.VLAB_GATEWAY_PROVISION_QUEUE
+task_routes = {
+    'gateway.show': {'queue': const.VLAB_GATEWAY_READ_QUEUE, 'priority': MAX_PRIORITY},
+    'gateway.networks': {'queue': const.VLAB_GATEWAY_READ_QUEUE},
+    'gateway.image': {'queue': const.VLAB_GATEWAY_READ_QUEUE},
+    'gateway.fleet': {'queue': const.VLAB_GATEWAY_READ_QUEUE},
+    'gateway.bulk': {'queue': const.VLAB_GATEWAY_READ_QUEUE},
+    'gateway.create': {'queue': const.VLAB_GATEWAY_PROVISION_QUEUE},
+    'gateway.delete': {'queue': const.VLAB_GATEWAY_PROVISION_QUEUE},
+    'gateway.delete_wait': {'queue': const.VLAB_GATEWAY_PROVISION_QUEUE},
+    'gateway.reconfigure': {'queue': const.VLAB_GATEWAY_PROVISION_QUEUE},
+    'gateway.pool_refill': {'queue': const.VLAB_GATEWAY_PROVISION_QUEUE},
+}
+# A worker only reserves the task it's running; otherwise a quick task can sit
+# behind a 10 minute create that the same worker prefetched first.
+worker_prefetch_multiplier = 1
@@ -17,6 +17,7 @@ DEFINED = OrderedDict([
             ('VLAB_GATEWAY_LOG_LEVEL', environ.get('VLAB_GATEWAY_LOG_LEVEL', 'INFO')),
             ('VLAB_MESSAGE_BROKER', environ.get('VLAB_MESSAGE_BROKER', 'gateway-broker')),
             ('VLAB_GATEWAY_IMAGES_DIR', environ.get('VLAB_GATEWAY_IMAGES_DIR', '/images')),
+            ('VLAB_GATEWAY_DEFAULT_IMAGE', environ.get('VLAB_GATEWAY_DEFAULT_IMAGE', 'defaultgateway-IPAM.ova')),
             ('INF_VCENTER_TOP_LVL_DIR', environ.get('INF_VCENTER_TOP_LVL_DIR', '/vlab')),
             ('VLAB_DOMAIN', environ.get('VLAB_DOMAIN', 'local')),
             ('VLAB_IPAM_ADMIN', 'administrator'),
@@ -25,6 +26,61 @@ DEFINED = OrderedDict([
             ('VLAB_IPAM_BROKER', environ.get('VLAB_IPAM_BROKER', 'localhost:9092')),
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
             ('VLAB_DDNS_KEY', environ.get('VLAB_DDNS_KEY', 'aabbcc')),
+            ('INF_VCENTER_MAX_SESSIONS', int(environ.get('INF_VCENTER_MAX_SESSIONS', 2))),
+            ('INF_VCENTER_SESSION_CHECK', int(environ.get('INF_VCENTER_SESSION_CHECK', 60))),
+            ('VLAB_GATEWAY_BOOT_TIMEOUT', int(environ.get('VLAB_GATEWAY_BOOT_TIMEOUT', 600))),
+            ('VLAB_GATEWAY_SHUTDOWN_TIMEOUT', int(environ.get('VLAB_GATEWAY_SHUTDOWN_TIMEOUT', 60))),
+            ('VLAB_GATEWAY_DEPLOY_MODE', environ.get('VLAB_GATEWAY_DEPLOY_MODE', 'ova')),
+            ('VLAB_GATEWAY_TEMPLATE_DIR', environ.get('VLAB_GATEWAY_TEMPLATE_DIR', 'gatewayTemplates')),
+            ('VLAB_GATEWAY_TEMPLATE_IMPORT_LEASE', int(environ.get('VLAB_GATEWAY_TEMPLATE_IMPORT_LEASE', 3600))),
+            ('VLAB_GATEWAY_POOL_SIZE', int(environ.get('VLAB_GATEWAY_POOL_SIZE', 0))),
+            ('VLAB_GATEWAY_POOL_REFILL_RATE', int(environ.get('VLAB_GATEWAY_POOL_REFILL_RATE', 2))),
+            ('VLAB_GATEWAY_POOL_REFILL_INTERVAL', int(environ.get('VLAB_GATEWAY_POOL_REFILL_INTERVAL', 300))),
+            ('VLAB_GATEWAY_POOL_DIR', environ.get('VLAB_GATEWAY_POOL_DIR', 'gatewayPool')),
+            ('VLAB_GATEWAY_POOL_WAN', environ.get('VLAB_GATEWAY_POOL_WAN', 'frontend')),
+            ('VLAB_GATEWAY_POOL_LAN', environ.get('VLAB_GATEWAY_POOL_LAN', 'gatewayPool')),
+            ('VLAB_GATEWAY_CACHE_DB', environ.get('VLAB_GATEWAY_CACHE_DB', '/var/cache/vlab/gateway.db')),
+            ('VLAB_GATEWAY_CACHE_TTL', int(environ.get('VLAB_GATEWAY_CACHE_TTL', 300))),
+            ('VLAB_GATEWAY_NETWORK_CHECK_TIMEOUT', int(environ.get('VLAB_GATEWAY_NETWORK_CHECK_TIMEOUT', 5))),
+            ('VLAB_GATEWAY_IMAGE_CHECK_TIMEOUT', int(environ.get('VLAB_GATEWAY_IMAGE_CHECK_TIMEOUT', 5))),
+            ('VLAB_GATEWAY_ADMINS', [x for x in environ.get('VLAB_GATEWAY_ADMINS', '').split(',') if x]),
+            ('VLAB_GATEWAY_BULK_CONCURRENCY', int(environ.get('VLAB_GATEWAY_BULK_CONCURRENCY', 10))),
+            ('VLAB_GATEWAY_BULK_POLL', int(environ.get('VLAB_GATEWAY_BULK_POLL', 10))),
+            ('VLAB_GATEWAY_BULK_TASK_TIMEOUT', int(environ.get('VLAB_GATEWAY_BULK_TASK_TIMEOUT', 1800))),
+            ('VLAB_GATEWAY_BULK_TTL', int(environ.get('VLAB_GATEWAY_BULK_TTL', 86400))),
+            ('VLAB_GATEWAY_BULK_MAX_USERS', int(environ.get('VLAB_GATEWAY_BULK_MAX_USERS', 500))),
+            ('VLAB_GATEWAY_CREATE_CONCURRENCY', int(environ.get('VLAB_GATEWAY_CREATE_CONCURRENCY', 4))),
+            ('VLAB_GATEWAY_CREATE_RATE', float(environ.get('VLAB_GATEWAY_CREATE_RATE', 0.2))),
+            ('VLAB_GATEWAY_DELETE_CONCURRENCY', int(environ.get('VLAB_GATEWAY_DELETE_CONCURRENCY', 8))),
+            ('VLAB_GATEWAY_DELETE_RATE', float(environ.get('VLAB_GATEWAY_DELETE_RATE', 1))),
+            ('VLAB_GATEWAY_RECONFIGURE_CONCURRENCY', int(environ.get('VLAB_GATEWAY_RECONFIGURE_CONCURRENCY', 8))),
+            ('VLAB_GATEWAY_RECONFIGURE_RATE', float(environ.get('VLAB_GATEWAY_RECONFIGURE_RATE', 1))),
+            ('VLAB_GATEWAY_SHOW_CONCURRENCY', int(environ.get('VLAB_GATEWAY_SHOW_CONCURRENCY', 16))),
+            ('VLAB_GATEWAY_SHOW_RATE', float(environ.get('VLAB_GATEWAY_SHOW_RATE', 10))),
+            ('VLAB_GATEWAY_ADMISSION_WAIT', int(environ.get('VLAB_GATEWAY_ADMISSION_WAIT', 30))),
+            ('VLAB_GATEWAY_ADMISSION_LEASE', int(environ.get('VLAB_GATEWAY_ADMISSION_LEASE', 1800))),
+            ('VLAB_GATEWAY_READ_QUEUE', environ.get('VLAB_GATEWAY_READ_QUEUE', 'gateway_read')),
+            ('VLAB_GATEWAY_PROVISION_QUEUE', environ.get('VLAB_GATEWAY_PROVISION_QUEUE', 'gateway_provision')),
+            ('VLAB_GATEWAY_READ_TIME_LIMIT', int(environ.get('VLAB_GATEWAY_READ_TIME_LIMIT', 60))),
+            ('VLAB_GATEWAY_INFLIGHT_TTL', int(environ.get('VLAB_GATEWAY_INFLIGHT_TTL', 1800))),
+            ('VLAB_GATEWAY_DELETE_POLL', int(environ.get('VLAB_GATEWAY_DELETE_POLL', 10))),
+            ('VLAB_GATEWAY_DELETE_TIMEOUT', int(environ.get('VLAB_GATEWAY_DELETE_TIMEOUT', 600))),
+            ('VLAB_GATEWAY_PROGRESS_TTL', int(environ.get('VLAB_GATEWAY_PROGRESS_TTL', 3600))),
+            ('VLAB_GATEWAY_PROGRESS_POLL', float(environ.get('VLAB_GATEWAY_PROGRESS_POLL', 0.5))),
+            ('VLAB_GATEWAY_PROGRESS_STREAMS', int(environ.get('VLAB_GATEWAY_PROGRESS_STREAMS', 2))),
+            ('VLAB_GATEWAY_PROGRESS_STREAM_MAX', int(environ.get('VLAB_GATEWAY_PROGRESS_STREAM_MAX', 300))),
+            ('VLAB_GATEWAY_RESULT_BACKEND', environ.get('VLAB_GATEWAY_RESULT_BACKEND', 'vlab_gateway_api.lib.result_backend:StoreBackend')),
+            ('VLAB_GATEWAY_RESULT_SERIALIZER', environ.get('VLAB_GATEWAY_RESULT_SERIALIZER', 'msgpack')),
+            ('VLAB_GATEWAY_RESULT_TTL', int(environ.get('VLAB_GATEWAY_RESULT_TTL', 86400))),
+            ('VLAB_GATEWAY_METRICS_PORT', int(environ.get('VLAB_GATEWAY_METRICS_PORT', 9100))),
+            ('VLAB_GATEWAY_PROFILE', environ.get('VLAB_GATEWAY_PROFILE', '')),
+            ('VLAB_GATEWAY_BROKER_POOL_LIMIT', int(environ.get('VLAB_GATEWAY_BROKER_POOL_LIMIT', 16))),
+            ('VLAB_GATEWAY_FLEET_PAGE', int(environ.get('VLAB_GATEWAY_FLEET_PAGE', 500))),
+            ('VLAB_GATEWAY_FLEET_PAGE_TIMEOUT', int(environ.get('VLAB_GATEWAY_FLEET_PAGE_TIMEOUT', 30))),
+            ('VLAB_GATEWAY_DNS_TTL', int(environ.get('VLAB_GATEWAY_DNS_TTL', 300))),
+            ('VLAB_GATEWAY_DNS_STALE', int(environ.get('VLAB_GATEWAY_DNS_STALE', 3600))),
+            ('VLAB_GATEWAY_HEALTH_INTERVAL', int(environ.get('VLAB_GATEWAY_HEALTH_INTERVAL', 10))),
+            ('VLAB_GATEWAY_IMAGE_CHECKSUM_LEASE', int(environ.get('VLAB_GATEWAY_IMAGE_CHECKSUM_LEASE', 3600))),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
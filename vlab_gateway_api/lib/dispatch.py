@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+"""
+Queue the tasks that change (or show) a user's gateway.
+
+Every task for a user goes through ``send_once``, whether the API or a bulk
+operation sends it, so double clicks, client retries and bulk operations share
+one task instead of racing each other on the same VM.
+"""
+import uuid
+
+from vlab_gateway_api.lib import const, cache, progress
+
+
+def send_once(celery_app, operation, username, params, txn_id, logger, task_id=None):
+    """Queue a task for a user, unless the same task is already in flight.
+
+    :Returns: String - The id of the task; not ``task_id`` if the same task was
+              already in flight
+
+    :param celery_app: The Celery app to send the task with
+    :type celery_app: celery.Celery
+
+    :param operation: The kind of task; "show", "create", "delete" or "reconfigure"
+    :type operation: String
+
+    :param username: The user who owns the gateway
+    :type username: String
+
+    :param params: The arguments of the task, between the username and txn_id
+    :type params: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.Logger
+
+    :param task_id: The id to queue the task with; a new one if None
+    :type task_id: String
+    """
+    if task_id is None:
+        task_id = str(uuid.uuid4())
+    if operation == 'show':
+        ttl = const.VLAB_GATEWAY_READ_TIME_LIMIT
+    else:
+        ttl = const.VLAB_GATEWAY_INFLIGHT_TTL
+    existing = cache.claim_inflight(operation, username, params, task_id, ttl)
+    if existing is not None:
+        logger.info('Reusing in flight {} task {} for {}'.format(operation, existing, username))
+        return existing
+    try:
+        task = celery_app.send_task('gateway.{}'.format(operation),
+                                    [username] + params + [txn_id],
+                                    task_id=task_id)
+    except Exception:
+        cache.release_inflight(operation, username, params, task_id)
+        raise
+    if operation != 'show':
+        # So the events endpoint knows who the task belongs to, before a worker picks it up
+        progress.publish(task.id, username, progress.QUEUED)
+    return task.id
@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+"""
+Background checks of everything the service depends on.
+
+The healthcheck end point is hit by load balancers every few seconds, so it
+never checks anything itself; it returns the results of the last checks, which
+a thread in each API process refreshes every ``VLAB_GATEWAY_HEALTH_INTERVAL``
+seconds.
+
+The API has no vCenter credentials, so every worker checks in via the shared
+store on the same interval, with how its vCenter session is doing; a worker
+that stops checking in is dead (or wedged), as far as the API can tell.
+"""
+import os
+import time
+import threading
+import pkg_resources
+from collections import OrderedDict
+
+from vlab_api_common import get_logger
+
+from vlab_gateway_api.lib import const, cache
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_GATEWAY_LOG_LEVEL)
+# A worker is dead once it misses this many check ins
+MISSED_CHECKS = 3
+
+_LOCK = threading.Lock()
+_STATE = {'pid': None, 'results': OrderedDict()}
+
+
+def _version():
+    """Look up the installed version of this service
+
+    :Returns: String
+    """
+    try:
+        return pkg_resources.get_distribution('vlab-gateway-api').version
+    except pkg_resources.DistributionNotFound:
+        return 'unknown'
+
+
+# Scanning the package metadata is slow; it only changes with a new install
+VERSION = _version()
+
+
+def timed_check(check):
+    """Run a check, and time it
+
+    :Returns: Dictionary
+
+    :param check: Raises an exception if the dependency is unhealthy
+    :type check: Function
+    """
+    started = time.time()
+    try:
+        check()
+    except Exception as doh:
+        error = '{}'.format(doh) or doh.__class__.__name__
+    else:
+        error = None
+    now = time.time()
+    return {'ok': error is None, 'latency': now - started, 'checked': now, 'error': error}
+
+
+def start(celery_app):
+    """Start checking the dependencies of the API in the background, once per process.
+
+    Called on every healthcheck, instead of at import, because uWSGI forks the
+    workers after the app is loaded, and a thread doesn't survive a fork.
+
+    :Returns: None
+
+    :param celery_app: The Celery app the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    with _LOCK:
+        if _STATE['pid'] == os.getpid():
+            return
+        _STATE['pid'] = os.getpid()
+        _STATE['results'] = OrderedDict()
+    threading.Thread(target=_probe_forever, args=(celery_app,), daemon=True).start()
+
+
+def results():
+    """Obtain the results of the last checks
+
+    :Returns: collections.OrderedDict - Empty until the first checks are done
+    """
+    return _STATE['results']
+
+
+def probe(celery_app):
+    """Check every dependency of the API
+
+    :Returns: collections.OrderedDict
+
+    :param celery_app: The Celery app the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    found = OrderedDict()
+    found['broker'] = timed_check(lambda: _check_broker(celery_app))
+    heartbeats = {}
+    def _read_heartbeats():
+        heartbeats.update(cache.get_worker_health())
+    found['workers'] = timed_check(_read_heartbeats)
+    now = time.time()
+    alive = {k: v for k, v in heartbeats.items()
+             if now - v['checked'] < const.VLAB_GATEWAY_HEALTH_INTERVAL * MISSED_CHECKS}
+    found['workers']['alive'] = sorted(alive.keys())
+    if found['workers']['ok'] and not alive:
+        found['workers']['ok'] = False
+        found['workers']['error'] = 'No worker has checked in'
+    if alive:
+        hostname = max(alive, key=lambda x: alive[x]['checked'])
+        found['vcenter'] = dict(alive[hostname]['vcenter'], worker=hostname)
+    else:
+        found['vcenter'] = {'ok': False, 'latency': None, 'checked': None,
+                            'error': 'No worker is checking vCenter', 'worker': None}
+    return found
+
+
+def heartbeat(hostname, check_vcenter):
+    """Check in as a live worker, with how vCenter is doing
+
+    :Returns: Dictionary - The record that was published
+
+    :param hostname: The name of the worker
+    :type hostname: String
+
+    :param check_vcenter: Raises an exception if the vCenter session is unhealthy
+    :type check_vcenter: Function
+    """
+    record = {'vcenter': timed_check(check_vcenter)}
+    record['checked'] = time.time()
+    cache.set_worker_health(hostname, record, const.VLAB_GATEWAY_HEALTH_INTERVAL * MISSED_CHECKS)
+    return record
+
+
+def heartbeat_forever(hostname, check_vcenter):
+    """Check in every ``VLAB_GATEWAY_HEALTH_INTERVAL`` seconds; meant for a daemon thread
+
+    :Returns: None
+
+    :param hostname: The name of the worker
+    :type hostname: String
+
+    :param check_vcenter: Raises an exception if the vCenter session is unhealthy
+    :type check_vcenter: Function
+    """
+    while True:
+        heartbeat(hostname, check_vcenter)
+        time.sleep(const.VLAB_GATEWAY_HEALTH_INTERVAL)
+
+
+def _probe_forever(celery_app):
+    """Refresh the results every ``VLAB_GATEWAY_HEALTH_INTERVAL`` seconds
+
+    :Returns: None
+
+    :param celery_app: The Celery app the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    while True:
+        try:
+            _STATE['results'] = probe(celery_app)
+        except Exception as doh:
+            logger.exception('Health check failed: {}'.format(doh))
+        time.sleep(const.VLAB_GATEWAY_HEALTH_INTERVAL)
+
+
+def _check_broker(celery_app):
+    """Make sure a connection to the message broker can be made
+
+    :Returns: None
+
+    :param celery_app: The Celery app the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    with celery_app.connection_for_write() as conn:
+        conn.ensure_connection(max_retries=1)
@@ -0,0 +1,215 @@
+# -*- coding: UTF-8 -*-
+"""
+Prometheus metrics for the API and the workers.
+
+Every sample is tagged with the txn_id of the request/task it came from, as an
+exemplar; a slow bucket in Grafana then links to the logs of a call that landed
+in it. A txn_id is not a label, because every label value is a new time series.
+
+The workers and uWSGI fork, so they keep their metrics in
+``PROMETHEUS_MULTIPROC_DIR`` (set in both Dockerfiles); the main worker process
+serves them on ``VLAB_GATEWAY_METRICS_PORT``, and any API process on the
+metrics end point. Exemplars are only kept by a single process, like
+``python3 app.py``.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from flask import g, request
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, multiprocess, start_http_server
+from prometheus_client.exposition import choose_encoder
+
+
+# From a quick SOAP call, to deploying an OVA
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+# The combined length of exemplar labels is capped at 128 characters
+MAX_TXN_ID = 100
+
+STAGE_SECONDS = Histogram('vlab_gateway_stage_seconds',
+                          'How long each stage of a task took, like deploying the OVA',
+                          ['stage'], buckets=BUCKETS)
+STAGE_ERRORS = Counter('vlab_gateway_stage_errors',
+                       'How many times a stage of a task raised an exception',
+                       ['stage'])
+TASK_SECONDS = Histogram('vlab_gateway_task_seconds',
+                         'How long each worker task took, by how it ended',
+                         ['task', 'state'], buckets=BUCKETS)
+VCENTER_SESSIONS = Counter('vlab_gateway_vcenter_sessions',
+                           'How many times a task checked out a vCenter session, by how the pool provided it',
+                           ['outcome'])
+ADMISSION_SECONDS = Histogram('vlab_gateway_admission_seconds',
+                              'How long tasks waited to be admitted, from their first attempt',
+                              ['operation'], buckets=BUCKETS)
+REQUEST_SECONDS = Histogram('vlab_gateway_request_seconds',
+                            'How long the API took to respond',
+                            ['method', 'endpoint', 'status'], buckets=BUCKETS)
+
+_CONTEXT = threading.local()
+
+
+def bind(txn_id):
+    """Tag every sample this thread records with a txn_id, until ``task_done``
+
+    :Returns: None
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    _CONTEXT.txn_id = txn_id
+    _CONTEXT.started = time.time()
+
+
+def task_done(task_name, state):
+    """Record how long the task bound to this thread took, and unbind it
+
+    :Returns: None
+
+    :param task_name: The name of the task, like "gateway.create"
+    :type task_name: String
+
+    :param state: How the task ended, like "SUCCESS"
+    :type state: String
+    """
+    started = getattr(_CONTEXT, 'started', None)
+    if started is not None:
+        TASK_SECONDS.labels(task_name, state).observe(time.time() - started, exemplar=_exemplar())
+    _CONTEXT.txn_id = None
+    _CONTEXT.started = None
+
+
+@contextmanager
+def timed(stage, logger=None):
+    """Record how long a block of code takes, and if it raised
+
+    :Returns: None
+
+    :param stage: A short name for what the code does, like "deploy"
+    :type stage: String
+
+    :param logger: Optionally log how long the stage took
+    :type logger: logging.LoggerAdapter
+    """
+    started = time.time()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc(exemplar=_exemplar())
+        raise
+    finally:
+        elapsed = time.time() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed, exemplar=_exemplar())
+        if logger is not None:
+            logger.info('Stage {} took {:.2f} seconds'.format(stage, elapsed))
+
+
+def observe(stage, seconds):
+    """Record how long a stage took, when it was timed somewhere else, like in the guest
+
+    :Returns: None
+
+    :param stage: A short name for what was done
+    :type stage: String
+
+    :param seconds: How long it took
+    :type seconds: Float
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds, exemplar=_exemplar())
+
+
+def session_checkout(outcome):
+    """Count a vCenter session handed out by the session pool
+
+    :Returns: None
+
+    :param outcome: "hit" for an idle session, "miss" for a new login, or
+                    "reconnect" for an expired session that was replaced
+    :type outcome: String
+    """
+    VCENTER_SESSIONS.labels(outcome).inc()
+
+
+def admitted(operation, seconds):
+    """Record how long a task waited for admission control, across retries
+
+    :Returns: None
+
+    :param operation: The kind of task, like "create"
+    :type operation: String
+
+    :param seconds: How long since the task first asked to be admitted
+    :type seconds: Float
+    """
+    ADMISSION_SECONDS.labels(operation).observe(seconds, exemplar=_exemplar())
+
+
+def instrument(app):
+    """Record how long the API takes to respond to every request
+
+    :Returns: None
+
+    :param app: The API
+    :type app: flask.Flask
+    """
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.time()
+        _CONTEXT.txn_id = request.headers.get('X-REQUEST-ID')
+
+    @app.after_request
+    def _stop_timer(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            # The rule, not the path, so task ids don't each become a time series
+            endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+            REQUEST_SECONDS.labels(request.method, endpoint, response.status_code).observe(time.time() - started,
+                                                                                          exemplar=_exemplar())
+        _CONTEXT.txn_id = None
+        return response
+
+
+def exposition(accept_header):
+    """Render every metric, in the format the scraper asked for
+
+    :Returns: Tuple - (bytes, content type)
+
+    :param accept_header: The Accept header of the scrape request
+    :type accept_header: String
+    """
+    encoder, content_type = choose_encoder(accept_header)
+    return encoder(registry()), content_type
+
+
+def registry():
+    """Obtain the metrics of this process, or of every worker process
+
+    :Returns: prometheus_client.CollectorRegistry
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return collected
+    return REGISTRY
+
+
+def serve(port):
+    """Serve the metrics over HTTP, in a background thread
+
+    :Returns: None
+
+    :param port: The TCP port to listen on
+    :type port: Integer
+    """
+    start_http_server(port, registry=registry())
+
+
+def _exemplar():
+    """The exemplar for the sample being recorded
+
+    :Returns: Dictionary, or None if this thread isn't bound to a txn_id
+    """
+    txn_id = getattr(_CONTEXT, 'txn_id', None)
+    if not txn_id:
+        return None
+    return {'txn_id': txn_id[:MAX_TXN_ID]}
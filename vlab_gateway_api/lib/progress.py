@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+Progress events for long running tasks, like creating a gateway.
+
+Workers append events to the shared store as a task moves through its stages,
+and the API streams them to the client. One streaming connection then replaces
+polling ``/task/<id>`` every few seconds for minutes at a time.
+
+The last event of a task is ``COMPLETE`` or ``FAILED``; a ``COMPLETE`` event
+has the same output as ``/task/<id>``.
+"""
+import time
+
+from vlab_gateway_api.lib import const, cache
+
+
+QUEUED = 'queued'
+COMPLETE = 'complete'
+FAILED = 'failed'
+FINISHED = (COMPLETE, FAILED)
+
+
+def publish(task_id, username, stage, detail=None):
+    """Record that a task reached a stage; never raises if the store is unusable
+
+    :Returns: None
+
+    :param task_id: The id of the task
+    :type task_id: String
+
+    :param username: The user the task is for
+    :type username: String
+
+    :param stage: A short name for what the task is doing, like "deploy"
+    :type stage: String
+
+    :param detail: Anything else the client might want to know
+    :type detail: Object
+    """
+    try:
+        with cache.STORE.transaction():
+            record = cache.STORE.get(_key(task_id)) or {'user': username, 'events': []}
+            record['events'].append({'stage': stage, 'detail': detail, 'time': time.time()})
+            cache.STORE.set(_key(task_id), record, ttl=const.VLAB_GATEWAY_PROGRESS_TTL)
+    except cache.CACHE_ERRORS:
+        pass
+
+
+def reporter(task_id, username):
+    """Make a function that publishes the stages of one task
+
+    :Returns: Function - Accepts the stage, and optionally the detail
+
+    :param task_id: The id of the task
+    :type task_id: String
+
+    :param username: The user the task is for
+    :type username: String
+    """
+    def report(stage, detail=None):
+        publish(task_id, username, stage, detail)
+    return report
+
+
+def events(task_id, after=0):
+    """Obtain the events of a task
+
+    :Returns: Tuple - (username, [(event_id, event), ...]), or (None, []) if
+              there's no such task
+
+    :Raises: sqlite3.Error or OSError if the store is unusable
+
+    :param task_id: The id of the task
+    :type task_id: String
+
+    :param after: Only return events with a greater id than this
+    :type after: Integer
+    """
+    record = cache.STORE.get(_key(task_id))
+    if record is None:
+        return None, []
+    # Event ids start at 1, so the client can supply 0 to get everything
+    found = [(idx, x) for idx, x in enumerate(record['events'], start=1) if idx > after]
+    return record['user'], found
+
+
+def no_report(stage, detail=None):
+    """The default for a function that accepts a progress reporter
+
+    :Returns: None
+    """
+    pass
+
+
+def _key(task_id):
+    """The store key of the events for a task
+
+    :Returns: String
+
+    :param task_id: The id of the task
+    :type task_id: String
+    """
+    return 'progress:{}'.format(task_id)
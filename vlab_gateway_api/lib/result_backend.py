@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+"""
+A Celery result backend that keeps task results in the shared store.
+
+With ``rpc://`` a result is sent back to the process that queued the task, and
+can only be read once; if uWSGI restarts (or another API process answers the
+``/task`` call) the result is lost, and clients retry by queuing the whole
+create again. The store is on a volume every API and worker container mounts,
+so any API process can look up any result by its task id, for
+``VLAB_GATEWAY_RESULT_TTL`` seconds.
+
+Set ``VLAB_GATEWAY_RESULT_BACKEND`` to use a different backend, like
+``redis://``.
+"""
+import random
+
+from celery.backends.base import KeyValueStoreBackend
+from kombu.utils.encoding import bytes_to_str
+
+from vlab_gateway_api.lib import cache
+
+
+# Expired results are ignored, but only deleted by a purge; about 1 in this many
+# writes purges them, so no beat scheduler is required to keep the store small.
+PURGE_EVERY = 1000
+
+
+class StoreBackend(KeyValueStoreBackend):
+    """Stores Celery task results in ``cache.STORE``"""
+    def get(self, key):
+        """Look up the serialized result of a task
+
+        :Returns: Bytes/String, or None
+        """
+        return cache.STORE.get_raw(bytes_to_str(key))
+
+    def mget(self, keys):
+        """Look up several results
+
+        :Returns: List
+        """
+        return [self.get(x) for x in keys]
+
+    def set(self, key, value):
+        """Save the serialized result of a task
+
+        :Returns: None
+        """
+        cache.STORE.set_raw(bytes_to_str(key), value, ttl=self.expires)
+        if random.randint(1, PURGE_EVERY) == 1:
+            self.cleanup()
+
+    def delete(self, key):
+        """Forget a result
+
+        :Returns: None
+        """
+        cache.STORE.delete(bytes_to_str(key))
+
+    def incr(self, key):
+        """Atomically count, for chords
+
+        :Returns: Integer
+        """
+        return cache.STORE.incr(bytes_to_str(key))
+
+    def cleanup(self):
+        """Delete expired results; also called by the ``celery.backend_cleanup``
+        task when a worker runs the beat scheduler
+
+        :Returns: None
+        """
+        cache.STORE.purge()
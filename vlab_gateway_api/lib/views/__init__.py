@@ -1,3 +1,4 @@
 # -*- coding: UTF-8 -*-
 from .gateway_view import GatewayView
 from .healthcheck import HealthView
+from .metrics_view import MetricsView
@@ -2,16 +2,24 @@
 """
 Defines the HTTP API for working with network gateways in vLab
 """
+import time
+import threading
+
 import ujson
-from flask import current_app
+from flask import current_app, stream_with_context
 from flask_classy import request, route, Response
 from jsonschema import validate, ValidationError
 from vlab_inf_common.views import TaskView
 from vlab_api_common import describe, get_logger, requires, validate_input
 
-from vlab_gateway_api.lib import const
+from vlab_gateway_api.lib import const, cache, bulk, progress, dispatch
 
 logger = get_logger(__name__, loglevel=const.VLAB_GATEWAY_LOG_LEVEL)
+KEEPALIVE_INTERVAL = 15 # seconds
+# A stream holds a uWSGI thread the whole time it's open; without a cap, a few
+# people watching progress would leave no threads for anything else
+_STREAMS = threading.BoundedSemaphore(const.VLAB_GATEWAY_PROGRESS_STREAMS)
+NDJSON = 'application/x-ndjson'
 
 
 class GatewayView(TaskView):
@@ -27,6 +35,16 @@ class GatewayView(TaskView):
                         "lan": {
                             "description": "The name of the Local Area Network to connect to",
                             "type": "string"
+                        },
+                        "image": {
+                            "description": "The file name of the OVA to deploy; see GET on /image",
+                            "type": "string",
+                            "pattern": "^[^/]+$"
+                        },
+                        "version": {
+                            "description": "The version of the OVA to deploy, instead of its file name",
+                            "type": "string",
+                            "pattern": "^[^/]+$"
                         }
                     },
                     "required":[
@@ -35,18 +53,62 @@ class GatewayView(TaskView):
                     ]
                   }
 
+    # A reconfigure takes no body; it always moves to the current profile
+    PUT_SCHEMA = { "$schema": "http://json-schema.org/draft-04/schema#",
+                   "description": "Change the settings of the gateway to match the current profile",
+                   "type": "object",
+                   "properties": {}
+                 }
+
+    BULK_SCHEMA = { "$schema": "http://json-schema.org/draft-04/schema#",
+                    "type": "object",
+                    "properties": {
+                        "action": {
+                            "description": "What to do to the gateway of every user",
+                            "type": "string",
+                            "enum": list(bulk.ACTIONS)
+                        },
+                        "users": {
+                            "description": "The users, and the WAN/LAN for their gateway when creating",
+                            "type": "array",
+                            "minItems": 1,
+                            "maxItems": const.VLAB_GATEWAY_BULK_MAX_USERS,
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "username": {"type": "string"},
+                                    "wan": {"type": "string"},
+                                    "lan": {"type": "string"}
+                                },
+                                "required": ["username"]
+                            }
+                        }
+                    },
+                    "required":[
+                        "action",
+                        "users"
+                    ]
+                  }
+
     @requires(verify=False, version=2)
-    @describe(post=POST_SCHEMA, delete={}, get_args={})
+    @describe(post=POST_SCHEMA, put=PUT_SCHEMA, delete={}, get_args={})
     def get(self, *args, **kwargs):
         """Obtain a info about the gateways a user owns"""
         username = kwargs['token']['username']
         resp_data = {'user' : username}
+        info = cache.get_show(username)
+        if info is not None:
+            # Nothing has changed since the last gateway.show; skip the round trip
+            resp_data['content'] = info
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 200
+            return resp
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        task = current_app.celery_app.send_task('gateway.show', [username, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        task_id = dispatch.send_once(current_app.celery_app, 'show', username, [], txn_id, logger)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -58,11 +120,23 @@ class GatewayView(TaskView):
         wan = kwargs['body']['wan']
         lan = '{}_{}'.format(username, kwargs['body']['lan'])
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        task = current_app.celery_app.send_task('gateway.create', [username, wan, lan, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        image, error = _find_image(kwargs['body'].get('image'), kwargs['body'].get('version'), txn_id)
+        if error:
+            resp_data['error'] = error
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 400
+            return resp
+        missing = _missing_networks({'WAN': wan, 'LAN': lan}, txn_id)
+        if missing:
+            resp_data['error'] = 'No such network for {}'.format(', '.join(missing))
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 400
+            return resp
+        task_id = dispatch.send_once(current_app.celery_app, 'create', username, [wan, lan, image], txn_id, logger)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -71,9 +145,336 @@ class GatewayView(TaskView):
         username = kwargs['token']['username']
         resp_data = {'user' : username}
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        task = current_app.celery_app.send_task('gateway.delete', [username, txn_id])
+        task_id = dispatch.send_once(current_app.celery_app, 'delete', username, [], txn_id, logger)
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    def put(self, *args, **kwargs):
+        """Change the settings of a gateway to match the current profile"""
+        username = kwargs['token']['username']
+        resp_data = {'user' : username}
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        task_id = dispatch.send_once(current_app.celery_app, 'reconfigure', username, [], txn_id, logger)
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/task/<task_id>/events', methods=["GET"])
+    @requires(verify=False, version=2)
+    def task_events(self, *args, **kwargs):
+        """Stream the progress of a create/delete task as Server-Sent Events"""
+        username = kwargs['token']['username']
+        resp_data = {'user' : username}
+        task_id = kwargs['task_id']
+        try:
+            owner, _ = progress.events(task_id)
+        except cache.CACHE_ERRORS as doh:
+            logger.error('Unable to read task progress: {}'.format(doh))
+            resp_data['error'] = 'Task progress is unavailable'
+            return ujson.dumps(resp_data), 503
+        if owner != username:
+            # Don't leak that another user's task exists
+            resp_data['error'] = 'No such task: {}'.format(task_id)
+            return ujson.dumps(resp_data), 404
+        try:
+            # Set by the browser when it reconnects
+            after = int(request.headers.get('Last-Event-ID', 0))
+        except ValueError:
+            after = 0
+        if not _STREAMS.acquire(blocking=False):
+            resp_data['error'] = 'Too many progress streams; poll {}/task/{} instead'.format(self.route_base, task_id)
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 429
+            resp.headers['Retry-After'] = str(KEEPALIVE_INTERVAL)
+            resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+            return resp
+        resp = Response(stream_with_context(_stream_events(task_id, after)), mimetype='text/event-stream')
+        # Runs even if the client hangs up before the first event is sent
+        resp.call_on_close(_STREAMS.release)
+        resp.headers['Cache-Control'] = 'no-cache'
+        # Otherwise nginx holds the events until its buffer fills up
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+
+    @route('/image', methods=["GET"])
+    @requires(verify=False, version=2)
+    def image(self, *args, **kwargs):
+        """List the OVAs that gateways can be deployed from"""
+        resp_data = {'user' : kwargs['token']['username']}
+        catalog = cache.get_images()
+        if catalog is None:
+            # Workers publish it once they start; no sense waiting on one
+            resp_data['error'] = 'Gateway images are unavailable; no worker has published them yet'
+            return ujson.dumps(resp_data), 503
+        resp_data['content'] = {'image': [x['version'] for x in catalog if x['error'] is None],
+                                'details': catalog}
+        return ujson.dumps(resp_data), 200
+
+    @route('/bulk', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @requires(username=const.VLAB_GATEWAY_ADMINS, version=None, verify=const.VLAB_VERIFY_TOKEN)
+    @validate_input(schema=BULK_SCHEMA)
+    @describe(post=BULK_SCHEMA)
+    def bulk(self, *args, **kwargs):
+        """Create or delete the gateways of many users (admin only)"""
+        username = kwargs['token']['username']
+        resp_data = {'user' : username}
+        action = kwargs['body']['action']
+        users = []
+        for user in kwargs['body']['users']:
+            if action == 'create':
+                if not (user.get('wan') and user.get('lan')):
+                    resp_data['error'] = 'wan and lan are required to create a gateway for {}'.format(user['username'])
+                    return ujson.dumps(resp_data), 400
+                # Same naming as a user's own POST
+                user = dict(user, lan='{}_{}'.format(user['username'], user['lan']))
+            users.append(user)
+        if len(set(x['username'] for x in users)) != len(users):
+            resp_data['error'] = 'Each user can only be supplied once'
+            return ujson.dumps(resp_data), 400
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        try:
+            bulk_id = bulk.start(action, users)
+        except cache.CACHE_ERRORS as doh:
+            logger.error('Unable to start bulk operation: {}'.format(doh))
+            resp_data['error'] = 'Bulk operations are unavailable'
+            return ujson.dumps(resp_data), 503
+        task = current_app.celery_app.send_task('gateway.bulk', [bulk_id, txn_id])
+        resp_data['content'] = {'bulk-id': bulk_id, 'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/bulk/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, bulk_id))
+        return resp
+
+    @route('/fleet', methods=["GET"])
+    @requires(verify=False, version=2)
+    @requires(username=const.VLAB_GATEWAY_ADMINS, version=None, verify=False)
+    def fleet(self, *args, **kwargs):
+        """List the gateway of every user, a page at a time (admin only).
+
+        Send ``Accept: application/x-ndjson`` to have every page streamed back
+        as one gateway per line, instead of queuing a task for the first page.
+        """
+        username = kwargs['token']['username']
+        resp_data = {'user' : username}
+        version = request.args.get('version')
+        after = request.args.get('after')
+        generation = request.args.get('generation')
+        try:
+            if generation is not None:
+                generation = int(generation)
+            limit = int(request.args.get('limit', const.VLAB_GATEWAY_FLEET_PAGE))
+        except ValueError:
+            resp_data['error'] = 'generation and limit must be integers'
+            return ujson.dumps(resp_data), 400
+        if not 0 < limit <= const.VLAB_GATEWAY_FLEET_PAGE:
+            resp_data['error'] = 'limit must be between 1 and {}'.format(const.VLAB_GATEWAY_FLEET_PAGE)
+            return ujson.dumps(resp_data), 400
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        params = [username, version, generation, after, limit, txn_id]
+        if request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+            resp = Response(stream_with_context(_stream_fleet(params)), mimetype=NDJSON)
+            # Otherwise nginx holds the gateways until its buffer fills up
+            resp.headers['X-Accel-Buffering'] = 'no'
+            return resp
+        task = current_app.celery_app.send_task('gateway.fleet', params)
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
         resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
         return resp
+
+    @route('/bulk/<bulk_id>', methods=["GET"])
+    @requires(verify=False, version=2)
+    @requires(username=const.VLAB_GATEWAY_ADMINS, version=None, verify=False)
+    def bulk_status(self, *args, **kwargs):
+        """Check the progress of a bulk create/delete (admin only)"""
+        resp_data = {'user' : kwargs['token']['username']}
+        try:
+            info = bulk.status(kwargs['bulk_id'])
+        except cache.CACHE_ERRORS as doh:
+            logger.error('Unable to check bulk operation: {}'.format(doh))
+            resp_data['error'] = 'Bulk operations are unavailable'
+            return ujson.dumps(resp_data), 503
+        if info is None:
+            resp_data['error'] = 'No such bulk operation: {}'.format(kwargs['bulk_id'])
+            return ujson.dumps(resp_data), 404
+        resp_data['content'] = info
+        status_code = 200 if info['complete'] else 202
+        return ujson.dumps(resp_data), status_code
+
+
+def _find_image(image, version, txn_id):
+    """Pick the OVA to deploy, using the images the workers last published.
+
+    Like ``_missing_networks``, an image that's not in the published catalog
+    might be brand new, so a worker is asked for the current catalog before
+    deciding it doesn't exist; and if no answer comes back quickly, the image is
+    assumed to exist. Until a worker publishes the catalog, every image is
+    assumed to exist, without asking.
+
+    :Returns: Tuple - (the file name of the OVA, an error message or None)
+
+    :param image: The file name of the OVA, or None
+    :type image: String
+
+    :param version: The version of the OVA, or None
+    :type version: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    if image is None and version is None:
+        image = const.VLAB_GATEWAY_DEFAULT_IMAGE
+    published = cache.get_images()
+    if published is None:
+        # The worker reports a missing image when it runs the task
+        return image or '{}.ova'.format(version), None
+    entry = _match_image(published, image, version)
+    if entry is None:
+        catalog = _fetch_images(txn_id)
+        if catalog is None:
+            return image or '{}.ova'.format(version), None
+        entry = _match_image(catalog, image, version)
+    if entry is None:
+        return None, 'No such image: {}'.format(image or version)
+    if entry['error']:
+        return None, 'Unable to deploy image {}: {}'.format(entry['version'], entry['error'])
+    return entry['image'], None
+
+
+def _match_image(catalog, image, version):
+    """Find an OVA in the catalog by file name and/or version
+
+    :Returns: Dictionary, or None if there's no such OVA
+
+    :param catalog: The images the workers published
+    :type catalog: List
+
+    :param image: The file name of the OVA, or None
+    :type image: String
+
+    :param version: The version of the OVA, or None
+    :type version: String
+    """
+    for entry in catalog:
+        if image in (None, entry['image']) and version in (None, entry['version']):
+            return entry
+    return None
+
+
+def _fetch_images(txn_id):
+    """Ask a worker for the current catalog of images
+
+    :Returns: List, or None if no worker answered in time
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    try:
+        task = current_app.celery_app.send_task('gateway.image', [txn_id])
+        result = task.get(timeout=const.VLAB_GATEWAY_IMAGE_CHECK_TIMEOUT)
+    except Exception as doh:
+        logger.info('Unable to look up gateway images: {}'.format(doh))
+        return None
+    if result['error']:
+        logger.info('Unable to look up gateway images: {}'.format(result['error']))
+        return None
+    return result['content']
+
+
+def _stream_fleet(params):
+    """Yield every gateway in the fleet as a line of JSON, asking a worker for
+    one page at a time; so only one page is ever in memory.
+
+    :Returns: Generator
+
+    :param params: The arguments of the ``gateway.fleet`` task for the first page
+    :type params: List
+    """
+    while True:
+        try:
+            task = current_app.celery_app.send_task('gateway.fleet', params)
+            result = task.get(timeout=const.VLAB_GATEWAY_FLEET_PAGE_TIMEOUT)
+        except Exception as doh:
+            logger.error('Unable to list gateways: {}'.format(doh))
+            result = {'error': 'Unable to list gateways; try again later'}
+        if result['error']:
+            # The status code is long gone; the client finds out on the last line
+            yield ujson.dumps({'error': result['error']}) + '\n'
+            return
+        for gateway in result['content']['gateways']:
+            yield ujson.dumps(gateway) + '\n'
+        if result['content']['next'] is None:
+            return
+        params = params[:3] + [result['content']['next']] + params[4:]
+
+
+def _stream_events(task_id, after):
+    """Yield the progress events of a task as Server-Sent Events, until the
+    task is done, or ``VLAB_GATEWAY_PROGRESS_STREAM_MAX`` seconds pass (clients
+    reconnect on their own, and resume with the Last-Event-ID header).
+
+    :Returns: Generator
+
+    :param task_id: The id of the task
+    :type task_id: String
+
+    :param after: The id of the last event the client already has
+    :type after: Integer
+    """
+    # How long the client waits before reconnecting, in milliseconds
+    yield 'retry: 1000\n\n'
+    started = time.time()
+    last_sent = started
+    while time.time() - started < const.VLAB_GATEWAY_PROGRESS_STREAM_MAX:
+        try:
+            _, found = progress.events(task_id, after)
+        except cache.CACHE_ERRORS as doh:
+            logger.error('Unable to read task progress: {}'.format(doh))
+            return
+        for event_id, event in found:
+            yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event['stage'], ujson.dumps(event))
+            after = event_id
+            last_sent = time.time()
+            if event['stage'] in progress.FINISHED:
+                return
+        if time.time() - last_sent > KEEPALIVE_INTERVAL:
+            # A comment; keeps proxies from closing an idle connection
+            yield ': keepalive\n\n'
+            last_sent = time.time()
+        time.sleep(const.VLAB_GATEWAY_PROGRESS_POLL)
+
+
+def _missing_networks(networks, txn_id):
+    """Check that networks exist, using the names the workers last published.
+
+    A name that's not in the published list might be a brand new network, so a
+    worker is asked for the current names before deciding it doesn't exist. If
+    no answer comes back quickly, the networks are assumed to exist, and the
+    create task reports the problem like it always has.
+
+    :Returns: List - The "<role>: <name>" of every network that does not exist
+
+    :param networks: The role (i.e. WAN/LAN) of each network, and its name
+    :type networks: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    unknown = [x for x in networks.values() if not cache.network_exists(x)]
+    if not unknown:
+        return []
+    try:
+        task = current_app.celery_app.send_task('gateway.networks', [txn_id])
+        names = set(task.get(timeout=const.VLAB_GATEWAY_NETWORK_CHECK_TIMEOUT)['content'])
+    except Exception as doh:
+        logger.info('Unable to check networks {}: {}'.format(unknown, doh))
+        return []
+    return ['{}: {}'.format(role, name) for role, name in sorted(networks.items()) if name not in names]
@@ -3,11 +3,13 @@
 Enables Health checks for the Links service
 """
 from time import time
-import pkg_resources
 
 import ujson
+from flask import current_app
 from flask_classy import FlaskView
 
+from vlab_gateway_api.lib import health
+
 
 class HealthView(FlaskView):
     """Logic for checking service health"""
@@ -17,5 +19,8 @@ class HealthView(FlaskView):
     def get(self):
         """API end point for checking service health"""
         stime = time()
-        version = pkg_resources.get_distribution('vlab-gateway-api').version
-        return ujson.dumps({'latency' : time() - stime, 'version' : version}), 200
+        health.start(current_app.celery_app)
+        resp_data = {'version' : health.VERSION,
+                     'dependencies' : health.results()}
+        resp_data['latency'] = time() - stime
+        return ujson.dumps(resp_data), 200
@@ -0,0 +1,18 @@
+# -*- coding: UTF-8 -*-
+"""
+Exposes the metrics of the API for Prometheus to scrape
+"""
+from flask_classy import FlaskView, request, Response
+
+from vlab_gateway_api.lib import metrics
+
+
+class MetricsView(FlaskView):
+    """Logic for serving Prometheus metrics"""
+    route_base = '/api/1/inf/gateway/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """API end point for scraping metrics; supports the OpenMetrics format, for exemplars"""
+        body, content_type = metrics.exposition(request.headers.get('Accept'))
+        return Response(body, status=200, content_type=content_type)
@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+"""
+Admission control for the tasks that work with vCenter.
+
+Every kind of operation (create/delete/show) has a semaphore, limiting how many
+run at once across every worker, and a token bucket, limiting how often they
+start. Both live in the shared store. A task that isn't admitted within
+``VLAB_GATEWAY_ADMISSION_WAIT`` seconds raises ``Busy``, so it can be retried
+later instead of holding a worker process hostage. How long tasks waited is
+recorded on the ``vlab_gateway_admission_seconds`` histogram.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from vlab_gateway_api.lib import const, cache, metrics
+
+
+POLL_MAX = 2 # seconds
+# The most concurrent tasks, and the most started per second; zero means no limit
+LIMITS = {'create': (const.VLAB_GATEWAY_CREATE_CONCURRENCY, const.VLAB_GATEWAY_CREATE_RATE),
+          'delete': (const.VLAB_GATEWAY_DELETE_CONCURRENCY, const.VLAB_GATEWAY_DELETE_RATE),
+          'reconfigure': (const.VLAB_GATEWAY_RECONFIGURE_CONCURRENCY, const.VLAB_GATEWAY_RECONFIGURE_RATE),
+          'show': (const.VLAB_GATEWAY_SHOW_CONCURRENCY, const.VLAB_GATEWAY_SHOW_RATE)}
+
+
+class Busy(Exception):
+    """Raised when a task was not admitted in time
+
+    :param operation: The kind of task; "create", "delete", "reconfigure" or "show"
+    :type operation: String
+
+    :param wait: About how many seconds until the task could be admitted
+    :type wait: Float
+    """
+    def __init__(self, operation, wait):
+        super(Busy, self).__init__('Too many {} tasks; try again in {:.1f} seconds'.format(operation, wait))
+        self.wait = wait
+
+
+@contextmanager
+def admit(operation, ticket, logger):
+    """Block until the operation can use vCenter, and hold a slot until done
+
+    :Returns: None
+
+    :Raises: Busy
+
+    :param operation: The kind of task; "create", "delete", "reconfigure" or "show"
+    :type operation: String
+
+    :param ticket: A unique id for the task, which stays the same when retried
+    :type ticket: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    holder = uuid.uuid4().hex
+    try:
+        first_try = _first_try(ticket)
+        wait = _acquire(operation, holder)
+        started = time.time()
+        while wait:
+            if time.time() - started + wait > const.VLAB_GATEWAY_ADMISSION_WAIT:
+                raise Busy(operation, wait)
+            time.sleep(min(wait, POLL_MAX))
+            wait = _acquire(operation, holder)
+    except cache.CACHE_ERRORS as doh:
+        # Better to run unlimited than to not run at all
+        logger.error('Admission control unavailable: {}'.format(doh))
+        unlimited = True
+    else:
+        unlimited = False
+    if unlimited:
+        yield
+        return
+    waited = time.time() - first_try
+    metrics.admitted(operation, waited)
+    logger.info('Admitted {} task after {:.1f} seconds'.format(operation, waited))
+    try:
+        yield
+    finally:
+        try:
+            _release(operation, holder)
+            cache.STORE.delete(_ticket_key(ticket))
+        except cache.CACHE_ERRORS as doh:
+            # The lease expires eventually
+            logger.error('Unable to release admission slot: {}'.format(doh))
+
+
+def _first_try(ticket):
+    """Remember when a task first asked to be admitted, even across retries
+
+    :Returns: Float - The epoch time of the first attempt
+
+    :param ticket: A unique id for the task
+    :type ticket: String
+    """
+    now = time.time()
+    key = _ticket_key(ticket)
+    if cache.STORE.add(key, now, ttl=const.VLAB_GATEWAY_ADMISSION_LEASE):
+        return now
+    return cache.STORE.get(key) or now
+
+
+def _acquire(operation, holder):
+    """Try to take a slot in the semaphore, and a token from the bucket
+
+    :Returns: Float - Zero if admitted, otherwise about how many seconds to wait
+
+    :param operation: The kind of task
+    :type operation: String
+
+    :param holder: A unique id for this attempt
+    :type holder: String
+    """
+    concurrency, rate = LIMITS[operation]
+    now = time.time()
+    with cache.STORE.transaction():
+        holders = {}
+        if concurrency:
+            # A holder that crashed never releases; its lease expires instead
+            holders = {k: v for k, v in (cache.STORE.get(_sem_key(operation)) or {}).items() if v > now}
+            if len(holders) >= concurrency:
+                # No telling when a slot frees up
+                return POLL_MAX
+        if rate:
+            burst = max(concurrency, 1)
+            bucket = cache.STORE.get(_bucket_key(operation)) or {'tokens': burst, 'updated': now}
+            tokens = min(burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            cache.STORE.set(_bucket_key(operation), {'tokens': tokens - 1, 'updated': now})
+        if concurrency:
+            holders[holder] = now + const.VLAB_GATEWAY_ADMISSION_LEASE
+            cache.STORE.set(_sem_key(operation), holders)
+    return 0
+
+
+def _release(operation, holder):
+    """Give up a slot in the semaphore
+
+    :Returns: None
+
+    :param operation: The kind of task
+    :type operation: String
+
+    :param holder: The id supplied to ``_acquire``
+    :type holder: String
+    """
+    if not LIMITS[operation][0]:
+        return
+    with cache.STORE.transaction():
+        holders = cache.STORE.get(_sem_key(operation)) or {}
+        holders.pop(holder, None)
+        cache.STORE.set(_sem_key(operation), holders)
+
+
+def _sem_key(operation):
+    """The store key of an operation's semaphore
+
+    :Returns: String
+    """
+    return 'admission-sem:{}'.format(operation)
+
+
+def _bucket_key(operation):
+    """The store key of an operation's token bucket
+
+    :Returns: String
+    """
+    return 'admission-bucket:{}'.format(operation)
+
+
+def _ticket_key(ticket):
+    """The store key for when a task first asked to be admitted
+
+    :Returns: String
+    """
+    return 'admission-ticket:{}'.format(ticket)
@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""
+Everything about configuring a gateway that's the same for every user, built
+once per worker instead of on every create.
+
+That's the IP of the vLab server, the profile, and the commands of every step
+that isn't specific to a user (already escaped for sed, and checked for
+dependencies the setup script cannot run). The context is only built again
+when the IP or the ``VLAB_GATEWAY_PROFILE`` file changes.
+
+The IP comes from a DNS cache, which keeps every answer for
+``VLAB_GATEWAY_DNS_TTL`` seconds; while DNS is down, an answer is used for up
+to ``VLAB_GATEWAY_DNS_STALE`` more seconds, so an outage doesn't fail every
+create.
+"""
+import os
+import time
+import socket
+import threading
+from collections import namedtuple
+
+from vlab_gateway_api.lib import const
+from vlab_gateway_api.lib.worker import profile, provision
+
+
+# The name of the vLab server, without the scheme of VLAB_URL
+VLAB_HOST = const.VLAB_URL.replace('https://', '').replace('http://', '')
+
+# common_steps - The steps that every new gateway runs, besides ``provision.user_steps``
+Context = namedtuple('Context', ['vlab_ip', 'profile', 'common_steps'])
+Answer = namedtuple('Answer', ['addr', 'expires'])
+
+
+def _resolve(name):
+    """Resolve a DNS name into an IP address
+
+    :Returns: String
+
+    :param name: The FQDN to resolve
+    :type name: String
+    """
+    hostname, aliases, addr = socket.gethostbyname_ex(name)
+    return addr[0]
+
+
+class DnsCache(object):
+    """Resolves DNS names, reusing every answer until it expires. Thread safe.
+
+    :param ttl: How many seconds to use an answer before resolving the name again
+    :type ttl: Integer
+
+    :param stale: How many seconds past ``ttl`` an answer is used, when the name cannot be resolved
+    :type stale: Integer
+
+    :param resolve: Looks up the IP of a name
+    :type resolve: Function
+    """
+    def __init__(self, ttl, stale, resolve=_resolve):
+        self.ttl = ttl
+        self.stale = stale
+        self._resolve = resolve
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, name):
+        """Obtain the IP of a name
+
+        :Returns: String
+
+        :Raises: OSError if the name cannot be resolved, and there's no usable answer
+
+        :param name: The FQDN to resolve
+        :type name: String
+        """
+        now = time.monotonic()
+        with self._lock:
+            answer = self._answers.get(name)
+        if answer is not None and now < answer.expires:
+            return answer.addr
+        try:
+            addr = self._resolve(name)
+        except OSError:
+            if answer is not None and now < answer.expires + self.stale:
+                return answer.addr
+            raise
+        with self._lock:
+            self._answers[name] = Answer(addr, now + self.ttl)
+        return addr
+
+    def clear(self):
+        """Forget every answer
+
+        :Returns: None
+        """
+        with self._lock:
+            self._answers.clear()
+
+
+DNS = DnsCache(ttl=const.VLAB_GATEWAY_DNS_TTL, stale=const.VLAB_GATEWAY_DNS_STALE)
+
+_LOCK = threading.Lock()
+# (key, context) - The key is the IP, and how the profile file was last seen
+_CURRENT = [None, None]
+
+
+def get(vlab_ip):
+    """Obtain the context for configuring gateways, building it only if it changed
+
+    :Returns: Context
+
+    :Raises: ValueError if the profile is invalid, or the steps cannot be run
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+    """
+    key = (vlab_ip, _profile_stamp())
+    with _LOCK:
+        if _CURRENT[0] == key:
+            return _CURRENT[1]
+    # Outside the lock; two threads building the same context is harmless
+    context = build(vlab_ip)
+    with _LOCK:
+        _CURRENT[:] = [key, context]
+    return context
+
+
+def build(vlab_ip):
+    """Load the profile, and render the commands that are the same for every user
+
+    :Returns: Context
+
+    :Raises: ValueError if the profile is invalid, or the steps cannot be run
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+    """
+    the_profile = profile.load(vlab_ip)
+    steps = tuple(provision.common_steps(vlab_ip, settings=the_profile.settings))
+    # Raises now, instead of in the middle of configuring a user's gateway
+    provision.plan(provision.user_steps('validate') + list(steps))
+    return Context(vlab_ip, the_profile, steps)
+
+
+def reset():
+    """Forget the context, and every DNS answer
+
+    :Returns: None
+    """
+    DNS.clear()
+    with _LOCK:
+        _CURRENT[:] = [None, None]
+
+
+def _profile_stamp():
+    """Describe the version of the profile file, so a new one is noticed
+
+    :Returns: Tuple, or None when there's no profile file
+    """
+    if not const.VLAB_GATEWAY_PROFILE:
+        return None
+    info = os.stat(const.VLAB_GATEWAY_PROFILE)
+    return (info.st_mtime_ns, info.st_size)
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""
+The catalog of OVAs in ``VLAB_GATEWAY_IMAGES_DIR`` that gateways can be
+deployed from.
+
+The version of an image is its file name without ``.ova``. Every OVA is opened
+(via ``mapped_ova.parse``, so it's only read once per worker) and checked for
+the WAN/LAN networks a gateway needs; an OVA that cannot be deployed stays in
+the catalog with an error, so the API can say why. Workers publish the catalog
+to the shared store, where the API checks the image of a create before it's
+queued.
+
+Checksums take a while for a multi-GB OVA, so they're computed in the
+background by one worker, and kept until the file is replaced.
+"""
+import os
+import hashlib
+import tarfile
+
+from vlab_gateway_api.lib import const, cache
+from vlab_gateway_api.lib.worker import mapped_ova
+
+
+EXTENSION = '.ova'
+CHUNK_SIZE = 1024 * 1024
+# The networks ``vmware._create_network_map`` knows how to map
+NETWORKS = ('wan', 'lan')
+
+
+def scan(previous=None):
+    """Find every OVA, and check that a gateway can be deployed from it
+
+    :Returns: List - A dictionary for every OVA, sorted by version
+
+    :param previous: The last catalog; checksums of unchanged OVAs are kept
+    :type previous: List
+    """
+    known = {x['image']: x for x in previous or []}
+    catalog = []
+    for name in sorted(os.listdir(const.VLAB_GATEWAY_IMAGES_DIR)):
+        if not name.endswith(EXTENSION):
+            continue
+        ova_path = os.path.join(const.VLAB_GATEWAY_IMAGES_DIR, name)
+        info = os.stat(ova_path)
+        entry = {'image': name,
+                 'version': name[:-len(EXTENSION)],
+                 'size': info.st_size,
+                 'modified': info.st_mtime,
+                 'networks': [],
+                 'sha256': None,
+                 'error': None}
+        old = known.get(name, {})
+        if old.get('size') == entry['size'] and old.get('modified') == entry['modified']:
+            entry['sha256'] = old.get('sha256')
+        try:
+            entry['networks'] = mapped_ova.parse(ova_path).networks
+        except (tarfile.TarError, ValueError, OSError) as doh:
+            entry['error'] = 'Unable to read OVA: {}'.format(doh)
+        else:
+            unexpected = [x for x in entry['networks'] if x.lower() not in NETWORKS]
+            if unexpected or not entry['networks']:
+                entry['error'] = 'Unexpected networks defined in OVA: {}'.format(entry['networks'])
+        catalog.append(entry)
+    return catalog
+
+
+def checksum(ova_path):
+    """Compute the SHA-256 of a file
+
+    :Returns: String
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+    """
+    digest = hashlib.sha256()
+    with open(ova_path, 'rb') as the_file:
+        for chunk in iter(lambda: the_file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def refresh(logger, checksums=False):
+    """Scan the OVAs, and publish the catalog
+
+    :Returns: List - The catalog
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param checksums: Set to True to also checksum every OVA that's missing one,
+                      publishing the catalog again after each one
+    :type checksums: Boolean
+    """
+    catalog = scan(cache.get_images())
+    cache.set_images(catalog)
+    logger.info('Found {} gateway image(s)'.format(len(catalog)))
+    if checksums:
+        for entry in catalog:
+            if entry['sha256'] is not None or entry['error'] is not None:
+                continue
+            ova_path = os.path.join(const.VLAB_GATEWAY_IMAGES_DIR, entry['image'])
+            try:
+                entry['sha256'] = checksum(ova_path)
+            except OSError as doh:
+                logger.error('Unable to checksum {}: {}'.format(entry['image'], doh))
+                continue
+            cache.set_images(catalog)
+    return catalog
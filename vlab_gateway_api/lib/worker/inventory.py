@@ -0,0 +1,436 @@
+# -*- coding: UTF-8 -*-
+"""
+In-memory indexes of vCenter objects, kept current by a PropertyCollector.
+
+Walking ``folder.childEntity`` costs a SOAP call per child just to read its
+name, and ``vCenter.networks`` enumerates every portgroup in the datacenter.
+An index is loaded with a single PropertyCollector request, and every lookup
+after that only asks vCenter for what changed since the last one via
+``WaitForUpdatesEx``; so a lookup is one round trip no matter how many objects
+there are.
+
+A PropertyCollector belongs to the session that created it, so there is one
+set of indexes per pooled vCenter session; pooled sessions live as long as the
+worker process.
+"""
+import weakref
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_gateway_api.lib import const, cache
+
+
+VM_PROPERTIES = ['name', 'parent', 'config.annotation']
+FOLDER_PROPERTIES = ['name', 'parent']
+NETWORK_PROPERTIES = ['name']
+# Errors that mean the collector is gone (or confused), and the index must be rebuilt
+INDEX_ERRORS = (vmodl.fault.ManagedObjectNotFound, vmodl.query.InvalidCollectorVersion)
+
+_INDEXES = weakref.WeakKeyDictionary()
+
+
+def get(vcenter):
+    """Obtain the up to date index of VMs and folders for a vCenter session
+
+    :Returns: Inventory
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    return _get(vcenter, Inventory)
+
+
+def get_networks(vcenter):
+    """Obtain the up to date index of networks for a vCenter session.
+
+    Also primes the ``vCenter.networks`` cache, so code in vlab_inf_common that
+    reads ``vCenter.networks`` doesn't enumerate every network either.
+
+    :Returns: NetworkIndex
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    index = _get(vcenter, NetworkIndex)
+    vcenter._net_cache = index.networks
+    return index
+
+
+def _get(vcenter, kind):
+    """Obtain, and update, one kind of index for a vCenter session
+
+    :Returns: _Index
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param kind: The kind of index
+    :type kind: Class
+    """
+    indexes = _INDEXES.setdefault(vcenter, {})
+    index = indexes.get(kind)
+    if index is None:
+        index = kind(vcenter)
+        indexes[kind] = index
+    try:
+        index.update()
+    except INDEX_ERRORS:
+        index = kind(vcenter)
+        indexes[kind] = index
+        index.update()
+    return index
+
+
+class _Index(object):
+    """Mirrors some properties of some vCenter objects, via a PropertyCollector.
+
+    Not thread-safe; like the session it uses, only one task at a time should
+    have it. Subclasses define what to watch in ``_filter_spec``.
+
+    :param vcenter: **Required** The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    def __init__(self, vcenter):
+        # A strong reference would keep the session alive in _INDEXES forever
+        self._vcenter = weakref.ref(vcenter)
+        self._collector = None
+        self.version = ''
+        # moId -> {'obj': ManagedObject, property name -> value}
+        self._objects = {}
+
+    def update(self):
+        """Apply every change made in vCenter since the last update
+
+        :Returns: Boolean - True if anything changed
+        """
+        if self._collector is None:
+            self._collector = self._create_collector()
+        # maxWaitSeconds=0 returns right away, even if nothing changed
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        changed = False
+        while True:
+            result = self._collector.WaitForUpdatesEx(self.version, options)
+            if result is None:
+                break
+            changed = True
+            self.version = result.version
+            for filter_set in result.filterSet:
+                for change in filter_set.objectSet:
+                    self._apply(change)
+            if not result.truncated:
+                break
+        if changed:
+            self._changed()
+        return changed
+
+    def _changed(self):
+        """Called after an update changes the index
+
+        :Returns: None
+        """
+        pass
+
+    def _apply(self, change):
+        """Update the index with a change to one object
+
+        :Returns: None
+
+        :param change: The change from the PropertyCollector
+        :type change: vmodl.query.PropertyCollector.ObjectUpdate
+        """
+        moid = change.obj._moId
+        if change.kind == 'leave':
+            self._objects.pop(moid, None)
+            return
+        item = self._objects.setdefault(moid, {'obj': change.obj})
+        for prop in change.changeSet:
+            if prop.op == 'remove':
+                item.pop(prop.name, None)
+            else:
+                item[prop.name] = prop.val
+
+    def _filter_spec(self, vcenter):
+        """Define what objects and properties to watch
+
+        :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+        :param vcenter: The instantiated connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        raise NotImplementedError
+
+    def _create_collector(self):
+        """Make a PropertyCollector for the objects defined by ``_filter_spec``.
+
+        A dedicated collector, so the filter doesn't collide with anything else
+        using the session's default collector.
+
+        :Returns: vmodl.query.PropertyCollector
+        """
+        vcenter = self._vcenter()
+        collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+        collector.CreateFilter(self._filter_spec(vcenter), partialUpdates=False)
+        return collector
+
+
+def _view_spec(vcenter, container, prop_specs):
+    """Define a filter for every object of some types within a folder
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param container: The folder to look in
+    :type container: vim.Folder
+
+    :param prop_specs: The types of objects, and which properties to watch
+    :type prop_specs: List of vmodl.query.PropertyCollector.PropertySpec
+    """
+    view = vcenter.content.viewManager.CreateContainerView(container=container,
+                                                           type=[x.type for x in prop_specs],
+                                                           recursive=True)
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView',
+                                                            type=vim.view.ContainerView,
+                                                            path='view',
+                                                            skip=False)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+
+class Inventory(_Index):
+    """The names, parents, and annotations of VMs and folders under
+    ``INF_VCENTER_TOP_LVL_DIR``.
+
+    Folders by name, and the children of every folder, are kept up to date as
+    changes are applied, so a lookup only touches the VMs in one folder.
+
+    :param vcenter: **Required** The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    def __init__(self, vcenter):
+        super(Inventory, self).__init__(vcenter)
+        # folder name -> set of moIds
+        self._folders = {}
+        # parent moId -> set of child moIds
+        self._children = {}
+
+    def folder(self, name):
+        """Find a folder by name
+
+        :Returns: vim.Folder
+
+        :Raises: ValueError if there's no such folder
+
+        :param name: The name of the folder
+        :type name: String
+        """
+        for moid in self._folders.get(name, ()):
+            return self._objects[moid]['obj']
+        raise ValueError('Unable to locate object named {}'.format(name))
+
+    def find_vm(self, folder_name, vm_name):
+        """Find a VM by name, within a specific folder
+
+        :Returns: vim.VirtualMachine, or None if there's no such VM
+
+        :Raises: ValueError if there's no such folder
+
+        :param folder_name: The name of the folder the VM is in
+        :type folder_name: String
+
+        :param vm_name: The name of the VM
+        :type vm_name: String
+        """
+        found = self.find_vms(folder_name, vm_name)
+        if found:
+            return found[0]
+        return None
+
+    def find_vms(self, folder_name, vm_name):
+        """Find every VM with a name, within a specific folder
+
+        :Returns: List of vim.VirtualMachine
+
+        :Raises: ValueError if there's no such folder
+
+        :param folder_name: The name of the folder the VMs are in
+        :type folder_name: String
+
+        :param vm_name: The name of the VMs
+        :type vm_name: String
+        """
+        return [x for x in self.vms(folder_name) if self._objects[x._moId].get('name') == vm_name]
+
+    def vms(self, folder_name):
+        """Obtain every VM within a folder
+
+        :Returns: List of vim.VirtualMachine
+
+        :Raises: ValueError if there's no such folder
+
+        :param folder_name: The name of the folder the VMs are in
+        :type folder_name: String
+        """
+        folder_id = self.folder(folder_name)._moId
+        vms = []
+        for moid in self._children.get(folder_id, ()):
+            obj = self._objects[moid]['obj']
+            if isinstance(obj, vim.VirtualMachine):
+                vms.append(obj)
+        return vms
+
+    def owned_vms(self, vm_name):
+        """Find every VM with a name, in any folder, along with the name of its folder
+
+        :Returns: Generator - (folder name, vim.VirtualMachine)
+
+        :param vm_name: The name of the VMs
+        :type vm_name: String
+        """
+        for item in self._objects.values():
+            parent = item.get('parent')
+            if isinstance(item['obj'], vim.VirtualMachine) and parent is not None and item.get('name') == vm_name:
+                folder_name = self._objects.get(parent._moId, {}).get('name')
+                if folder_name is not None:
+                    yield folder_name, item['obj']
+
+    def meta(self, the_vm):
+        """Obtain the component meta data of a VM, without asking vCenter
+
+        :Returns: Dictionary - Empty if the VM has no meta data
+
+        :param the_vm: The VM
+        :type the_vm: vim.VirtualMachine
+        """
+        annotation = self._objects.get(the_vm._moId, {}).get('config.annotation')
+        try:
+            return ujson.loads(annotation)
+        except (ValueError, TypeError):
+            return {}
+
+    def _apply(self, change):
+        """Update the index, and the folder and children maps, with a change to one object
+
+        :Returns: None
+
+        :param change: The change from the PropertyCollector
+        :type change: vmodl.query.PropertyCollector.ObjectUpdate
+        """
+        moid = change.obj._moId
+        self._unlink(moid)
+        super(Inventory, self)._apply(change)
+        self._link(moid)
+
+    def _link(self, moid):
+        """Add an object to the folder and children maps
+
+        :Returns: None
+
+        :param moid: The id of the object
+        :type moid: String
+        """
+        item = self._objects.get(moid)
+        if item is None:
+            return
+        if isinstance(item['obj'], vim.Folder) and item.get('name') is not None:
+            self._folders.setdefault(item['name'], set()).add(moid)
+        if item.get('parent') is not None:
+            self._children.setdefault(item['parent']._moId, set()).add(moid)
+
+    def _unlink(self, moid):
+        """Remove an object from the folder and children maps, before it changes
+
+        :Returns: None
+
+        :param moid: The id of the object
+        :type moid: String
+        """
+        item = self._objects.get(moid)
+        if item is None:
+            return
+        if isinstance(item['obj'], vim.Folder) and item.get('name') is not None:
+            _discard(self._folders, item['name'], moid)
+        if item.get('parent') is not None:
+            _discard(self._children, item['parent']._moId, moid)
+
+    def _filter_spec(self, vcenter):
+        """Watch every VM and folder under ``INF_VCENTER_TOP_LVL_DIR``
+
+        :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+        :param vcenter: The instantiated connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        top_dir = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=VM_PROPERTIES),
+                      vmodl.query.PropertyCollector.PropertySpec(type=vim.Folder, pathSet=FOLDER_PROPERTIES)]
+        return _view_spec(vcenter, top_dir, prop_specs)
+
+
+def _discard(mapping, key, moid):
+    """Remove a moId from a set in a mapping, and the set once it's empty
+
+    :Returns: None
+
+    :param mapping: Maps a key to a set of moIds
+    :type mapping: Dictionary
+
+    :param key: Which set to remove the moId from
+    :type key: String
+
+    :param moid: The id of the object
+    :type moid: String
+    """
+    found = mapping.get(key)
+    if found is None:
+        return
+    found.discard(moid)
+    if not found:
+        del mapping[key]
+
+
+class NetworkIndex(_Index):
+    """Every network in vCenter, by name.
+
+    Every time a network is added, removed, or renamed, the names are published
+    to the shared store so the API can check them without asking a worker.
+
+    :param vcenter: **Required** The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    def __init__(self, vcenter):
+        super(NetworkIndex, self).__init__(vcenter)
+        self.networks = {}
+
+    def exists(self, name):
+        """Determine if there's a network with the supplied name
+
+        :Returns: Boolean
+
+        :param name: The name of the network
+        :type name: String
+        """
+        return name in self.networks
+
+    def _changed(self):
+        """Rebuild the mapping of names to networks, and publish the names
+
+        :Returns: None
+        """
+        # A new dict, not an update, so nobody sees it half built
+        self.networks = {x['name']: x['obj'] for x in self._objects.values() if 'name' in x}
+        cache.set_network_names(self.networks.keys())
+
+    def _filter_spec(self, vcenter):
+        """Watch every network in vCenter
+
+        :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+        :param vcenter: The instantiated connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=vim.Network, pathSet=NETWORK_PROPERTIES)]
+        return _view_spec(vcenter, vcenter.content.rootFolder, prop_specs)
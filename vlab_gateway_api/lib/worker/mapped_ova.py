@@ -0,0 +1,205 @@
+# -*- coding: UTF-8 -*-
+"""
+An OVA that's parsed once per worker, and uploaded from a memory map.
+
+``vlab_inf_common.vmware.Ova`` opens the tarball and reads the OVF descriptor
+every time it's created, just so ``_create_network_map`` can look at the
+network names. The descriptor, network names, and where every VMDK is within
+the tarball only change when the file does, so they're cached by path, modified
+time, and size.
+
+While deploying, the VMDKs are sent straight out of a read-only memory map of
+the OVA, in slices of ``CHUNK_SIZE``; there are no buffered reads copying the
+disk into the worker, and every create (in every worker) shares the same pages
+of the page cache.
+"""
+import os
+import re
+import mmap
+import tarfile
+import threading
+from collections import namedtuple, OrderedDict
+
+from vlab_inf_common.vmware import Ova
+
+
+# Plenty for every version of every image a worker deploys
+MAX_CACHED = 8
+CHUNK_SIZE = 1024 * 1024
+
+# disks - The offset and size of every VMDK within the tarball, by name
+Parsed = namedtuple('Parsed', ['ovf', 'networks', 'disks'])
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def parse(ova_path):
+    """Obtain the OVF descriptor, network names, and VMDK locations of an OVA
+
+    :Returns: Parsed
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+    """
+    info = os.stat(ova_path)
+    key = (ova_path, info.st_mtime_ns, info.st_size)
+    with _CACHE_LOCK:
+        parsed = _CACHE.get(key)
+        if parsed is not None:
+            _CACHE.move_to_end(key)
+            return parsed
+    # Outside the lock; two threads parsing the same OVA at once is harmless
+    parsed = _parse(ova_path)
+    with _CACHE_LOCK:
+        for stale in [x for x in _CACHE if x[0] == ova_path]:
+            # The file was replaced
+            del _CACHE[stale]
+        _CACHE[key] = parsed
+        while len(_CACHE) > MAX_CACHED:
+            _CACHE.popitem(last=False)
+    return parsed
+
+
+def _parse(ova_path):
+    """Read the OVF descriptor, and find every VMDK, within an OVA
+
+    :Returns: Parsed
+
+    :Raises: ValueError if a VMDK cannot be read straight out of the file
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+    """
+    ovf = None
+    disks = OrderedDict()
+    with tarfile.open(ova_path) as the_tar:
+        for member in the_tar.getmembers():
+            if member.name.endswith('.vmdk'):
+                if not member.isreg() or member.issparse():
+                    raise ValueError('Unable to map {} within {}'.format(member.name, ova_path))
+                disks[member.name] = (member.offset_data, member.size)
+            elif member.name.endswith('.ovf'):
+                ovf = the_tar.extractfile(member).read().decode()
+    # Same as Ova.networks
+    found = re.findall(r'Network ovf:name=[\w\ \"]{1,50}', ovf or '')
+    networks = [x.split('=')[1].replace('"', '') for x in found]
+    return Parsed(ovf, networks, disks)
+
+
+class MappedOva(Ova):
+    """A drop-in replacement for ``vlab_inf_common.vmware.Ova``, for an OVA
+    on the local file system.
+
+    :param ovafile: **Required** The file path of an OVA file
+    :type ovafile: String
+    """
+    def __init__(self, ovafile):
+        self._spec = None
+        self._lease = None
+        self._host = None
+        self._prog = None
+        self._tar = None
+        parsed = parse(ovafile)
+        self._ovf = parsed.ovf
+        self._networks = parsed.networks
+        self._handle = MappedFile(ovafile)
+        self._disks = OrderedDict((name, MappedDisk(self._handle, offset, size))
+                                  for name, (offset, size) in parsed.disks.items())
+
+    @property
+    def networks(self):
+        """Return a list of network names that a VM has configured"""
+        return list(self._networks)
+
+
+class MappedFile(object):
+    """A read-only memory map of a file, that's only created once it's read.
+
+    Tracks how far into the file the upload is, like ``FileHandle`` of
+    ``vlab_inf_common``, so the deploy lease reports progress.
+
+    :param filename: **Required** The file to map
+    :type filename: String
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.st_size = os.stat(filename).st_size
+        self.offset = 0
+        self._mmap = None
+        self._view = None
+
+    def view(self):
+        """Obtain the whole file, without reading it
+
+        :Returns: memoryview
+        """
+        if self._view is None:
+            with open(self.filename, 'rb') as the_file:
+                self._mmap = mmap.mmap(the_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._mmap, 'madvise'):
+                # Let the kernel read ahead, and drop the pages once they're sent
+                self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+            self._view = memoryview(self._mmap)
+        return self._view
+
+    def progress(self):
+        """How much of the file has been uploaded, as a percentage
+
+        :Returns: Integer
+        """
+        if not self.st_size:
+            return 100
+        return min(int(100.0 * self.offset / self.st_size), 100)
+
+    def close(self):
+        """Unmap the file
+
+        :Returns: None
+        """
+        if self._view is not None:
+            self._view.release()
+            self._mmap.close()
+            self._view = None
+            self._mmap = None
+
+
+class MappedDisk(object):
+    """A VMDK within a mapped OVA.
+
+    Iterating yields slices of the memory map, which ``http.client`` sends as-is.
+
+    :param mapped: **Required** The mapped OVA
+    :type mapped: MappedFile
+
+    :param offset: **Required** Where the VMDK starts within the OVA
+    :type offset: Integer
+
+    :param size: **Required** How many bytes the VMDK is
+    :type size: Integer
+    """
+    def __init__(self, mapped, offset, size):
+        self._mapped = mapped
+        self._offset = offset
+        self.size = size
+
+    def seek(self, offset, whence=0):
+        """Every upload starts from the beginning; here so ``Ova._reset`` works
+
+        :Returns: Integer
+        """
+        return 0
+
+    def __iter__(self):
+        view = self._mapped.view()
+        sent = 0
+        while sent < self.size:
+            length = min(CHUNK_SIZE, self.size - sent)
+            chunk = view[self._offset + sent:self._offset + sent + length]
+            try:
+                yield chunk
+            finally:
+                # Otherwise the map cannot be closed
+                chunk.release()
+            sent += length
+            self._mapped.offset = self._offset + sent
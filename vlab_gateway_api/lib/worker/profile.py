@@ -0,0 +1,217 @@
+# -*- coding: UTF-8 -*-
+"""
+The settings of a gateway, as a declarative, versioned profile.
+
+A profile maps setting names to values, like ``{"ntp": "10.1.1.1"}``. Every
+setting knows which file it lives in and what its line looks like, so a
+running gateway can be moved from one profile to another by editing only the
+lines of the settings that changed; no new gateway needed.
+
+The settings a gateway has are recorded in its VM annotation. Secrets are
+recorded as a fingerprint, because anyone who can see the VM in vCenter can
+read the annotation.
+
+The profile comes from the environment (like ``VLAB_IPAM_BROKER``), and the
+JSON file at ``VLAB_GATEWAY_PROFILE`` (if set) overrides any of it::
+
+    {"version": "1.1.0", "settings": {"ntp": "10.1.1.5"}}
+"""
+import re
+import hashlib
+from collections import namedtuple, OrderedDict
+
+import ujson
+
+from vlab_gateway_api.lib import const
+
+
+DEFAULT_VERSION = '1.0.0'
+
+Profile = namedtuple('Profile', ['version', 'settings'])
+
+# template - The line in the file, where {} is the value
+# original - The text the OVA ships with, replaced the first time the setting is applied
+# secret - Only record a fingerprint of the value
+# restart - The systemd unit that reads the setting, or None if it takes a reboot
+Setting = namedtuple('Setting', ['path', 'template', 'original', 'secret', 'restart', 'error'])
+
+SETTINGS = OrderedDict([
+    ('log_target', Setting('/etc/environment', 'VLAB_LOG_TARGET={}', 'VLAB_LOG_TARGET=localhost:9092',
+                           False, None, 'Failed to set IPAM log-sender address')),
+    ('log_key', Setting('/etc/vlab/log_sender.key', '{}', 'changeME',
+                        True, None, 'Failed to set IPAM encryption key')),
+    ('vlab_url', Setting('/etc/environment', 'VLAB_URL={}', 'VLAB_URL=https://localhost',
+                         False, None, 'Failed to set VLAB_URL environment variable')),
+    ('production', Setting('/etc/environment', 'PRODUCTION={}', 'PRODUCTION=false',
+                           False, None, 'Failed to set PRODUCTION environment variable')),
+    ('ntp', Setting('/etc/chrony/chrony.conf', '{}', '1.us.pool.ntp.org',
+                    False, 'chrony', 'Failed to set NTP server')),
+    ('ddns', Setting('/etc/environment', 'VLAB_DDNS_KEY={}', 'VLAB_DDNS_KEY=aabbcc',
+                     True, None, 'Failed to configure DDNS settings')),
+    ('dns_forwarder', Setting('/etc/bind/named.conf', '{}', '8.8.8.8',
+                              False, 'bind9', 'Failed to configure DNS forwarder')),
+    ('salt_master', Setting('/etc/salt/minion', 'master: {}', '#master: salt',
+                            False, 'salt-minion', 'Failed to configure Config Mgmt Software')),
+])
+
+
+def baseline(vlab_ip):
+    """Obtain the settings from the environment of the worker; what every
+    gateway was configured with before profiles were recorded.
+
+    :Returns: collections.OrderedDict
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+    """
+    return OrderedDict([('log_target', const.VLAB_IPAM_BROKER),
+                        ('log_key', const.VLAB_IPAM_KEY),
+                        ('vlab_url', const.VLAB_URL),
+                        ('production', 'beta'),
+                        ('ntp', vlab_ip),
+                        ('ddns', const.VLAB_DDNS_KEY),
+                        ('dns_forwarder', vlab_ip),
+                        ('salt_master', vlab_ip)])
+
+
+def recorded_or_baseline(recorded, vlab_ip):
+    """Obtain the settings a gateway has, even if it never recorded them
+
+    :Returns: Dictionary - As recorded in the VM annotation
+
+    :param recorded: The settings recorded in the VM annotation, or None when
+                     the gateway was configured before profiles were recorded
+    :type recorded: Dictionary
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+    """
+    if recorded is None:
+        # Every setting was already changed from the text the OVA ships with
+        return record(baseline(vlab_ip))
+    return recorded
+
+
+def load(vlab_ip):
+    """Obtain the profile every gateway should have
+
+    :Returns: Profile
+
+    :Raises: ValueError if the profile file is invalid
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+    """
+    settings = baseline(vlab_ip)
+    version = DEFAULT_VERSION
+    if const.VLAB_GATEWAY_PROFILE:
+        with open(const.VLAB_GATEWAY_PROFILE) as the_file:
+            try:
+                custom = ujson.load(the_file)
+            except ValueError as doh:
+                raise ValueError('Invalid gateway profile {}: {}'.format(const.VLAB_GATEWAY_PROFILE, doh))
+        unknown = set(custom.get('settings', {})) - set(SETTINGS)
+        if unknown:
+            raise ValueError('Unknown gateway setting(s): {}'.format(', '.join(sorted(unknown))))
+        for name, value in custom.get('settings', {}).items():
+            settings[name] = '{}'.format(value)
+        version = custom.get('version', version)
+    return Profile(version, settings)
+
+
+def record(settings):
+    """Describe settings the way they're recorded in the VM annotation
+
+    :Returns: Dictionary
+
+    :param settings: Setting names, and their values
+    :type settings: Dictionary
+    """
+    recorded = {}
+    for name, value in settings.items():
+        if SETTINGS[name].secret:
+            recorded[name] = 'sha256:{}'.format(hashlib.sha256(value.encode()).hexdigest())
+        else:
+            recorded[name] = value
+    return recorded
+
+
+def diff(recorded, settings):
+    """Find the settings that a gateway doesn't have yet
+
+    :Returns: collections.OrderedDict - The setting names, and their new values
+
+    :param recorded: The settings recorded in the VM annotation
+    :type recorded: Dictionary
+
+    :param settings: The settings the gateway should have
+    :type settings: Dictionary
+    """
+    wanted = record(settings)
+    return OrderedDict((x, settings[x]) for x in settings if recorded.get(x) != wanted[x])
+
+
+def needs_reboot(names):
+    """Determine if changing some settings takes a reboot, instead of restarting services
+
+    :Returns: Boolean
+
+    :param names: The names of the changed settings
+    :type names: Iterable
+    """
+    return any(SETTINGS[x].restart is None for x in names)
+
+
+def pattern(name, recorded, sed=True):
+    """Create a (basic) regex that matches the current line of a setting
+
+    :Returns: String
+
+    :param name: The name of the setting
+    :type name: String
+
+    :param recorded: The settings recorded in the VM annotation; an empty
+                     dictionary for a gateway that's fresh from the OVA
+    :type recorded: Dictionary
+
+    :param sed: Set to False for a regex for grep, where ``/`` isn't special
+    :type sed: Boolean
+    """
+    setting = SETTINGS[name]
+    if name not in recorded:
+        return _escape_regex(setting.original, sed)
+    if setting.secret:
+        # The old value is unknown; match the whole line instead
+        before, after = setting.template.split('{}')
+        return '^{}.*{}$'.format(_escape_regex(before, sed), _escape_regex(after, sed))
+    return _escape_regex(setting.template.format(recorded[name]), sed)
+
+
+def replacement(name, value):
+    """Create the sed replacement that sets a setting to a value
+
+    :Returns: String
+
+    :param name: The name of the setting
+    :type name: String
+
+    :param value: The new value
+    :type value: String
+    """
+    return re.sub(r'([\\/&])', r'\\\1', SETTINGS[name].template.format(value))
+
+
+def _escape_regex(text, sed=True):
+    """Make literal text safe to use in a sed (or grep) basic regex
+
+    :Returns: String
+
+    :param text: The text to match
+    :type text: String
+
+    :param sed: Set to False to leave ``/`` alone, for grep
+    :type sed: Boolean
+    """
+    if sed:
+        return re.sub(r'([\\/.*\[\]^$])', r'\\\1', text)
+    return re.sub(r'([\\.*\[\]^$])', r'\\\1', text)
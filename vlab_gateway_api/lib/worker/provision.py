@@ -0,0 +1,345 @@
+# -*- coding: UTF-8 -*-
+"""
+Configure a new gateway by running one script in the guest, instead of one
+guest-operations round trip through vCenter for every setting.
+
+Steps declare which other steps they must run after, and the script runs the
+steps that don't depend on each other at the same time.
+"""
+import time
+from collections import namedtuple, OrderedDict
+
+import requests
+from vlab_inf_common.vmware import vim, virtual_machine
+
+from vlab_gateway_api.lib import const, metrics
+from vlab_gateway_api.lib.worker import profile, readiness
+
+
+SCRIPT_PATH = '/tmp/vlab-gateway-setup.sh'
+RESULTS_PATH = '/tmp/vlab-gateway-setup.results'
+SCRIPT_HEADER = """\
+#!/bin/bash
+# Generated by vlab-gateway-api; every step records its exit code, and how many
+# milliseconds it took, in the results file
+RESULTS={}
+: > "$RESULTS"
+record () {{
+    echo "$1 $2 $(( $(date +%s%3N) - $3 ))" >> "$RESULTS"
+}}
+""".format(RESULTS_PATH)
+# The script has secrets in it; don't leave it laying around
+SCRIPT_FOOTER = """\
+rm -f "$0"
+exit $(awk '$2 != 0' "$RESULTS" | wc -l)
+"""
+# The most steps the script runs at once
+MAX_PARALLEL = 4
+
+# A step runs once every step named in ``after`` is done
+# secret - The command has a secret in it, so it's never logged
+Step = namedtuple('Step', ['name', 'command', 'error', 'after', 'secret'], defaults=((), False))
+
+
+def user_steps(username):
+    """Define the commands that make a gateway specific to one user
+
+    :Returns: List
+
+    :param username: The user who owns the gateway
+    :type username: String
+    """
+    steps = [
+        Step('hostname',
+             '/usr/bin/hostnamectl set-hostname {}'.format(username),
+             'Failed to set hostname to {}'.format(username)),
+        # Updating hostname fixes SPAM when SSH into box about "failure to resolve <host>"
+        Step('hosts',
+             "/bin/sed -i -e 's/ipam/{}/g' /etc/hosts".format(username),
+             'Failed to fix hostname SPAM'),
+        # *MUST* happen after setting up the hostname otherwise the salt-minion will
+        # use the default hostname when registering with the salt-master
+        Step('salt_enable',
+             '/bin/systemctl enable salt-minion.service',
+             'Failed to enable Config Mgmt Software',
+             after=('hostname',)),
+    ]
+    return steps
+
+
+def common_steps(vlab_ip, settings=None):
+    """Define the commands that are the same for every user's gateway
+
+    :Returns: List
+
+    :param vlab_ip: The IP of the vLab server
+    :type vlab_ip: String
+
+    :param settings: The settings of the profile, if it's already loaded
+    :type settings: Dictionary
+    """
+    if settings is None:
+        settings = profile.load(vlab_ip).settings
+    steps = setting_steps(settings, recorded={})
+    steps.append(Step('kern_log',
+                      "/bin/sed -i -e 's/$ActionFileDefaultTemplate RSYSLOG_TraditionalFileFormat/#$ActionFileDefaultTemplate RSYSLOG_TraditionalFileFormat/g' /etc/rsyslog.conf",
+                      'Failed to set kern.log timestamp format'))
+    return steps
+
+
+def setting_steps(settings, recorded, restart=False):
+    """Define the commands that change some settings of a gateway
+
+    :Returns: List
+
+    :param settings: The names of the settings to change, and their new values
+    :type settings: Dictionary
+
+    :param recorded: The settings recorded in the VM annotation; an empty
+                     dictionary for a gateway that's fresh from the OVA
+    :type recorded: Dictionary
+
+    :param restart: Set to True to restart the services that read the settings
+    :type restart: Boolean
+    """
+    steps = []
+    # Every ``sed -i`` replaces the file, so two edits of the same file at
+    # the same time would lose one of them
+    last_edit = {}
+    for name, value in settings.items():
+        setting = profile.SETTINGS[name]
+        expression = 's/{}/{}/g'.format(profile.pattern(name, recorded), profile.replacement(name, value))
+        # sed exits 0 even when nothing matched; the grep makes a setting
+        # that isn't where it's expected a failed step
+        command = "/bin/grep -q -e {} {} && /bin/sed -i -e {} {}".format(_quote(profile.pattern(name, recorded, sed=False)),
+                                                                         setting.path,
+                                                                         _quote(expression),
+                                                                         setting.path)
+        after = (last_edit[setting.path],) if setting.path in last_edit else ()
+        steps.append(Step(name, command, setting.error, after=after, secret=setting.secret))
+        last_edit[setting.path] = name
+    if restart:
+        units = OrderedDict()
+        for name in settings:
+            unit = profile.SETTINGS[name].restart
+            if unit is not None:
+                units.setdefault(unit, []).append(name)
+        for unit, names in units.items():
+            steps.append(Step('restart_{}'.format(unit),
+                              '/bin/systemctl restart {}'.format(unit),
+                              'Failed to restart {}'.format(unit),
+                              after=tuple(names)))
+    return steps
+
+
+def _quote(text):
+    """Single quote text for the shell; a quote in the text ends the quoting,
+    adds an escaped quote, and starts quoting again
+
+    :Returns: String
+
+    :param text: The text to quote
+    :type text: String
+    """
+    return "'{}'".format(text.replace("'", "'\\''"))
+
+
+def plan(steps):
+    """Group the steps into batches that can run at the same time; a batch only
+    starts once every step in the prior batches is done.
+
+    :Returns: List of Lists
+
+    :Raises: ValueError if a step depends on an unknown step, or the dependencies are circular
+
+    :param steps: The configuration steps to run
+    :type steps: List
+    """
+    names = {x.name for x in steps}
+    for step in steps:
+        unknown = set(step.after) - names
+        if unknown:
+            error = 'Step {} depends on unknown step(s): {}'.format(step.name, ', '.join(sorted(unknown)))
+            raise ValueError(error)
+    batches = []
+    done = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [x for x in remaining if done.issuperset(x.after)]
+        if not ready:
+            error = 'Circular dependency between steps: {}'.format(', '.join(x.name for x in remaining))
+            raise ValueError(error)
+        for idx in range(0, len(ready), MAX_PARALLEL):
+            batches.append(ready[idx:idx + MAX_PARALLEL])
+        done.update(x.name for x in ready)
+        remaining = [x for x in remaining if x.name not in done]
+    return batches
+
+
+def render_script(steps):
+    """Create a shell script that runs every step, and records each exit code
+    and duration
+
+    :Returns: String
+
+    :param steps: The configuration steps to run
+    :type steps: List
+    """
+    lines = [SCRIPT_HEADER]
+    for batch in plan(steps):
+        for step in batch:
+            lines.append('( START=$(date +%s%3N); {}\nrecord {} $? $START ) &\n'.format(step.command, step.name))
+        lines.append('wait\n')
+    lines.append(SCRIPT_FOOTER)
+    return ''.join(lines)
+
+
+def run_steps(vcenter, the_vm, steps, logger):
+    """Upload the steps as one script, run it, and log every step that failed
+
+    :Returns: List - The name, exit code, and seconds taken of every step, in
+              the order supplied; the exit code and seconds are None for a
+              step that never ran
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param the_vm: The gateway to configure
+    :type the_vm: vim.VirtualMachine
+
+    :param steps: The configuration steps to run
+    :type steps: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    creds = vim.vm.guest.NamePasswordAuthentication(username=const.VLAB_IPAM_ADMIN,
+                                                     password=const.VLAB_IPAM_ADMIN_PW)
+    _upload(vcenter, the_vm, creds, SCRIPT_PATH, render_script(steps))
+    with metrics.timed('run_command', logger):
+        virtual_machine.run_command(vcenter,
+                                    the_vm,
+                                    '/usr/bin/sudo',
+                                    user=const.VLAB_IPAM_ADMIN,
+                                    password=const.VLAB_IPAM_ADMIN_PW,
+                                    arguments='/bin/bash {}'.format(SCRIPT_PATH))
+    # Even when every step worked, the results have how long each one took
+    results = _parse_results(_download(vcenter, the_vm, creds, RESULTS_PATH))
+    report = []
+    for step in steps:
+        exit_code, seconds = results.get(step.name, (None, None))
+        if exit_code is None:
+            logger.error('{} (step never ran)'.format(step.error))
+        elif exit_code:
+            logger.error(step.error)
+            logger.error('CMD: {}'.format('<redacted>' if step.secret else step.command))
+            logger.error('Exit code: {}'.format(exit_code))
+        if seconds is not None:
+            metrics.observe('step_{}'.format(step.name), seconds)
+        report.append({'name': step.name, 'exit_code': exit_code, 'seconds': seconds})
+    return report
+
+
+def _parse_results(results):
+    """Convert the results file into a mapping of step name to exit code and duration
+
+    :Returns: Dictionary - (exit code, seconds) keyed by step name
+
+    :param results: The contents of the results file the script wrote
+    :type results: String
+    """
+    parsed = {}
+    for line in results.splitlines():
+        try:
+            name, exit_code, millis = line.split()
+            parsed[name] = (int(exit_code), int(millis) / 1000)
+        except ValueError:
+            # The script was killed mid-write
+            continue
+    return parsed
+
+
+def _upload(vcenter, the_vm, creds, guest_path, content):
+    """Write a file into the guest via the Guest Operations file manager
+
+    :Returns: None
+
+    :Raises: ValueError if VMware Tools isn't ready within ``VLAB_GATEWAY_BOOT_TIMEOUT``, or the upload fails
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param the_vm: The VM to upload the file to
+    :type the_vm: vim.VirtualMachine
+
+    :param creds: The guest account to write the file as
+    :type creds: vim.vm.guest.NamePasswordAuthentication
+
+    :param guest_path: Where to write the file inside the guest
+    :type guest_path: String
+
+    :param content: What to write to the file
+    :type content: String
+    """
+    data = content.encode()
+    file_manager = vcenter.content.guestOperationsManager.fileManager
+    # The VM just booted, and VMware Tools can take some time to be ready; give
+    # it as long, and back off the same way, as waiting on the guest to boot
+    waited = 0
+    delay = readiness.POLL_START
+    while True:
+        try:
+            url = file_manager.InitiateFileTransferToGuest(vm=the_vm,
+                                                           auth=creds,
+                                                           guestFilePath=guest_path,
+                                                           fileAttributes=vim.vm.guest.FileManager.PosixFileAttributes(permissions=0o600),
+                                                           fileSize=len(data),
+                                                           overwrite=True)
+        except vim.fault.GuestOperationsUnavailable:
+            remaining = const.VLAB_GATEWAY_BOOT_TIMEOUT - waited
+            if remaining <= 0:
+                error = 'Unable to upload {} to VM. Timed out waiting on GuestOperations to become available.'.format(guest_path)
+                raise ValueError(error)
+            pause = min(delay, remaining)
+            time.sleep(pause)
+            waited += pause
+            delay = min(delay * 2, readiness.POLL_MAX)
+        else:
+            break
+    try:
+        resp = requests.put(url, data=data, verify=False)
+        resp.raise_for_status()
+    except requests.RequestException as doh:
+        raise ValueError('Unable to upload {} to VM: {}'.format(guest_path, doh))
+
+
+def _download(vcenter, the_vm, creds, guest_path):
+    """Read a file from the guest via the Guest Operations file manager
+
+    :Returns: String
+
+    :Raises: ValueError if the file cannot be read, like when it doesn't exist
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param the_vm: The VM to read the file from
+    :type the_vm: vim.VirtualMachine
+
+    :param creds: The guest account to read the file as
+    :type creds: vim.vm.guest.NamePasswordAuthentication
+
+    :param guest_path: The file to read inside the guest
+    :type guest_path: String
+    """
+    file_manager = vcenter.content.guestOperationsManager.fileManager
+    try:
+        info = file_manager.InitiateFileTransferFromGuest(vm=the_vm,
+                                                          auth=creds,
+                                                          guestFilePath=guest_path)
+        resp = requests.get(info.url, verify=False)
+        resp.raise_for_status()
+    except (vim.fault.VimFault, requests.RequestException) as doh:
+        # Like when the script was killed before it wrote anything
+        raise ValueError('Unable to download {} from VM: {}'.format(guest_path, doh))
+    return resp.text
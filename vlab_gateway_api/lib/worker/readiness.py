@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+"""
+Wait on a gateway to boot by watching VMware Tools, instead of sleeping for a
+fixed amount of time. Callers time the waits on the ``boot_wait`` and
+``reboot_wait`` stages of the stage histogram in ``metrics``.
+"""
+import time
+
+from vlab_gateway_api.lib import const
+
+
+POLL_START = 1  # seconds
+POLL_MAX = 5
+
+
+def wait_for_guest(the_vm, logger, phase='boot', deadline=const.VLAB_GATEWAY_BOOT_TIMEOUT):
+    """Block until the guest can run commands via VMware Tools
+
+    :Returns: Float - How many seconds it took the guest to become ready
+
+    :Raises: ValueError - when the deadline is exceeded
+
+    :param the_vm: The gateway being booted
+    :type the_vm: vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param phase: Either "boot" or "reboot", for the log message
+    :type phase: String
+
+    :param deadline: The most seconds to wait on the guest
+    :type deadline: Integer
+    """
+    boot_time = _poll(the_vm, deadline, want_ready=True)
+    if boot_time is None:
+        error = 'Gateway not ready within {} seconds'.format(deadline)
+        raise ValueError(error)
+    logger.info('Gateway ready after {:.1f} seconds ({})'.format(boot_time, phase))
+    return boot_time
+
+
+def wait_for_reboot(the_vm, logger, deadline=const.VLAB_GATEWAY_BOOT_TIMEOUT):
+    """Block until a guest that was told to reboot has gone down and come back up
+
+    :Returns: Float - How many seconds it took the guest to become ready again
+
+    :Raises: ValueError - when the guest does not come back before the deadline
+
+    :param the_vm: The gateway being rebooted
+    :type the_vm: vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param deadline: The most seconds to wait on the guest to come back up
+    :type deadline: Integer
+    """
+    if _poll(the_vm, const.VLAB_GATEWAY_SHUTDOWN_TIMEOUT, want_ready=False) is None:
+        # Either the reboot was missed between polls, or it never happened.
+        # Both ways, waiting on the guest to be ready is the right next step.
+        logger.info('Gateway did not go down within {} seconds'.format(const.VLAB_GATEWAY_SHUTDOWN_TIMEOUT))
+    return wait_for_guest(the_vm, logger, phase='reboot', deadline=deadline)
+
+
+def _poll(the_vm, deadline, want_ready):
+    """Poll the guest state, backing off exponentially between checks
+
+    :Returns: Float or None - How many seconds it took to reach the wanted state,
+              or None if the deadline was exceeded
+
+    :param the_vm: The VM to check on
+    :type the_vm: vim.VirtualMachine
+
+    :param deadline: The most seconds to wait
+    :type deadline: Integer
+
+    :param want_ready: Set to False to wait on the guest to stop being ready
+    :type want_ready: Boolean
+    """
+    started = time.time()
+    delay = POLL_START
+    while _guest_ready(the_vm) != want_ready:
+        remaining = deadline - (time.time() - started)
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, POLL_MAX)
+    return time.time() - started
+
+
+def _guest_ready(the_vm):
+    """Determine if VMware Tools is heartbeating and accepting guest operations
+
+    :Returns: Boolean
+
+    :param the_vm: The VM to check on
+    :type the_vm: vim.VirtualMachine
+    """
+    return bool(the_vm.guest.guestOperationsReady) and the_vm.guestHeartbeatStatus == 'green'
@@ -0,0 +1,168 @@
+# -*- coding: UTF-8 -*-
+"""
+Reuse authenticated vCenter sessions across Celery tasks.
+
+Logging into vCenter is a multi-step SOAP handshake, and for short tasks like
+``gateway.show`` it is most of the work. Each worker process keeps a small pool
+of logged in sessions, and hands them out to tasks one at a time. Every
+checkout is counted on the ``vlab_gateway_vcenter_sessions_total`` metric, as
+a hit, a miss, or a reconnect.
+"""
+import ssl
+import time
+import threading
+import http.client
+from contextlib import contextmanager
+
+from vlab_inf_common.vmware import vim
+
+from vlab_gateway_api.lib import metrics
+
+
+# Errors that mean the session itself is unusable, not that the task failed
+SESSION_ERRORS = (vim.fault.NotAuthenticated, ConnectionError, http.client.HTTPException, ssl.SSLError)
+
+
+class SessionPool(object):
+    """A thread-safe pool of vCenter sessions for a single worker process.
+
+    :param factory: **Required** Called with no args to login a new session
+    :type factory: Function
+
+    :param max_sessions: **Required** The most sessions that can be open at once
+    :type max_sessions: Integer
+
+    :param check_after: **Required** How many seconds a session can sit idle before
+                        it is checked for expiration when checked out.
+    :type check_after: Integer
+    """
+    def __init__(self, factory, max_sessions, check_after):
+        self._factory = factory
+        self._max_sessions = max_sessions
+        self._check_after = check_after
+        self.reset()
+
+    def reset(self):
+        """Forget every session without logging out.
+
+        Meant for a freshly forked process; the sessions belong to the parent.
+
+        :Returns: None
+        """
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self._max_sessions)
+        self._idle = []
+        self._open = 0
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def stats(self):
+        """Obtain counters that show how well the pool is working
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'reconnects': self.reconnects,
+                    'open': self._open,
+                    'idle': len(self._idle)}
+
+    @contextmanager
+    def session(self):
+        """Check out a logged in session, blocking if ``max_sessions`` are in use.
+
+        A session that raises an error in ``SESSION_ERRORS`` is logged out
+        instead of going back into the pool.
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        self._slots.acquire()
+        vcenter = None
+        try:
+            vcenter = self._checkout()
+            yield vcenter
+        except SESSION_ERRORS:
+            self._discard(vcenter)
+            vcenter = None
+            raise
+        finally:
+            if vcenter is not None:
+                self._checkin(vcenter)
+            self._slots.release()
+
+    def close(self):
+        """Logout every idle session
+
+        :Returns: None
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for vcenter, _ in idle:
+            self._discard(vcenter)
+
+    def _checkout(self):
+        """Pop an idle session, making sure it is still valid, or login a new one
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        with self._lock:
+            vcenter, last_used = self._idle.pop() if self._idle else (None, 0)
+        if vcenter is not None:
+            if time.time() - last_used < self._check_after or _is_alive(vcenter):
+                with self._lock:
+                    self.hits += 1
+                metrics.session_checkout('hit')
+                return vcenter
+            with self._lock:
+                self.reconnects += 1
+            metrics.session_checkout('reconnect')
+            self._discard(vcenter)
+        vcenter = self._factory()
+        with self._lock:
+            self.misses += 1
+            self._open += 1
+        metrics.session_checkout('miss')
+        return vcenter
+
+    def _checkin(self, vcenter):
+        """Return a session to the pool
+
+        :Returns: None
+
+        :param vcenter: The session being returned
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        with self._lock:
+            self._idle.append((vcenter, time.time()))
+
+    def _discard(self, vcenter):
+        """Logout a session that will not be reused
+
+        :Returns: None
+
+        :param vcenter: The session to get rid of
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        with self._lock:
+            self._open -= 1
+        try:
+            vcenter.close()
+        except Exception:
+            # Already expired, or vCenter is unreachable; either way it's gone
+            pass
+
+
+def _is_alive(vcenter):
+    """Determine if vCenter still honors a session
+
+    :Returns: Boolean
+
+    :param vcenter: The session to check
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    try:
+        return vcenter.content.sessionManager.currentSession is not None
+    except SESSION_ERRORS:
+        return False
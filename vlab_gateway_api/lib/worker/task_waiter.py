@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+"""
+Wait on many vCenter tasks at once.
+
+``consume_task`` polls ``task.info`` once a second, one task at a time. Here a
+single PropertyCollector watches the state of every task, and
+``WaitForUpdatesEx`` only returns when one of them changes; so waiting on ten
+tasks costs about as much as waiting on the slowest one.
+"""
+import time
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+
+TASK_PROPERTIES = ['info.state', 'info.error']
+FINISHED = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+
+
+def watch(vcenter, task_ids, max_wait):
+    """Wait until every task is finished, or ``max_wait`` seconds pass
+
+    :Returns: Dictionary - The moId of each task -> {'state': String, 'error': vmodl.MethodFault}
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param task_ids: The moIds of the tasks; a task from any session will do
+    :type task_ids: List
+
+    :param max_wait: The most seconds to wait for the tasks to finish
+    :type max_wait: Integer
+    """
+    states = {x: {'state': None, 'error': None} for x in task_ids}
+    if not task_ids:
+        return states
+    default_collector = vcenter.content.propertyCollector
+    collector = default_collector.CreatePropertyCollector()
+    try:
+        obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=vim.Task(x, default_collector._stub))
+                     for x in task_ids]
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=TASK_PROPERTIES)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[prop_spec])
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        deadline = time.time() + max_wait
+        version = ''
+        while True:
+            remaining = max(int(deadline - time.time()), 0)
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=remaining)
+            result = collector.WaitForUpdatesEx(version, options)
+            if result is None:
+                # Nothing changed before the deadline
+                break
+            version = result.version
+            for filter_set in result.filterSet:
+                for change in filter_set.objectSet:
+                    _apply(states[change.obj._moId], change)
+            if all_finished(states) and not result.truncated:
+                break
+    finally:
+        collector.DestroyPropertyCollector()
+    return states
+
+
+def all_finished(states):
+    """Determine if every task is done, whether it worked or not
+
+    :Returns: Boolean
+
+    :param states: The output from ``watch``
+    :type states: Dictionary
+    """
+    return all(x['state'] in FINISHED for x in states.values())
+
+
+def _apply(state, change):
+    """Update the state of a task
+
+    :Returns: None
+
+    :param state: The state of the task, from ``watch``
+    :type state: Dictionary
+
+    :param change: The change from the PropertyCollector
+    :type change: vmodl.query.PropertyCollector.ObjectUpdate
+    """
+    for prop in change.changeSet:
+        if prop.name == 'info.state':
+            state['state'] = prop.val
+        elif prop.name == 'info.error':
+            state['error'] = prop.val
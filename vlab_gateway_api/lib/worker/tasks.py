@@ -2,17 +2,167 @@
 """
 Entry point logic for available backend worker tasks
 """
-from celery import Celery
+import threading
+
+from celery import Celery, states
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_prerun, task_postrun, worker_ready, worker_process_init, worker_process_shutdown
 from vlab_api_common import get_task_logger
 
-from vlab_gateway_api.lib import const
-from vlab_gateway_api.lib.worker import vmware
+from vlab_gateway_api.lib import const, cache, bulk, progress, metrics, health, dispatch
+from vlab_gateway_api.lib.worker import vmware, admission, images
+
+
+# States where a task will run again, or another task took over its id
+UNFINISHED = (states.RETRY, states.IGNORED)
+
+app = Celery('gateway')
+app.config_from_object('vlab_gateway_api.lib.celery_config')
+if const.VLAB_GATEWAY_POOL_SIZE:
+    # Only takes effect in the worker started with ``--beat``
+    app.conf.beat_schedule = {
+        'refill-gateway-pool': {
+            'task': 'gateway.pool_refill',
+            'schedule': const.VLAB_GATEWAY_POOL_REFILL_INTERVAL,
+            'args': ('beat',),
+        },
+    }
+
+
+@worker_ready.connect
+def _serve_metrics(sender, **kwargs):
+    """Serve the metrics of every worker process for Prometheus to scrape"""
+    if const.VLAB_GATEWAY_METRICS_PORT:
+        metrics.serve(const.VLAB_GATEWAY_METRICS_PORT)
+
+
+@worker_process_init.connect
+def _reset_sessions(**kwargs):
+    """A forked worker must not share vCenter sessions with its parent"""
+    vmware.SESSIONS.reset()
+
+
+@worker_ready.connect
+def _fill_pool(sender, **kwargs):
+    """Start filling the warm pool as soon as a worker comes online"""
+    if const.VLAB_GATEWAY_POOL_SIZE:
+        sender.app.send_task('gateway.pool_refill', kwargs={'txn_id': 'worker_ready'})
+
+
+@worker_ready.connect
+def _catalog_images(sender, **kwargs):
+    """Publish the gateway images this worker can deploy, and checksum them in the background"""
+    logger = get_task_logger(txn_id='worker_ready', task_id='images', loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    checksums = cache.claim_image_checksums(const.VLAB_GATEWAY_IMAGE_CHECKSUM_LEASE)
+    threading.Thread(target=_refresh_images, args=(logger, checksums), daemon=True).start()
+
+
+@worker_ready.connect
+def _check_in(sender, **kwargs):
+    """Tell the API this worker is alive, and how vCenter is doing, until the worker stops"""
+    threading.Thread(target=health.heartbeat_forever, args=(sender.hostname, vmware.check_session), daemon=True).start()
+
+
+def _refresh_images(logger, checksums):
+    """Runs ``images.refresh`` in a thread, where an exception would go unnoticed"""
+    try:
+        images.refresh(logger, checksums=checksums)
+    except OSError as doh:
+        logger.error('Unable to catalog gateway images: {}'.format(doh))
+
+
+@task_prerun.connect
+def _bind_metrics(task_id=None, task=None, args=None, kwargs=None, **extras):
+    """Tag the metrics of a task with its txn_id, which is always the last argument"""
+    if kwargs and 'txn_id' in kwargs:
+        txn_id = kwargs['txn_id']
+    elif args:
+        txn_id = args[-1]
+    else:
+        txn_id = None
+    metrics.bind(txn_id)
+
+
+@task_postrun.connect
+def _record_metrics(task=None, state=None, **kwargs):
+    """Record how long a task took; a retry counts as its own attempt"""
+    metrics.task_done(task.name, state)
+
+
+@task_postrun.connect
+def _record_bulk(task_id=None, task=None, retval=None, state=None, **kwargs):
+    """Update the bulk operation (if any) that a create/delete task was part of"""
+    if task.name not in ('gateway.create', 'gateway.delete', 'gateway.delete_wait') or state in UNFINISHED:
+        return
+    if state == 'SUCCESS':
+        error = retval['error']
+    else:
+        error = '{}'.format(retval)
+    try:
+        bulk.record_result(task_id, error)
+    except cache.CACHE_ERRORS:
+        pass
+
+
+@task_postrun.connect
+def _release_inflight(task_id=None, task=None, args=None, state=None, **kwargs):
+    """Let the API queue a new show/create/delete/reconfigure for the user once this one is done"""
+    if task.name not in ('gateway.show', 'gateway.create', 'gateway.delete', 'gateway.delete_wait',
+                         'gateway.reconfigure') or state in UNFINISHED:
+        return
+    if not args:
+        # Not sent by the API, so it never claimed anything
+        return
+    if task.name == 'gateway.delete_wait':
+        # Took over the task id of a gateway.delete
+        cache.release_inflight('delete', args[0], [], task_id)
+        return
+    # The API sends (username, *params, txn_id)
+    cache.release_inflight(task.name.split('.')[1], args[0], list(args[1:-1]), task_id)
+
+
+@task_postrun.connect
+def _publish_result(task_id=None, task=None, args=None, retval=None, state=None, **kwargs):
+    """Publish the outcome of a create/delete/reconfigure as its last progress event"""
+    if task.name not in ('gateway.create', 'gateway.delete', 'gateway.delete_wait',
+                         'gateway.reconfigure') or state in UNFINISHED:
+        return
+    if not args:
+        return
+    if state == states.SUCCESS:
+        stage = progress.FAILED if retval['error'] else progress.COMPLETE
+        progress.publish(task_id, args[0], stage, retval)
+    else:
+        progress.publish(task_id, args[0], progress.FAILED, {'error': '{}'.format(retval)})
+
+
+@worker_process_shutdown.connect
+def _close_sessions(**kwargs):
+    """Logout of vCenter so the sessions do not linger until they expire"""
+    vmware.SESSIONS.close()
+
+
+def _retry(task, busy, logger):
+    """Put a task that wasn't admitted back on the queue, backing off on every retry
+
+    :Returns: celery.exceptions.Retry
 
+    :param task: The bound task
+    :type task: celery.Task
 
-app = Celery('gateway', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+    :param busy: The reason the task wasn't admitted
+    :type busy: vlab_gateway_api.lib.worker.admission.Busy
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    countdown = max(busy.wait, min(2 ** task.request.retries, 60))
+    logger.info('{}; retrying in {:.1f} seconds'.format(busy, countdown))
+    return task.retry(countdown=countdown, max_retries=None)
 
 
-@app.task(name='gateway.show', bind=True)
+@app.task(name='gateway.show', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
 def show(self, username, txn_id):
     """Obtain basic information about a user's default gateway
 
@@ -27,19 +177,29 @@ def show(self, username, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     try:
-        logger.info('Task starting')
-        info = vmware.show_gateway(username)
-    except ValueError as doh:
-        logger.error('Task failed: {}'.format(doh))
-        resp['error'] = '{}'.format(doh)
-    else:
-        logger.info('Task complete')
-        resp['content'] = info
+        with admission.admit('show', self.request.id, logger):
+            try:
+                logger.info('Task starting')
+                generation = cache.show_generation(username)
+                info = vmware.show_gateway(username)
+            except ValueError as doh:
+                logger.error('Task failed: {}'.format(doh))
+                resp['error'] = '{}'.format(doh)
+            except SoftTimeLimitExceeded:
+                logger.error('Task failed: timed out')
+                resp['error'] = 'Timed out looking up gateway; try again later'
+            else:
+                logger.info('Task complete')
+                resp['content'] = info
+                cache.set_show(username, info, generation)
+    except admission.Busy as doh:
+        raise _retry(self, doh, logger)
+    logger.debug('vCenter session pool: {}'.format(vmware.SESSIONS.stats()))
     return resp
 
 
 @app.task(name='gateway.create', bind=True)
-def create(self, username, wan, lan, txn_id):
+def create(self, username, wan, lan, image, txn_id):
     """Deploy a new default gateway
 
     :Returns: Dictionary
@@ -50,18 +210,34 @@ def create(self, username, wan, lan, txn_id):
     :param network: The name of the network that the jumpbox connects to.
     :type network: String
 
+    :param image: The file name of the OVA to deploy
+    :type image: String
+
     :param txn_id: A unique string supplied by the client to track the call through logs
     :type txn_id: String
     """
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     try:
-        logger.info('Task starting')
-        resp['content'] = vmware.create_gateway(username, wan, lan, logger)
-    except ValueError as doh:
-        logger.error('Task failed: {}'.format(doh))
-        resp['error'] = '{}'.format(doh)
+        with admission.admit('create', self.request.id, logger):
+            try:
+                logger.info('Task starting')
+                cache.invalidate_show(username)
+                report = progress.reporter(self.request.id, username)
+                resp['content'] = vmware.create_gateway(username, wan, lan, logger, image_name=image, report=report)
+            except ValueError as doh:
+                logger.error('Task failed: {}'.format(doh))
+                resp['error'] = '{}'.format(doh)
+            finally:
+                # The gateway changed while a show might have been caching the old state
+                cache.invalidate_show(username)
+    except admission.Busy as doh:
+        raise _retry(self, doh, logger)
     logger.info('Task complete')
+    if const.VLAB_GATEWAY_POOL_SIZE:
+        # Replace the spare this gateway might have claimed
+        pool_refill.delay(txn_id=txn_id)
+    logger.debug('vCenter session pool: {}'.format(vmware.SESSIONS.stats()))
     return resp
 
 
@@ -80,12 +256,228 @@ def delete(self, username, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     try:
-        logger.info('Task starting')
-        info = vmware.delete_gateway(username, logger)
+        with admission.admit('delete', self.request.id, logger):
+            try:
+                logger.info('Task starting')
+                cache.invalidate_show(username)
+                report = progress.reporter(self.request.id, username)
+                deleting = vmware.delete_gateway(username, logger, report=report)
+            except ValueError as doh:
+                logger.error('Task failed: {}'.format(doh))
+                resp['error'] = '{}'.format(doh)
+            else:
+                if deleting is not None:
+                    # Free up this worker while vCenter powers off and destroys
+                    # the VMs; the client sees the result of delete_wait instead
+                    logger.info('Waiting on vCenter')
+                    wait = delete_wait.s(username, deleting, txn_id).set(reply_to=self.request.reply_to)
+                    return self.replace(wait)
+                logger.info('Task complete')
+            finally:
+                cache.invalidate_show(username)
+    except admission.Busy as doh:
+        raise _retry(self, doh, logger)
+    logger.debug('vCenter session pool: {}'.format(vmware.SESSIONS.stats()))
+    return resp
+
+
+@app.task(name='gateway.delete_wait', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
+def delete_wait(self, username, deleting, txn_id):
+    """Finish deleting the default gateway, retrying until vCenter is done
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who is deleting their default gateway
+    :type username: String
+
+    :param deleting: The output from ``vmware.delete_gateway`` or ``vmware.delete_step``
+    :type deleting: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    try:
+        report = progress.reporter(self.request.id, username)
+        deleting = vmware.delete_step(deleting, logger, report=report)
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    else:
+        if deleting is not None:
+            raise self.retry(args=[username, deleting, txn_id], countdown=1, max_retries=None)
+        logger.info('Task complete')
+    cache.invalidate_show(username)
+    return resp
+
+
+@app.task(name='gateway.reconfigure', bind=True)
+def reconfigure(self, username, txn_id):
+    """Change the settings of a default gateway to match the current profile
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the default gateway
+    :type username: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    try:
+        with admission.admit('reconfigure', self.request.id, logger):
+            try:
+                logger.info('Task starting')
+                report = progress.reporter(self.request.id, username)
+                resp['content'] = vmware.reconfigure_gateway(username, logger, report=report)
+            except ValueError as doh:
+                logger.error('Task failed: {}'.format(doh))
+                resp['error'] = '{}'.format(doh)
+            else:
+                logger.info('Task complete')
+            finally:
+                # The version and generation in the meta data changed
+                cache.invalidate_show(username)
+    except admission.Busy as doh:
+        raise _retry(self, doh, logger)
+    logger.debug('vCenter session pool: {}'.format(vmware.SESSIONS.stats()))
+    return resp
+
+
+@app.task(name='gateway.image', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
+def image(self, txn_id):
+    """Obtain, and publish, the catalog of gateway images
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : [], 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = images.refresh(logger)
+    except OSError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = 'Unable to list gateway images'
+    else:
+        logger.info('Task complete')
+    return resp
+
+
+@app.task(name='gateway.networks', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
+def networks(self, txn_id):
+    """Obtain the names of every network in vCenter
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : [], 'error': None, 'params': {}}
+    logger.info('Task starting')
+    resp['content'] = vmware.network_names()
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='gateway.fleet', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
+def fleet(self, username, version, generation, after, limit, txn_id):
+    """Obtain one page of every user's gateway, for an admin
+
+    :Returns: Dictionary
+
+    :param username: The admin who wants to see the fleet
+    :type username: String
+
+    :param version: Only include gateways configured with this profile version, or None
+    :type version: String
+
+    :param generation: Only include gateways that were configured this many times, or None
+    :type generation: Integer
+
+    :param after: The cursor of the page to return; None for the first page
+    :type after: String
+
+    :param limit: The most gateways to return
+    :type limit: Integer
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.list_fleet(version=version, generation=generation, after=after, limit=limit)
+    except SoftTimeLimitExceeded:
+        logger.error('Task failed: timed out')
+        resp['error'] = 'Timed out listing gateways; try again later'
     else:
         logger.info('Task complete')
-        resp['content'] = info
     return resp
+
+
+@app.task(name='gateway.bulk', bind=True, soft_time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT,
+          time_limit=const.VLAB_GATEWAY_READ_TIME_LIMIT + 5)
+def bulk_dispatch(self, bulk_id, txn_id):
+    """Send the next users of a bulk operation to the workers, and reschedule
+    itself until every user is done.
+
+    No more than ``VLAB_GATEWAY_BULK_CONCURRENCY`` users are queued at once, so
+    a bulk operation doesn't starve everyone else of workers or swamp vCenter.
+
+    :Returns: Dictionary
+
+    :param bulk_id: The id of the bulk operation
+    :type bulk_id: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    action, batch, complete = bulk.next_batch(bulk_id, const.VLAB_GATEWAY_BULK_CONCURRENCY)
+    for username, entry, task_id in batch:
+        if action == 'create':
+            params = [entry['wan'], entry['lan'], const.VLAB_GATEWAY_DEFAULT_IMAGE]
+        else:
+            params = []
+        # The same claim as the API, so a bulk task never races the user's own
+        sent = dispatch.send_once(app, action, username, params, txn_id, logger, task_id=task_id)
+        if sent != task_id:
+            bulk.follow(task_id, sent)
+    if batch:
+        logger.info('Queued {} {} tasks for bulk operation {}'.format(len(batch), action, bulk_id))
+    if not complete:
+        self.apply_async(args=[bulk_id, txn_id], countdown=const.VLAB_GATEWAY_BULK_POLL)
+    resp['content'] = {'bulk-id': bulk_id, 'queued': len(batch), 'complete': complete}
+    return resp
+
+
+@app.task(name='gateway.pool_refill', bind=True, ignore_result=True)
+def pool_refill(self, txn_id):
+    """Top up the warm pool of spare gateways
+
+    :Returns: None
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_GATEWAY_LOG_LEVEL.upper())
+    logger.info('Task starting')
+    try:
+        added = vmware.refill_pool(logger)
+    except (ValueError, RuntimeError) as doh:
+        # The failed spare is already destroyed; the next refill tries again
+        logger.error('Task failed: {}'.format(doh))
+        return
+    logger.info('Task complete, added {} spare gateways'.format(added))
@@ -0,0 +1,205 @@
+# -*- coding: UTF-8 -*-
+"""
+Deploy gateways as linked clones of a golden template.
+
+The OVA is imported once per image version into ``VLAB_GATEWAY_TEMPLATE_DIR``
+and snapshotted. Every gateway after that is a linked clone of the snapshot,
+so only a delta disk is created instead of streaming the whole image.
+
+Only one worker (in any container) imports a template at a time; it claims the
+import in the shared store for ``VLAB_GATEWAY_TEMPLATE_IMPORT_LEASE`` seconds.
+Until the template is snapshotted, creates deploy the OVA instead. A template
+left without a snapshot by a failed import is destroyed, and imported again,
+by the next worker to claim it.
+"""
+import re
+import os
+
+import ujson
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
+
+from vlab_gateway_api.lib import const, cache
+from vlab_gateway_api.lib.worker import vm_utils
+
+
+SNAPSHOT_NAME = 'golden'
+TEMPLATE_COMPONENT = 'gatewayTemplate'
+
+
+def clone_gateway(vcenter, ova, ova_path, network_map, username, machine_name, logger):
+    """Create a new gateway as a linked clone of the template for an OVA
+
+    :Returns: vim.VirtualMachine, or None if the template is not usable yet
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param ova: The OVA to import if there's no template for it yet
+    :type ova: vlab_inf_common.vmware.Ova
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+
+    :param network_map: The mapping of OVA networks to vCenter networks
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param username: The user who will own the new gateway
+    :type username: String
+
+    :param machine_name: The name to give the new VM
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    template = get_template(vcenter, ova, ova_path, network_map, logger)
+    if template is None:
+        return None
+    folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    spec = _clone_spec(vcenter, template, network_map)
+    logger.debug('Creating linked clone of {}'.format(template.name))
+    return consume_task(template.CloneVM_Task(folder=folder, name=machine_name, spec=spec))
+
+
+def get_template(vcenter, ova, ova_path, network_map, logger):
+    """Find the template for an OVA, importing the OVA if needed
+
+    :Returns: vim.VirtualMachine, or None if the template is being imported by
+              another worker, or the import failed
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param ova: The OVA to import if there's no template for it yet
+    :type ova: vlab_inf_common.vmware.Ova
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+
+    :param network_map: The networks to connect the template to while importing
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    name = template_name(ova_path)
+    template = _find_template(vcenter, name)
+    if template is not None and template.snapshot is not None:
+        return template
+    if not cache.claim_template_import(name, const.VLAB_GATEWAY_TEMPLATE_IMPORT_LEASE):
+        logger.warning('Template {} is being imported by another worker; deploying the OVA instead'.format(name))
+        return None
+    try:
+        # Another worker might have finished the import before this one claimed it
+        template = _find_template(vcenter, name)
+        if template is not None and template.snapshot is None:
+            logger.warning('Destroying template {}, left over from a failed import'.format(name))
+            consume_task(template.Destroy_Task())
+            template = None
+        if template is None:
+            logger.info('Importing {} as template {}'.format(ova_path, name))
+            template = _import_template(vcenter, ova, name, network_map, logger)
+    except Exception as doh:
+        logger.warning('Unable to import template {}; deploying the OVA instead: {}'.format(name, doh))
+        return None
+    finally:
+        cache.release_template_import(name)
+    return template
+
+
+def template_name(ova_path):
+    """Create a VM name that's unique to a version of an OVA file.
+
+    A replaced OVA gets a new modified time, and therefore a new template.
+
+    :Returns: String
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+    """
+    stem = os.path.splitext(os.path.basename(ova_path))[0]
+    stem = re.sub(r'[^a-zA-Z0-9\-]', '-', stem).strip('-')
+    return '{}-{}'.format(stem, int(os.stat(ova_path).st_mtime))
+
+
+def _find_template(vcenter, name):
+    """Look up an already imported template
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param name: The name of the template
+    :type name: String
+    """
+    folder = vm_utils.ensure_folder(vcenter, const.VLAB_GATEWAY_TEMPLATE_DIR)
+    for entity in folder.childEntity:
+        if entity.name == name:
+            return entity
+    return None
+
+
+def _import_template(vcenter, ova, name, network_map, logger):
+    """Deploy the OVA, record which NIC is which network, and snapshot it.
+
+    If the template cannot be finished, it's destroyed.
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param ova: The OVA to import
+    :type ova: vlab_inf_common.vmware.Ova
+
+    :param name: The name of the template
+    :type name: String
+
+    :param network_map: The networks to connect the template to while importing
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    vm_utils.ensure_folder(vcenter, const.VLAB_GATEWAY_TEMPLATE_DIR)
+    template = virtual_machine.deploy_from_ova(vcenter, ova, network_map,
+                                               const.VLAB_GATEWAY_TEMPLATE_DIR,
+                                               name, logger, power_on=False)
+    try:
+        meta_data = {'component': TEMPLATE_COMPONENT, 'nics': vm_utils.nic_labels(template, network_map)}
+        consume_task(template.ReconfigVM_Task(vim.vm.ConfigSpec(annotation=ujson.dumps(meta_data))))
+        consume_task(template.CreateSnapshot_Task(name=SNAPSHOT_NAME, memory=False, quiesce=False))
+    except Exception:
+        try:
+            consume_task(template.Destroy_Task())
+        except RuntimeError as doh:
+            # The next import destroys it instead
+            logger.error('Unable to destroy half imported template {}: {}'.format(name, doh))
+        raise
+    return template
+
+
+def _clone_spec(vcenter, template, network_map):
+    """Define a linked clone of the template, connected to the supplied networks
+
+    :Returns: vim.vm.CloneSpec
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param template: The VM to clone
+    :type template: vim.VirtualMachine
+
+    :param network_map: The networks the clone should connect to
+    :type network_map: List of vim.OvfManager.NetworkMapping
+    """
+    labels = ujson.loads(template.config.annotation)['nics']
+    changes = vm_utils.nic_changes(template, labels, network_map)
+    location = vim.vm.RelocateSpec(diskMoveType='createNewChildDiskBacking',
+                                   pool=vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL])
+    return vim.vm.CloneSpec(location=location,
+                            snapshot=template.snapshot.currentSnapshot,
+                            config=vim.vm.ConfigSpec(deviceChange=changes),
+                            powerOn=True,
+                            template=False)
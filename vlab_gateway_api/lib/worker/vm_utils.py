@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+"""
+Small helpers for VMs and folders that vlab_inf_common doesn't provide
+"""
+from vlab_inf_common.vmware import vim
+
+from vlab_gateway_api.lib import const
+
+
+def ensure_folder(vcenter, name):
+    """Obtain a folder under ``INF_VCENTER_TOP_LVL_DIR``, creating it if needed
+
+    :Returns: vim.Folder
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param name: The name of the folder
+    :type name: String
+    """
+    try:
+        return vcenter.get_by_name(name=name, vimtype=vim.Folder)
+    except ValueError:
+        vcenter.create_vm_folder('{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR, name))
+        return vcenter.get_by_name(name=name, vimtype=vim.Folder)
+
+
+def nic_labels(the_vm, network_map):
+    """Map the OVA network names to the label of the NIC connected to them.
+
+    Once a VM is moved to other networks, the label is the only way to tell
+    which NIC is the WAN and which is the LAN; so record this while the NICs
+    are still connected to the networks from the OVA deploy.
+
+    :Returns: Dictionary
+
+    :param the_vm: The newly deployed VM
+    :type the_vm: vim.VirtualMachine
+
+    :param network_map: The networks the VM was deployed with
+    :type network_map: List of vim.OvfManager.NetworkMapping
+    """
+    labels = {}
+    for a_map in network_map:
+        for device in _nics(the_vm):
+            if _connected_to(device, a_map.network):
+                labels[a_map.name] = device.deviceInfo.label
+    return labels
+
+
+def nic_changes(the_vm, labels, network_map):
+    """Define the device changes that connect a VM's NICs to new networks
+
+    :Returns: List of vim.vm.device.VirtualDeviceSpec
+
+    :param the_vm: The VM to reconnect
+    :type the_vm: vim.VirtualMachine
+
+    :param labels: The output from ``nic_labels``
+    :type labels: Dictionary
+
+    :param network_map: The networks the NICs should connect to
+    :type network_map: List of vim.OvfManager.NetworkMapping
+    """
+    devices = {x.deviceInfo.label: x for x in _nics(the_vm)}
+    changes = []
+    for a_map in network_map:
+        device = devices[labels[a_map.name]]
+        device.backing = _backing(a_map.network)
+        nic_spec = vim.vm.device.VirtualDeviceSpec()
+        nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+        nic_spec.device = device
+        changes.append(nic_spec)
+    return changes
+
+
+def _nics(the_vm):
+    """Obtain the virtual NICs of a VM
+
+    :Returns: List
+
+    :param the_vm: The VM with the NICs
+    :type the_vm: vim.VirtualMachine
+    """
+    return [x for x in the_vm.config.hardware.device if isinstance(x, vim.vm.device.VirtualEthernetCard)]
+
+
+def _connected_to(device, network):
+    """Determine if a NIC is connected to a network
+
+    :Returns: Boolean
+
+    :param device: The virtual NIC
+    :type device: vim.vm.device.VirtualEthernetCard
+
+    :param network: The network to check for
+    :type network: vim.Network
+    """
+    backing = device.backing
+    if isinstance(backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo):
+        return backing.port.portgroupKey == getattr(network, 'key', None)
+    return backing.network is not None and backing.network._moId == network._moId
+
+
+def _backing(network):
+    """Create the NIC backing for connecting to a network
+
+    :Returns: vim.vm.device.VirtualDevice.BackingInfo
+
+    :param network: The network to connect to
+    :type network: vim.Network
+    """
+    if isinstance(network, vim.dvs.DistributedVirtualPortgroup):
+        port = vim.dvs.PortConnection(portgroupKey=network.key,
+                                      switchUuid=network.config.distributedVirtualSwitch.uuid)
+        return vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo(port=port)
+    return vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(network=network, deviceName=network.name)
@@ -1,19 +1,37 @@
 # -*- coding: UTF-8 -*-
 """Business logic for backend worker tasks"""
 import time
-import socket
+import heapq
 import random
 import os.path
 
 import ujson
-from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
+from vlab_inf_common.vmware import vCenter, vim, virtual_machine
 
-from vlab_gateway_api.lib import const
+from vlab_gateway_api.lib import const, progress, metrics
+from vlab_gateway_api.lib.worker import inventory, readiness, provision, profile, template, warm_pool, task_waiter, context
+from vlab_gateway_api.lib.worker.session_pool import SessionPool
+from vlab_gateway_api.lib.worker.mapped_ova import MappedOva
 
 
 COMPONENT_NAME='defaultGateway'
 
 
+def _login():
+    """Create a new session to vCenter
+
+    :Returns: vlab_inf_common.vmware.vCenter
+    """
+    with metrics.timed('vcenter_login'):
+        return vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
+                       password=const.INF_VCENTER_PASSWORD)
+
+
+SESSIONS = SessionPool(factory=_login,
+                       max_sessions=const.INF_VCENTER_MAX_SESSIONS,
+                       check_after=const.INF_VCENTER_SESSION_CHECK)
+
+
 def show_gateway(username):
     """Obtain basic information about the defaultGateway
 
@@ -23,20 +41,84 @@ def show_gateway(username):
     :type username: String
     """
     info = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            if vm.name == COMPONENT_NAME:
-                info = virtual_machine.get_info(vcenter, vm, username)
-                break
+    with SESSIONS.session() as vcenter:
+        with metrics.timed('folder_lookup'):
+            the_vm = inventory.get(vcenter).find_vm(username, COMPONENT_NAME)
+        if the_vm is not None:
+            # get_info reads vCenter.networks; this keeps that from listing every network
+            inventory.get_networks(vcenter)
+            with metrics.timed('get_info'):
+                info = virtual_machine.get_info(vcenter, the_vm, username)
     return info
 
 
-def create_gateway(username, wan, lan, logger, image_name='defaultgateway-IPAM.ova'):
+def list_fleet(version=None, generation=None, after=None, limit=const.VLAB_GATEWAY_FLEET_PAGE):
+    """Obtain one page of every user's defaultGateway, sorted by owner.
+
+    Read from the inventory index, so it's one round trip to vCenter no matter
+    how many gateways there are, and only one page is ever copied out of it.
+
+    :Returns: Dictionary - The gateways, and the cursor of the next page (None on the last page)
+
+    :param version: Only include gateways configured with this profile version
+    :type version: String
+
+    :param generation: Only include gateways that were configured this many times
+    :type generation: Integer
+
+    :param after: The cursor of the page to return; None for the first page
+    :type after: String
+
+    :param limit: The most gateways to return
+    :type limit: Integer
+    """
+    start = _split_cursor(after) if after is not None else None
+    with SESSIONS.session() as vcenter:
+        with metrics.timed('folder_lookup'):
+            index = inventory.get(vcenter)
+        def matches():
+            for owner, the_vm in index.owned_vms(COMPONENT_NAME):
+                if start is not None and (owner, the_vm._moId) <= start:
+                    continue
+                meta_data = index.meta(the_vm)
+                if version is not None and meta_data.get('version') != version:
+                    continue
+                if generation is not None and meta_data.get('generation') != generation:
+                    continue
+                yield (owner, the_vm._moId), meta_data
+        # Keeps ``limit`` + 1 gateways, instead of sorting the whole fleet
+        found = heapq.nsmallest(limit + 1, matches(), key=lambda x: x[0])
+    gateways = []
+    for (owner, moid), meta_data in found[:limit]:
+        gateways.append({'username': owner,
+                         'moid': moid,
+                         'version': meta_data.get('version'),
+                         'generation': meta_data.get('generation'),
+                         'created': meta_data.get('created'),
+                         'configured': meta_data.get('configured', False)})
+    next_page = None
+    if len(found) > limit:
+        next_page = '{}:{}'.format(*found[limit - 1][0])
+    return {'gateways': gateways, 'next': next_page}
+
+
+def _split_cursor(cursor):
+    """Convert the cursor of a page of the fleet back into a sort key
+
+    :Returns: Tuple - (owner, moId)
+
+    :param cursor: The ``next`` of the prior page
+    :type cursor: String
+    """
+    owner, _, moid = cursor.rpartition(':')
+    return owner, moid
+
+
+def create_gateway(username, wan, lan, logger, image_name=const.VLAB_GATEWAY_DEFAULT_IMAGE, report=progress.no_report):
     """Deploy the defaultGateway from an OVA
 
-    :Returns: None
+    :Returns: Dictionary - Info about the new gateway, and the results of
+              every setup step under "setup"
 
     :param username: The user who wants to create a new defaultGateway
     :type username: String
@@ -52,41 +134,188 @@ def create_gateway(username, wan, lan, logger, image_name='defaultgateway-IPAM.o
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
+
+    :param report: Publishes the progress of the create
+    :type report: Function
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        ova = Ova(os.path.join(const.VLAB_GATEWAY_IMAGES_DIR, image_name))
+    with SESSIONS.session() as vcenter:
+        # The image came from the API; never look outside the images dir
+        ova_path = os.path.join(const.VLAB_GATEWAY_IMAGES_DIR, os.path.basename(image_name))
+        try:
+            ova = MappedOva(ova_path)
+        except FileNotFoundError:
+            raise ValueError('No such image: {}'.format(image_name))
         try:
-            network_map = _create_network_map(vcenter, ova, wan, lan, logger)
-            the_vm = virtual_machine.deploy_from_ova(vcenter, ova, network_map,
-                                                     username, COMPONENT_NAME, logger)
+            report('network_map')
+            # Also refreshes the networks ``get_info`` reads, on a reused session
+            with metrics.timed('network_map', logger):
+                network_map = _create_network_map(vcenter, ova, wan, lan, logger)
+            the_vm = None
+            if const.VLAB_GATEWAY_POOL_SIZE:
+                report('pool_claim')
+                with metrics.timed('pool_claim', logger):
+                    the_vm = warm_pool.claim(vcenter, username, COMPONENT_NAME,
+                                             network_map, image_name, logger)
+            pooled = the_vm is not None
+            if not pooled:
+                report('deploy')
+                with metrics.timed('deploy', logger):
+                    the_vm = _deploy(vcenter, ova, ova_path, network_map, username, COMPONENT_NAME, logger)
         finally:
             ova.close()
-        _setup_gateway(vcenter, the_vm, username, gateway_version='1.0.0', logger=logger)
-        return virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
+        setup_report = _setup_gateway(vcenter, the_vm, username, logger=logger,
+                                      pooled=pooled, report=report)
+        with metrics.timed('get_info', logger):
+            info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
+    info['setup'] = setup_report
+    return info
+
+
+def refill_pool(logger, image_name=const.VLAB_GATEWAY_DEFAULT_IMAGE):
+    """Deploy and partly configure spare gateways until the warm pool is full.
+
+    At most ``VLAB_GATEWAY_POOL_REFILL_RATE`` spares are created per call, so a
+    refill never hogs vCenter while users are creating gateways.
+
+    :Returns: Integer - The number of spares added to the pool
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param image_name: The of the OVA to deploy
+    :type image_name: String
+    """
+    added = 0
+    with SESSIONS.session() as vcenter:
+        the_context = context.get(resolve_name(context.VLAB_HOST))
+        settings = the_context.profile.settings
+        ova_path = os.path.join(const.VLAB_GATEWAY_IMAGES_DIR, image_name)
+        for _ in range(const.VLAB_GATEWAY_POOL_REFILL_RATE):
+            # Check every time; another worker might be refilling too
+            if not warm_pool.missing(vcenter):
+                break
+            ova = MappedOva(ova_path)
+            try:
+                network_map = _create_network_map(vcenter, ova,
+                                                  const.VLAB_GATEWAY_POOL_WAN,
+                                                  const.VLAB_GATEWAY_POOL_LAN,
+                                                  logger)
+                the_vm = _deploy(vcenter, ova, ova_path, network_map,
+                                 const.VLAB_GATEWAY_POOL_DIR, warm_pool.spare_name(), logger)
+            finally:
+                ova.close()
+            try:
+                with metrics.timed('boot_wait', logger):
+                    readiness.wait_for_guest(the_vm, logger)
+                setup_report = provision.run_steps(vcenter, the_vm, list(the_context.common_steps), logger)
+                warm_pool.mark_ready(the_vm, network_map, image_name,
+                                     applied=_applied({}, settings, setup_report))
+            except Exception:
+                # Otherwise it counts as "still being deployed" forever, and
+                # the pool never gets back to full size
+                logger.error('Unable to add {} to the gateway pool'.format(the_vm.name))
+                warm_pool.discard(the_vm, logger)
+                raise
+            logger.info('Added {} to the gateway pool'.format(the_vm.name))
+            added += 1
+    return added
+
+
+def network_names():
+    """Obtain the names of every network in vCenter
+
+    :Returns: List
+    """
+    with SESSIONS.session() as vcenter:
+        return sorted(inventory.get_networks(vcenter).networks.keys())
 
 
-def delete_gateway(username, logger):
-    """Unregister and destroy the defaultGateway virtual machine
+def check_session():
+    """Make sure vCenter still honors a session of the worker
 
     :Returns: None
 
+    :Raises: RuntimeError if the session was not honored
+    """
+    with SESSIONS.session() as vcenter:
+        if vcenter.content.sessionManager.currentSession is None:
+            raise RuntimeError('vCenter did not honor the session')
+
+
+def delete_gateway(username, logger, report=progress.no_report):
+    """Start powering off every defaultGateway VM a user has.
+
+    Doesn't wait on vCenter; supply the output to ``delete_step`` until it
+    returns None.
+
+    :Returns: Dictionary - What's left to do for the delete, or None if there's nothing to delete
+
     :param username: The user who wants to delete their defaultGateway
     :type username: String
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
+
+    :param report: Publishes the progress of the delete
+    :type report: Function
+    """
+    with SESSIONS.session() as vcenter:
+        with metrics.timed('folder_lookup'):
+            vms = inventory.get(vcenter).find_vms(username, COMPONENT_NAME)
+        if not vms:
+            return None
+        logger.debug('powering off {} VM(s)'.format(len(vms)))
+        report('power_off', {'vms': len(vms)})
+        tasks = []
+        for the_vm in vms:
+            try:
+                tasks.append(the_vm.PowerOffVM_Task()._moId)
+            except vim.fault.InvalidPowerState:
+                # Already off
+                pass
+    return {'stage': 'power',
+            'vms': [x._moId for x in vms],
+            'tasks': tasks,
+            'deadline': time.time() + const.VLAB_GATEWAY_DELETE_TIMEOUT}
+
+
+def delete_step(deleting, logger, report=progress.no_report):
+    """Wait a little while on the vCenter tasks of a delete, and start the
+    next stage once they're done.
+
+    :Returns: Dictionary - What's left to do for the delete, or None once every VM is destroyed
+
+    :Raises: ValueError if a VM cannot be destroyed, or the delete takes too long
+
+    :param deleting: The output from ``delete_gateway``, or a prior ``delete_step``
+    :type deleting: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param report: Publishes the progress of the delete
+    :type report: Function
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == COMPONENT_NAME:
-                logger.debug('powering off VM')
-                virtual_machine.power(entity, state='off')
-                delete_task = entity.Destroy_Task()
-                logger.debug('blocking while VM is being destroyed')
-                consume_task(delete_task)
+    with SESSIONS.session() as vcenter:
+        states = task_waiter.watch(vcenter, deleting['tasks'], const.VLAB_GATEWAY_DELETE_POLL)
+        if not task_waiter.all_finished(states):
+            if time.time() > deleting['deadline']:
+                raise ValueError('Timed out waiting on vCenter to delete the gateway')
+            return deleting
+        if deleting['stage'] == 'destroy':
+            errors = [x['error'].msg for x in states.values() if x['error'] is not None]
+            if errors:
+                raise ValueError('Unable to destroy gateway: {}'.format('; '.join(errors)))
+            return None
+        for state in states.values():
+            # A VM that was already off is fine; anything else, Destroy_Task reports
+            if state['error'] is not None and not isinstance(state['error'], vim.fault.InvalidPowerState):
+                logger.error('Unable to power off VM: {}'.format(state['error'].msg))
+        logger.debug('destroying {} VM(s)'.format(len(deleting['vms'])))
+        report('destroy', {'vms': len(deleting['vms'])})
+        stub = vcenter.content.propertyCollector._stub
+        tasks = [vim.VirtualMachine(x, stub).Destroy_Task()._moId for x in deleting['vms']]
+    return dict(deleting, stage='destroy', tasks=tasks)
 
 
 def _create_network_map(vcenter, ova, wan, lan, logger):
@@ -98,7 +327,7 @@ def _create_network_map(vcenter, ova, wan, lan, logger):
     :type vcenter: vlab_inf_common.vmware.vCenter
 
     :param ova: The instantiated OVA object
-    :type ova: vlab_inf_common.vmware.Ova
+    :type ova: vlab_gateway_api.lib.worker.mapped_ova.MappedOva
 
     :param wan: The name of the network to use in vCenter for the WAN network
     :type wan: String
@@ -110,13 +339,14 @@ def _create_network_map(vcenter, ova, wan, lan, logger):
     :type logger: logging.LoggerAdapter
     """
     network_map = []
+    networks = inventory.get_networks(vcenter).networks
     ova_networks = ova.networks
     for network in ova_networks:
         a_map = vim.OvfManager.NetworkMapping()
         if network.lower() == 'wan':
             a_map.name = network
             try:
-                a_map.network = vcenter.networks[wan]
+                a_map.network = networks[wan]
             except KeyError:
                 error = 'No such network for WAN: {}'.format(wan)
                 raise ValueError(error)
@@ -124,7 +354,7 @@ def _create_network_map(vcenter, ova, wan, lan, logger):
         elif network.lower() == 'lan':
             a_map.name = network
             try:
-                a_map.network = vcenter.networks[lan]
+                a_map.network = networks[lan]
             except KeyError:
                 error = 'No such network for LAN: {}'.format(lan)
                 raise ValueError(error)
@@ -137,188 +367,208 @@ def _create_network_map(vcenter, ova, wan, lan, logger):
 
 
 def resolve_name(name):
-    """Resolve a DNS name into an IP address
+    """Resolve a DNS name into an IP address, reusing the last answer until it expires
 
     :Returns: String
 
     :param name: The FQDN to resolve
     :type name: String
     """
-    hostname, aliases, addr = socket.gethostbyname_ex(name)
-    return addr[0]
+    return context.DNS.lookup(name)
+
+
+def _deploy(vcenter, ova, ova_path, network_map, folder, machine_name, logger):
+    """Create a new gateway VM, per ``VLAB_GATEWAY_DEPLOY_MODE``
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param ova: The instantiated OVA object
+    :type ova: vlab_gateway_api.lib.worker.mapped_ova.MappedOva
+
+    :param ova_path: The location of the OVA file
+    :type ova_path: String
+
+    :param network_map: The mapping of OVA networks to vCenter networks
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param folder: The name of the folder to create the VM in
+    :type folder: String
+
+    :param machine_name: The name to give the new VM
+    :type machine_name: String
 
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    the_vm = None
+    if const.VLAB_GATEWAY_DEPLOY_MODE == 'clone':
+        the_vm = template.clone_gateway(vcenter, ova, ova_path, network_map,
+                                        folder, machine_name, logger)
+    if the_vm is None:
+        the_vm = virtual_machine.deploy_from_ova(vcenter, ova, network_map,
+                                                 folder, machine_name, logger)
+    return the_vm
+
+
+def reconfigure_gateway(username, logger, report=progress.no_report):
+    """Move a user's gateway to the current profile, by changing only the
+    settings that differ from what the gateway was configured with.
+
+    Settings that a service reads are applied by restarting the service; if
+    any changed setting is only read at boot, the gateway is rebooted instead.
+
+    :Returns: Dictionary - The names of the changed settings, the results of
+              every step under "setup", and if the gateway was rebooted
+
+    :Raises: ValueError if the user has no gateway, or a setting could not be changed
+
+    :param username: The user who owns the gateway
+    :type username: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
 
-def _setup_gateway(vcenter, the_vm, username, gateway_version, logger):
+    :param report: Publishes the progress of the reconfigure
+    :type report: Function
+    """
+    with SESSIONS.session() as vcenter:
+        with metrics.timed('folder_lookup'):
+            index = inventory.get(vcenter)
+            the_vm = index.find_vm(username, COMPONENT_NAME)
+        if the_vm is None:
+            raise ValueError('No gateway to reconfigure')
+        meta_data = index.meta(the_vm)
+        vlab_ip = resolve_name(context.VLAB_HOST)
+        # Always the latest profile; that's what a reconfigure is for
+        the_profile = profile.load(vlab_ip)
+        recorded = profile.recorded_or_baseline(meta_data.get('profile'), vlab_ip)
+        changed = profile.diff(recorded, the_profile.settings)
+        if not changed:
+            logger.info('Gateway already has profile {}'.format(the_profile.version))
+            return {'changed': [], 'setup': [], 'rebooted': False}
+        reboot = profile.needs_reboot(changed)
+        steps = provision.setting_steps(changed, recorded, restart=not reboot)
+        report('configure', {'steps': [x.name for x in steps]})
+        with metrics.timed('configure', logger):
+            setup_report = provision.run_steps(vcenter, the_vm, steps, logger)
+        for step in setup_report:
+            report('configure_step', step)
+        failed = [x['name'] for x in setup_report if x['exit_code'] != 0]
+        meta_data = dict(meta_data,
+                         version=the_profile.version if not failed else meta_data.get('version'),
+                         generation=meta_data.get('generation', 0) + 1,
+                         profile=_applied(recorded, changed, setup_report))
+        with metrics.timed('set_meta', logger):
+            virtual_machine.set_meta(the_vm, meta_data)
+        if reboot:
+            _reboot(vcenter, the_vm, logger, report)
+    if failed:
+        raise ValueError('Unable to change gateway setting(s): {}'.format(', '.join(failed)))
+    return {'changed': list(changed), 'setup': setup_report, 'rebooted': reboot}
+
+
+def _setup_gateway(vcenter, the_vm, username, logger, pooled=False, report=progress.no_report):
     """Initialize the new gateway for the user
 
-    :Returns: None
+    :Returns: List - The output of ``provision.run_steps``
 
     :param vcenter: The instantiated connection to vCenter
     :type vcenter: vlab_inf_common.vmware.vCenter
 
     :param the_vm: The new gateway
     :type the_vm: vim.VirtualMachine
+
+    :param pooled: Set to True if the gateway came from the warm pool, and only
+                   needs the settings that are specific to the user.
+    :type pooled: Boolean
+
+    :param report: Publishes the progress of the setup
+    :type report: Function
     """
-    time.sleep(120) # Let the VM fully boot
-    vlab_ip = resolve_name(const.VLAB_URL.replace('https://', '').replace('http://', ''))
-    cmd1 = '/usr/bin/sudo'
-    args1 = '/usr/bin/hostnamectl set-hostname {}'.format(username)
-    result1 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd1,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args1)
-    if result1.exitCode:
-        logger.error('Failed to set hostname to {}'.format(username))
-
-    # Updating hostname fixes SPAM when SSH into box about "failure to resolve <host>"
-    cmd2 = '/usr/bin/sudo'
-    args2 = "/bin/sed -i -e 's/ipam/{}/g' /etc/hosts".format(username)
-    result2 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd2,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args2)
-    if result2.exitCode:
-        logger.error('Failed to fix hostname SPAM')
-
-    # Fix the env var for the log_sender
-    cmd3 = '/usr/bin/sudo'
-    args3 = "/bin/sed -i -e 's/VLAB_LOG_TARGET=localhost:9092/VLAB_LOG_TARGET={}/g' /etc/environment".format(const.VLAB_IPAM_BROKER)
-    result3 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd3,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args3)
-    if result3.exitCode:
-        logger.error('Failed to set IPAM log-sender address')
-
-    # Set the encryption key for log_sender
-    cmd4 = '/usr/bin/sudo'
-    args4 = "/bin/sed -i -e 's/changeME/{}/g' /etc/vlab/log_sender.key".format(const.VLAB_IPAM_KEY)
-    result4 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd4,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args4)
-    if result4.exitCode:
-        logger.error('Failed to set IPAM encryption key')
-        logger.error('CMD: {} {}'.format(cmd4, args4))
-        logger.error('Result: \n{}'.format(result4))
-
-    cmd5 = '/usr/bin/sudo'
-    args5 = "/bin/sed -i -e 's/VLAB_URL=https:\/\/localhost/VLAB_URL={}/g' /etc/environment".format(const.VLAB_URL.replace('/', '\/'))
-    result5 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd5,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args5)
-    if result5.exitCode:
-        logger.error('Failed to set VLAB_URL environment variable')
-
-
-    cmd6 = '/usr/bin/sudo'
-    args6 = "/bin/sed -i -e 's/PRODUCTION=false/PRODUCTION=beta/g' /etc/environment"
-    result6 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd6,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args6)
-    if result6.exitCode:
-        logger.error('Failed to set PRODUCTION environment variable')
-
-    cmd7 = '/usr/bin/sudo'
-    args7 = "/bin/sed -i -e 's/1.us.pool.ntp.org/{}/g' /etc/chrony/chrony.conf".format(vlab_ip)
-    result7 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd7,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args7)
-    if result7.exitCode:
-        logger.error('Failed to set NTP server')
-
-    cmd8 = '/usr/bin/sudo'
-    args8 = "/bin/sed -i -e 's/VLAB_DDNS_KEY=aabbcc/VLAB_DDNS_KEY={}/g' /etc/environment".format(const.VLAB_DDNS_KEY)
-    result8 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd8,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args8)
-    if result8.exitCode:
-        logger.error('Failed to configure DDNS settings')
-
-    cmd9 = '/usr/bin/sudo'
-    args9 = "sed -i -e 's/8.8.8.8/{}/g' /etc/bind/named.conf".format(vlab_ip)
-    result9 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd9,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args9)
-    if result9.exitCode:
-        logger.error('Failed to configure DNS forwarder')
-
-    # *MUST* happen after setting up the hostname otherwise the salt-minion will
-    # use the default hostname when registering with the salt-master
-    cmd10 = '/usr/bin/sudo'
-    args10 = "/bin/systemctl enable salt-minion.service"
-    result10 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd10,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args10)
-    if result10.exitCode:
-        logger.error('Failed to enable Config Mgmt Software')
-
-
-    cmd11 = '/usr/bin/sudo'
-    args11 = "/bin/sed -i -e 's/#master: salt/master: {}/g' /etc/salt/minion".format(vlab_ip)
-    result11 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd11,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args11)
-    if result11.exitCode:
-        logger.error('Failed to configure Config Mgmt Software')
-
-
-    cmd12 = '/usr/bin/sudo'
-    args12 = "/bin/sed -i -e 's/$ActionFileDefaultTemplate RSYSLOG_TraditionalFileFormat/#$ActionFileDefaultTemplate RSYSLOG_TraditionalFileFormat/g' /etc/rsyslog.conf"
-    result12 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd12,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args12)
-    if result12.exitCode:
-        logger.error('Failed to set kern.log timestamp format')
-
-    cmd13 = '/usr/bin/sudo'
-    args13 = '/sbin/reboot'
-    result13 = virtual_machine.run_command(vcenter,
-                                          the_vm,
-                                          cmd13,
-                                          user=const.VLAB_IPAM_ADMIN,
-                                          password=const.VLAB_IPAM_ADMIN_PW,
-                                          arguments=args13,
-                                          one_shot=True)
-    if result13.exitCode:
-        logger.error('Failed to reboot IPAM server')
+    the_context = context.get(resolve_name(context.VLAB_HOST))
+    the_profile = the_context.profile
+    if pooled:
+        # The profile might have changed since the spare was configured
+        recorded = profile.recorded_or_baseline(warm_pool.applied(the_vm), the_context.vlab_ip)
+        changed = profile.diff(recorded, the_profile.settings)
+        steps = provision.user_steps(username) + provision.setting_steps(changed, recorded)
+    else:
+        report('boot_wait')
+        with metrics.timed('boot_wait', logger):
+            readiness.wait_for_guest(the_vm, logger)
+        recorded = {}
+        changed = the_profile.settings
+        steps = provision.user_steps(username) + list(the_context.common_steps)
+    report('configure', {'steps': [x.name for x in steps]})
+    with metrics.timed('configure', logger):
+        setup_report = provision.run_steps(vcenter, the_vm, steps, logger)
+    for step in setup_report:
+        # The steps run as one script in the guest, so they're reported once it's done
+        report('configure_step', step)
 
     meta_data = {'component': 'defaultGateway',
                  'created': time.time(),
-                 'version': gateway_version,
+                 'version': the_profile.version,
                  'configured': True,
-                 'generation': 1}
-    virtual_machine.set_meta(the_vm, meta_data)
-    time.sleep(60) # Give the box time to power cycles
+                 'generation': 1,
+                 'profile': _applied(recorded, changed, setup_report)}
+    with metrics.timed('set_meta', logger):
+        virtual_machine.set_meta(the_vm, meta_data)
+    _reboot(vcenter, the_vm, logger, report)
+    return setup_report
+
+
+def _reboot(vcenter, the_vm, logger, report):
+    """Reboot a gateway, and wait for it to come back
+
+    :Returns: None
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param the_vm: The gateway to reboot
+    :type the_vm: vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param report: Publishes the progress of the reboot
+    :type report: Function
+    """
+    with metrics.timed('run_command', logger):
+        result = virtual_machine.run_command(vcenter,
+                                             the_vm,
+                                             '/usr/bin/sudo',
+                                             user=const.VLAB_IPAM_ADMIN,
+                                             password=const.VLAB_IPAM_ADMIN_PW,
+                                             arguments='/sbin/reboot',
+                                             one_shot=True)
+    report('reboot')
+    if result.exitCode:
+        logger.error('Failed to reboot IPAM server')
+    report('reboot_wait')
+    with metrics.timed('reboot_wait', logger):
+        readiness.wait_for_reboot(the_vm, logger)
+
+
+def _applied(recorded, settings, setup_report):
+    """Work out which settings a gateway has, once some were changed
+
+    :Returns: Dictionary - Like ``profile.record``
+
+    :param recorded: The settings the gateway had before
+    :type recorded: Dictionary
+
+    :param settings: The settings that were changed, and their new values
+    :type settings: Dictionary
+
+    :param setup_report: The output of ``provision.run_steps``
+    :type setup_report: List
+    """
+    worked = {x['name'] for x in setup_report if x['exit_code'] == 0}
+    applied = dict(recorded)
+    applied.update(profile.record({x: settings[x] for x in settings if x in worked}))
+    return applied
@@ -0,0 +1,184 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of spare gateways that are deployed, booted, and have the settings
+common to every user already configured.
+
+Spare gateways live in ``VLAB_GATEWAY_POOL_DIR``, connected to
+``VLAB_GATEWAY_POOL_WAN`` and ``VLAB_GATEWAY_POOL_LAN``. Their state is kept in
+the VM annotation, and claiming one is a compare-and-swap on the VM config
+``changeVersion``, so two workers can never claim the same spare. A spare
+that cannot be handed to the user once claimed, or that fails to boot or be
+configured while the pool is refilled, is destroyed instead of being left in
+the pool forever; the next refill replaces it.
+"""
+import time
+import uuid
+
+import ujson
+from vlab_inf_common.vmware import vim, consume_task
+
+from vlab_gateway_api.lib import const
+from vlab_gateway_api.lib.worker import vm_utils
+
+
+POOL_COMPONENT = 'gatewayPool'
+READY = 'ready'
+CLAIMED = 'claimed'
+
+
+def spare_name():
+    """Create a unique name for a new spare gateway
+
+    :Returns: String
+    """
+    return 'spare-{}'.format(uuid.uuid4().hex[:12])
+
+
+def missing(vcenter):
+    """Determine how many spare gateways need to be created to fill the pool.
+
+    Spares that are claimed, but not yet moved to the user, don't count; spares
+    that are still being deployed do.
+
+    :Returns: Integer
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+    """
+    folder = vm_utils.ensure_folder(vcenter, const.VLAB_GATEWAY_POOL_DIR)
+    spares = [x for x in folder.childEntity if _meta(x.config).get('pool') != CLAIMED]
+    return max(const.VLAB_GATEWAY_POOL_SIZE - len(spares), 0)
+
+
+def mark_ready(the_vm, network_map, image_name, applied=None):
+    """Put a newly configured spare gateway into the pool
+
+    :Returns: None
+
+    :param the_vm: The spare gateway
+    :type the_vm: vim.VirtualMachine
+
+    :param network_map: The networks the spare was deployed with
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param image_name: The OVA the spare was deployed from
+    :type image_name: String
+
+    :param applied: The gateway profile settings the spare has, from ``profile.record``
+    :type applied: Dictionary
+    """
+    meta_data = {'component': POOL_COMPONENT,
+                 'created': time.time(),
+                 'version': 'Unknown',
+                 'configured': False,
+                 'generation': 0,
+                 'pool': READY,
+                 'image': image_name,
+                 'nics': vm_utils.nic_labels(the_vm, network_map),
+                 'profile': applied or {}}
+    consume_task(the_vm.ReconfigVM_Task(vim.vm.ConfigSpec(annotation=ujson.dumps(meta_data))))
+
+
+def claim(vcenter, username, machine_name, network_map, image_name, logger):
+    """Take a spare gateway out of the pool, and give it to a user
+
+    :Returns: vim.VirtualMachine, or None if the pool has no spares
+
+    :param vcenter: The instantiated connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vCenter
+
+    :param username: The user who wants a gateway
+    :type username: String
+
+    :param machine_name: The name to give the gateway
+    :type machine_name: String
+
+    :param network_map: The networks the user's gateway connects to
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param image_name: The OVA the user's gateway must be from
+    :type image_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    pool_folder = vm_utils.ensure_folder(vcenter, const.VLAB_GATEWAY_POOL_DIR)
+    for spare in pool_folder.childEntity:
+        config = spare.config
+        meta_data = _meta(config)
+        if meta_data.get('pool') != READY or meta_data.get('image') != image_name:
+            continue
+        meta_data['pool'] = CLAIMED
+        # Connecting to the user's networks with the same reconfigure makes the
+        # claim, and the network change, a single atomic operation.
+        spec = vim.vm.ConfigSpec(changeVersion=config.changeVersion,
+                                 annotation=ujson.dumps(meta_data),
+                                 deviceChange=vm_utils.nic_changes(spare, meta_data['nics'], network_map))
+        try:
+            consume_task(spare.ReconfigVM_Task(spec))
+        except RuntimeError:
+            # Another worker claimed it first
+            logger.debug('Lost race to claim spare gateway {}'.format(spare.name))
+            continue
+        logger.info('Claimed spare gateway {}'.format(spare.name))
+        try:
+            user_folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+            consume_task(user_folder.MoveIntoFolder_Task([spare]))
+            consume_task(spare.Rename_Task(machine_name))
+        except Exception:
+            # It's connected to the user's networks, so it cannot go back in the pool
+            logger.error('Unable to hand spare gateway {} to {}'.format(spare.name, username))
+            discard(spare, logger)
+            raise
+        return spare
+    return None
+
+
+def applied(the_vm):
+    """Obtain the gateway profile settings a (claimed) spare was configured with
+
+    :Returns: Dictionary, or None if the spare was configured before profiles were recorded
+
+    :param the_vm: The spare gateway
+    :type the_vm: vim.VirtualMachine
+    """
+    return _meta(the_vm.config).get('profile')
+
+
+def discard(the_vm, logger):
+    """Destroy a spare that cannot be put in, or handed out of, the pool
+
+    :Returns: None
+
+    :param the_vm: The spare gateway
+    :type the_vm: vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    try:
+        consume_task(the_vm.PowerOffVM_Task())
+    except (vim.fault.InvalidPowerState, RuntimeError):
+        # Already off, or Destroy_Task will say why not
+        pass
+    try:
+        consume_task(the_vm.Destroy_Task())
+    except Exception as doh:
+        logger.exception('Unable to destroy spare gateway {}: {}'.format(the_vm.name, doh))
+
+
+def _meta(config):
+    """Read the pool state out of a VM annotation
+
+    :Returns: Dictionary
+
+    :param config: The config of the VM
+    :type config: vim.vm.ConfigInfo
+    """
+    if config is None:
+        # Still being deployed
+        return {}
+    try:
+        return ujson.loads(config.annotation)
+    except (ValueError, TypeError):
+        return {}